@@ -0,0 +1,512 @@
+import os
+import time
+import uuid
+import asyncio
+import functools
+import contextvars
+import logging as log
+
+from galaxy_session import input_dataset_ids
+from invocation_watcher import InvocationWatcher, WorkflowFailedError
+from result_cache import cacheable_dir
+from run_metrics import RunMetrics
+
+
+async def run_blocking(func, *args, **kwargs):
+    """
+    Run a blocking bioblend call in the default executor so the event loop is
+    only held up for the length of the HTTP request, not the whole run. The
+    call runs in a copy of the caller's context so its requests are
+    recorded against the run being timed
+
+    Args:
+        func (callable): Blocking function to call
+        *args, **kwargs: Arguments for func
+
+    Returns:
+        The return value of func
+    """
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(
+        None,
+        functools.partial(contextvars.copy_context().run, func, *args, **kwargs)
+    )
+
+
+class InvocationHandle:
+    """
+    Handle on a running workflow invocation, returned by
+    launch_workflow_async as soon as the workflow has been invoked
+
+    The handle does not hold a thread while the workflow runs, wait() and
+    events() poll the galaxy server from the event loop (with the adaptive
+    backoff of InvocationWatcher) so one loop can supervise many
+    invocations at once.
+
+    Args:
+        session (GalaxySession): Session the workflow was launched with
+        invocation (dict): Invocation as returned by invoke_workflow
+        launch (dict): Prepared launch returned by prepare_launch
+        poll_interval (float): Shortest time in seconds between polls of the
+            server, the interval grows while nothing changes
+        max_poll_interval (float): Longest time in seconds between polls
+        on_change (callable): Called with each step change event, see
+            InvocationWatcher
+        result_key (string): If given, the outputs saved by
+            download_outputs are stored in the session result cache, as
+            long as they are the result_outputs the key was built for and
+            are not saved in the temporary directory
+        result_outputs (array of strings): Names of the outputs result_key
+            was built for, None for every output
+        metrics (RunMetrics): Timing breakdown of the run so far, carried on
+            through the wait and download, saved as run_metrics.json with
+            the outputs and passed to the session on_metrics hook
+        shared_history (bool): If true, the history also holds other runs
+            (e.g. the points of a sweep) and only the datasets made by this
+            invocation are downloaded
+    """
+
+    cached = False
+
+    def __init__(
+        self,
+        session,
+        invocation,
+        launch,
+        poll_interval=1.0,
+        max_poll_interval=30.0,
+        on_change=None,
+        result_key=None,
+        result_outputs=None,
+        metrics=None,
+        shared_history=False
+    ):
+        self.session = session
+        self.result_key = result_key
+        self.result_outputs = result_outputs
+        self.shared_history = shared_history
+        self.invocation_id = invocation['id']
+        self.history_id = launch['history_id']
+        self.workflow_id = launch['workflow_id']
+        self.uid = launch['uid']
+        self.input_ids = input_dataset_ids(launch)
+
+        if metrics is None:
+            metrics = RunMetrics(uid=self.uid)
+        self.metrics = metrics
+        self.metrics.invocation_id = self.invocation_id
+        self.metrics.history_id = self.history_id
+        self._on_change = on_change
+
+        self.watcher = InvocationWatcher(
+            session,
+            self.invocation_id,
+            on_change=self._step_changed,
+            min_interval=poll_interval,
+            max_interval=max_poll_interval
+        )
+        self._cancelled = False
+        self._updated = time.time()
+        self._reported = False
+
+    def _step_changed(self, event):
+        self.metrics.on_step_change(event)
+        if self._on_change is not None:
+            self._on_change(event)
+
+    async def _report(self, state, dest_dir=None):
+        """Finish the run metrics once, returning the saved file if any"""
+        if self._reported:
+            return None
+        self._reported = True
+        return await run_blocking(
+            self.session.report_metrics,
+            self.metrics,
+            self.watcher,
+            state,
+            dest_dir
+        )
+
+    def status(self):
+        """
+        Snapshot of the last known state of the invocation, this does not
+        talk to the server
+
+        Returns:
+            status (dict): format: {'invocation_id': id, 'history_id': id,
+                'uid': uid, 'state': 'running' / 'ok' / 'error' /
+                'cancelled', 'invocation_state': state,
+                'steps': [{'order_index': n, 'label': label,
+                'job_id': id, 'state': state}, ...], 'updated': timestamp}
+        """
+        if self._cancelled or self.watcher.invocation_state == 'cancelled':
+            state = 'cancelled'
+        elif self.watcher.failed:
+            state = 'error'
+        elif self.watcher.done:
+            state = 'ok'
+        else:
+            state = 'running'
+
+        return {
+            'invocation_id': self.invocation_id,
+            'history_id': self.history_id,
+            'uid': self.uid,
+            'state': state,
+            'invocation_state': self.watcher.invocation_state,
+            'steps': [
+                dict(step) for _, step in sorted(
+                    self.watcher.steps.items(),
+                    key=lambda item: -1 if item[0] is None else item[0]
+                )
+            ],
+            'updated': self._updated,
+        }
+
+    @property
+    def done(self):
+        """True once the invocation and the jobs of every step are terminal"""
+        return self._cancelled or self.watcher.done
+
+    async def refresh(self):
+        """
+        Poll the server once and update the state of every step
+
+        Returns:
+            events (array of dicts): Step changes since the last poll, see
+                InvocationWatcher
+        """
+        events = await run_blocking(self.watcher.poll)
+        self._updated = time.time()
+        return events
+
+    async def events(self):
+        """
+        Async iterator over the step changes of the invocation, finishing
+        once the whole workflow is terminal
+
+        Yields:
+            event (dict): Step change, see InvocationWatcher
+
+        Raises:
+            WorkflowFailedError once the events are exhausted if the
+                invocation or any step failed
+        """
+        with self.metrics.phase('wait'):
+            while True:
+                for event in await self.refresh():
+                    yield event
+                if self.done:
+                    break
+                await asyncio.sleep(self.watcher.interval)
+        if not self._cancelled:
+            await self._check()
+
+    async def _check(self):
+        try:
+            self.watcher.check()
+        except WorkflowFailedError:
+            await self._report('error')
+            raise
+
+    async def wait(self, timeout=None):
+        """
+        Wait for the invocation and the jobs of every step to finish
+
+        Args:
+            timeout (float): Maximum seconds to wait, None to wait
+                indefinitely
+
+        Returns:
+            status (dict): See status()
+
+        Raises:
+            WorkflowFailedError if the invocation or any step failed, unless
+                it was cancelled with cancel()
+            asyncio.TimeoutError if the invocation is not finished in time
+        """
+        start = time.time()
+        with self.metrics.phase('wait'):
+            while True:
+                await self.refresh()
+                if self.done:
+                    break
+                if timeout is not None and time.time() - start > timeout:
+                    raise asyncio.TimeoutError(
+                        f"Invocation {self.invocation_id} did not finish within {timeout} seconds"
+                    )
+                await asyncio.sleep(self.watcher.interval)
+        # A cancel asked for through cancel() is not a failure
+        if not self._cancelled:
+            await self._check()
+        return self.status()
+
+    async def cancel(self):
+        """
+        Cancel the invocation and any of its jobs that have not finished
+
+        Returns:
+            status (dict): See status()
+        """
+        await run_blocking(
+            self.session.gi.invocations.cancel_invocation, self.invocation_id
+        )
+        self._cancelled = True
+        self._updated = time.time()
+        await self._report('cancelled')
+        return self.status()
+
+    async def finish(self, delete_history=False):
+        """
+        Finish a run whose outputs are not downloaded: report its run
+        metrics (to the on_metrics hook, nothing is saved) and optionally
+        delete its history
+
+        Args:
+            delete_history (bool): If true, delete the history of the run
+                from the server
+        """
+        if delete_history:
+            with self.metrics.phase('cleanup'):
+                await run_blocking(
+                    self.session.gi.histories.delete_history,
+                    history_id=self.history_id
+                )
+        await self._report('ok')
+
+    async def download_outputs(
+        self,
+        dest_dir,
+        outputs=None,
+        delete_history=False
+    ):
+        """
+        Download the outputs of the run and its biocompute object straight
+        into dest_dir, the uploaded inputs are not downloaded
+
+        Args:
+            dest_dir (string): Directory to save the files in, created if
+                it does not exist
+            outputs (array of strings): Names of the outputs to download,
+                None for every output of the run
+            delete_history (bool): If true, delete the history of the run
+                from the server once the files are saved
+
+        Returns:
+            files (array of strings): Paths of the saved files, including
+                the run metrics
+        """
+        os.makedirs(dest_dir, exist_ok=True)
+        with self.metrics.phase('download'):
+            files = await run_blocking(
+                self.session.download_outputs,
+                self.history_id,
+                self.invocation_id,
+                dest_dir,
+                outputs=outputs,
+                exclude_ids=self.input_ids,
+                invocation_only=self.shared_history
+            )
+        if delete_history:
+            with self.metrics.phase('cleanup'):
+                await run_blocking(
+                    self.session.gi.histories.delete_history,
+                    history_id=self.history_id
+                )
+
+        metrics_file = await self._report('ok', dest_dir)
+        if metrics_file is not None:
+            files.append(metrics_file)
+
+        if self.result_key is not None:
+            self._cache_outputs(dest_dir, outputs, files)
+        return files
+
+    def _cache_outputs(self, dest_dir, outputs, files):
+        """
+        Store the downloaded outputs in the session result cache, unless
+        they are not the outputs the cache key stands for or are saved in
+        the temporary directory (the same rule as launch_workflow)
+        """
+        if _output_set(outputs) != _output_set(self.result_outputs):
+            log.info(
+                f"Outputs {outputs} of invocation {self.invocation_id} are not "
+                f"the {self.result_outputs} it was launched for, not cached"
+            )
+            return
+        if not cacheable_dir(dest_dir):
+            log.info(f"Outputs in temporary directory {dest_dir} are not cached")
+            return
+        self.session.result_cache.put(
+            self.result_key,
+            dest_dir,
+            files,
+            invocation_id=self.invocation_id
+        )
+
+
+def _output_set(outputs):
+    return None if outputs is None else frozenset(outputs)
+
+
+class CachedResult:
+    """
+    Stand-in for an InvocationHandle returned by launch_workflow_async when
+    the outputs of the run are already in the session result cache, the
+    workflow is not launched again
+
+    Args:
+        entry (dict): Result cache entry, see ResultCache.get
+        uid (string): Unique identifier given for the workflow run
+    """
+
+    cached = True
+    done = True
+
+    def __init__(self, entry, uid=None):
+        self.invocation_id = entry['invocation_id']
+        self.history_id = None
+        self.uid = uid
+        self.output_dir = entry['dir']
+        self.files = entry['files']
+
+    def status(self):
+        """
+        Returns:
+            status (dict): See InvocationHandle.status, with 'cached': True
+        """
+        return {
+            'invocation_id': self.invocation_id,
+            'history_id': None,
+            'uid': self.uid,
+            'state': 'ok',
+            'invocation_state': 'scheduled',
+            'steps': [],
+            'updated': time.time(),
+            'cached': True,
+        }
+
+    async def refresh(self):
+        return []
+
+    async def events(self):
+        return
+        yield
+
+    async def wait(self, timeout=None):
+        return self.status()
+
+    async def cancel(self):
+        return self.status()
+
+    async def download_outputs(
+        self,
+        dest_dir=None,
+        outputs=None,
+        delete_history=False
+    ):
+        """
+        Returns:
+            files (array of strings): Paths of the cached files, these are
+                left where they are rather than copied to dest_dir
+        """
+        return list(self.files)
+
+    async def finish(self, delete_history=False):
+        return
+
+
+def _prepare_and_invoke(
+    session,
+    workflow_name,
+    inputs,
+    uid,
+    outputs,
+    use_cache,
+    metrics
+):
+    key = None
+    with metrics.phase('validate'):
+        if not session.check_workflow(workflow_name):
+            return False, False, None
+        if use_cache:
+            key = session.result_key(workflow_name, inputs, outputs=outputs)
+            cached = session.result_cache.get(key)
+            if cached is not None:
+                return cached, None, key
+
+    with metrics.phase('upload'):
+        launch = session.prepare_launch(workflow_name, inputs, uid=uid)
+    if launch is False:
+        return False, False, None
+    with metrics.phase('invoke'):
+        invocation = session.invoke(launch)
+    return launch, invocation, key
+
+
+async def launch_workflow_async(
+    session,
+    workflow_name,
+    inputs,
+    uid=None,
+    poll_interval=1.0,
+    on_change=None,
+    outputs=None,
+    use_cache=True
+):
+    """
+    Function to launch a galaxy workflow without blocking the event loop,
+    returning as soon as the workflow has been invoked. The timing of the
+    run is recorded on the handle, see InvocationHandle.metrics
+
+    Args:
+        session (GalaxySession): Session for the galaxy instance
+        workflow_name (string): Target workflow name
+        inputs (dict): Dictionary of inputs for the workflow, these should
+            be named the same as the inputs in the workflow
+            format: {input_name: input_string/filename, ...}
+        uid (string): Unique identifier for the workflow run
+        poll_interval (float): Shortest time in seconds between polls of
+            the server while waiting on the invocation
+        on_change (callable): Called with each step change event, see
+            InvocationWatcher
+        outputs (array of strings): Names of the outputs that will be
+            downloaded, part of the result cache key
+        use_cache (bool): If true, an earlier run of the same workflow
+            version with the same inputs is returned as a CachedResult and
+            the outputs downloaded through the handle are cached (if they
+            are these outputs and are not saved in the temporary
+            directory). Set to False to always run the workflow
+
+    Returns:
+        handle (InvocationHandle): Handle on the running invocation
+        handle (CachedResult): Outputs of an earlier identical run
+        False if workflow failed to launch
+    """
+    if uid is None:
+        uid = str(uuid.uuid4())
+    metrics = RunMetrics(workflow_name, uid)
+    launch, invocation, key = await run_blocking(
+        _prepare_and_invoke,
+        session,
+        workflow_name,
+        inputs,
+        uid,
+        outputs,
+        use_cache,
+        metrics
+    )
+    if launch is False:
+        return False
+    if invocation is None:
+        return CachedResult(launch, uid=uid)
+    return InvocationHandle(
+        session,
+        invocation,
+        launch,
+        poll_interval=poll_interval,
+        on_change=on_change,
+        result_key=key,
+        result_outputs=outputs,
+        metrics=metrics
+    )
@@ -0,0 +1,238 @@
+"""
+Benchmark suite for GalaxySession / helper_functs against a local stand-in
+of the galaxy API (mock_galaxy.py), no galaxy instance is needed.
+
+Measures the latency and API request count of a full launch, upload and
+download throughput, and how the async launcher scales with the number of
+workflows launched at the same time. The results are written as JSON so
+runs can be compared over time.
+
+Usage:
+    python bench_galaxy.py --latency 0.005 --launches 5 --concurrency 1 4 16 --output bench.json
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import platform
+import statistics
+import subprocess
+import tempfile
+
+from async_launch import launch_workflow_async
+from galaxy_session import GalaxySession, input_dataset_ids
+from mock_galaxy import GalaxyStubServer
+
+parser = argparse.ArgumentParser(
+    prog="bench_galaxy.py",
+    description="Benchmark the galaxy client against a local stand-in galaxy server",
+)
+parser.add_argument("--latency", type=float, default=0.005, help="Seconds of latency added per request")
+parser.add_argument("--run-seconds", type=float, default=0.5, help="Seconds each workflow job runs for")
+parser.add_argument("--queue-seconds", type=float, default=0.0, help="Seconds each workflow job is queued for")
+parser.add_argument("--launches", type=int, default=5, help="Sequential launches timed for the latency figures")
+parser.add_argument("--input-mb", type=int, default=8, help="Size of the CAD input file")
+parser.add_argument("--output-mb", type=int, default=16, help="Size of each workflow output")
+parser.add_argument("--upload-mb", type=int, nargs="+", default=[1, 32, 128], help="File sizes for the upload throughput")
+parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16], help="Concurrent launches to test")
+parser.add_argument("--output", default=None, help="JSON file to write the results to")
+
+args = parser.parse_args()
+
+MB = 1024 * 1024
+
+
+def write_file(file_path, size):
+    with open(file_path, "wb") as f_write:
+        for _ in range(size // MB):
+            f_write.write(os.urandom(MB))
+        f_write.write(os.urandom(size % MB))
+    return file_path
+
+
+def summary(values):
+    values = sorted(values)
+    return {
+        "mean": statistics.mean(values),
+        "p50": values[len(values) // 2],
+        "p95": values[min(len(values) - 1, int(len(values) * 0.95))],
+        "min": values[0],
+        "max": values[-1],
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL,
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def new_session(server):
+    # Inputs are always uploaded so the figures stay comparable with runs from
+    # before input deduplication, the same CAD file is used for every launch
+    return GalaxySession(server.url, "bench-key", pool_size=32, deduplicate=False)
+
+
+def bench_launch(server, workdir, cad_file):
+    """Sequential launches, each with new inputs so nothing is reused"""
+    session = new_session(server)
+    session.validate()
+    latencies = []
+    requests = []
+    routes = {}
+    for i in range(args.launches):
+        server.state.reset_counts()
+        session.reset_request_count()
+        start = time.perf_counter()
+        session.launch_workflow(
+            "openmc_workflow",
+            {"CAD": cad_file, "Config": json.dumps({"run": i})},
+            from_omni=True,
+            output_dir=os.path.join(workdir, f"launch_{i}"),
+            use_cache=False,
+        )
+        latencies.append(time.perf_counter() - start)
+        requests.append(session.reset_request_count())
+        for route, count in server.state.reset_counts().items():
+            routes[route] = routes.get(route, 0) + count
+    session.close()
+    return {
+        "seconds": summary(latencies),
+        # The job itself runs for queue + run seconds of that
+        "overhead_seconds": summary(
+            [latency - args.queue_seconds - args.run_seconds for latency in latencies]
+        ),
+        "requests_per_launch": summary(requests),
+        "requests_by_route": {
+            route: count / args.launches for route, count in sorted(routes.items())
+        },
+    }
+
+
+def bench_uploads(server, workdir):
+    session = new_session(server)
+    session.validate()
+    history_id = session.gi.histories.create_history(name="bench_uploads")["id"]
+    results = []
+    for size_mb in args.upload_mb:
+        file_path = write_file(os.path.join(workdir, f"upload_{size_mb}.bin"), size_mb * MB)
+        session.reset_request_count()
+        start = time.perf_counter()
+        session.upload_file(file_path, history_id)
+        elapsed = time.perf_counter() - start
+        results.append({
+            "size_mb": size_mb,
+            "tus": session.tus_threshold is not None and size_mb * MB >= session.tus_threshold,
+            "seconds": elapsed,
+            "mb_per_s": size_mb / elapsed,
+            "requests": session.reset_request_count(),
+        })
+        os.remove(file_path)
+    session.close()
+    return results
+
+
+def bench_download(server, workdir, cad_file):
+    session = new_session(server)
+    session.validate()
+    launch = session.prepare_launch(
+        "openmc_workflow", {"CAD": cad_file, "Config": "{}"}
+    )
+    invocation_id = session.invoke(launch)["id"]
+    time.sleep(args.queue_seconds + args.run_seconds)
+
+    dest_dir = os.path.join(workdir, "download")
+    os.makedirs(dest_dir)
+    session.reset_request_count()
+    start = time.perf_counter()
+    files = session.download_outputs(
+        launch["history_id"],
+        invocation_id,
+        dest_dir,
+        exclude_ids=input_dataset_ids(launch),
+    )
+    elapsed = time.perf_counter() - start
+    size_mb = sum(os.path.getsize(file_path) for file_path in files) / MB
+    session.close()
+    return {
+        "files": len(files),
+        "size_mb": size_mb,
+        "seconds": elapsed,
+        "mb_per_s": size_mb / elapsed,
+        "requests": session.request_count,
+    }
+
+
+async def concurrent_launches(session, workdir, cad_file, count):
+    async def one(i):
+        start = time.perf_counter()
+        handle = await launch_workflow_async(
+            session,
+            "openmc_workflow",
+            {"CAD": cad_file, "Config": json.dumps({"run": i, "count": count})},
+            poll_interval=0.1,
+            use_cache=False,
+        )
+        await handle.wait()
+        await handle.download_outputs(
+            os.path.join(workdir, f"concurrent_{count}_{i}"), delete_history=True
+        )
+        return time.perf_counter() - start
+
+    return await asyncio.gather(*(one(i) for i in range(count)))
+
+
+def bench_concurrency(server, workdir, cad_file):
+    results = []
+    for count in args.concurrency:
+        session = new_session(server)
+        session.validate()
+        session.reset_request_count()
+        start = time.perf_counter()
+        latencies = asyncio.run(concurrent_launches(session, workdir, cad_file, count))
+        elapsed = time.perf_counter() - start
+        results.append({
+            "concurrent_launches": count,
+            "wall_seconds": elapsed,
+            "launches_per_s": count / elapsed,
+            "launch_seconds": summary(latencies),
+            "requests": session.request_count,
+        })
+        session.close()
+    return results
+
+
+results = {
+    "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    "commit": git_commit(),
+    "python": sys.version.split()[0],
+    "platform": platform.platform(),
+    "parameters": vars(args),
+}
+
+with tempfile.TemporaryDirectory() as workdir:
+    cad_file = write_file(os.path.join(workdir, "dagmc.h5m"), args.input_mb * MB)
+    with GalaxyStubServer(
+        latency=args.latency,
+        output_size=args.output_mb * MB,
+        queue_seconds=args.queue_seconds,
+        run_seconds=args.run_seconds,
+    ) as server:
+        results["launch"] = bench_launch(server, workdir, cad_file)
+        results["upload"] = bench_uploads(server, workdir)
+        results["download"] = bench_download(server, workdir, cad_file)
+        results["concurrency"] = bench_concurrency(server, workdir, cad_file)
+
+output = json.dumps(results, indent=4)
+if args.output is not None:
+    with open(args.output, "w") as f_write:
+        f_write.write(output)
+print(output)
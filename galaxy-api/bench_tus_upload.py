@@ -0,0 +1,98 @@
+"""
+Throughput benchmark of the resumable tus uploads against a local stand-in
+tus server (mock_tus.py), no galaxy instance is needed.
+
+Times uploads of a generated file for each combination of chunk size and
+number of parallel parts, checks the file on the server matches, and
+measures how much is sent again when an interrupted upload is resumed.
+
+Usage:
+    python bench_tus_upload.py --size-mb 256 --chunk-mb 4 16 --parallel 1 2 4
+"""
+
+import os
+import json
+import time
+import argparse
+import tempfile
+
+import requests
+
+from input_index import file_sha256
+from mock_tus import TusStubServer
+from tus_upload import TusUploader, TusUploadError
+
+parser = argparse.ArgumentParser(
+    prog="bench_tus_upload.py",
+    description="Benchmark resumable chunked uploads against a local tus server",
+)
+parser.add_argument("--size-mb", type=int, default=256, help="Size of the test file")
+parser.add_argument("--chunk-mb", type=int, nargs="+", default=[4, 16], help="Chunk sizes to test")
+parser.add_argument("--parallel", type=int, nargs="+", default=[1, 2, 4], help="Parallel parts to test")
+parser.add_argument("--latency", type=float, default=0.0, help="Seconds of latency added per request")
+
+args = parser.parse_args()
+
+MB = 1024 * 1024
+
+results = {"size_mb": args.size_mb, "runs": [], "resume": None}
+
+with tempfile.TemporaryDirectory() as workdir:
+    file_path = os.path.join(workdir, "geometry.h5m")
+    with open(file_path, "wb") as f_write:
+        for _ in range(args.size_mb):
+            f_write.write(os.urandom(MB))
+    digest = file_sha256(file_path)
+
+    for chunk_mb in args.chunk_mb:
+        for parallel in args.parallel:
+            with TusStubServer(latency=args.latency) as server:
+                uploader = TusUploader(
+                    requests.Session(),
+                    server.url,
+                    chunk_size=chunk_mb * MB,
+                    parallel_chunks=parallel,
+                )
+                start = time.perf_counter()
+                upload_id = uploader.upload(file_path)
+                elapsed = time.perf_counter() - start
+                matches = file_sha256(server.store.file_path(upload_id)) == digest
+                results["runs"].append({
+                    "chunk_mb": chunk_mb,
+                    "parallel_chunks": parallel,
+                    "seconds": elapsed,
+                    "mb_per_s": args.size_mb / elapsed,
+                    "requests": server.store.patch_count,
+                    "checksum_ok": matches,
+                })
+
+    # Drop the connection half way through, then resume from the saved state
+    chunk_mb = args.chunk_mb[0]
+    state_file = os.path.join(workdir, "tus_state.json")
+    total_chunks = -(-args.size_mb // chunk_mb)
+    with TusStubServer(fail_after=total_chunks // 2) as server:
+        uploader = TusUploader(
+            requests.Session(),
+            server.url,
+            chunk_size=chunk_mb * MB,
+            parallel_chunks=1,
+            state_file=state_file,
+        )
+        try:
+            uploader.upload(file_path)
+        except TusUploadError:
+            pass
+        sent_before_drop = server.store.bytes_received
+
+        server.store.fail_after = None
+        start = time.perf_counter()
+        upload_id = uploader.upload(file_path)
+        elapsed = time.perf_counter() - start
+        results["resume"] = {
+            "mb_before_drop": sent_before_drop / MB,
+            "mb_sent_on_resume": (server.store.bytes_received - sent_before_drop) / MB,
+            "resume_seconds": elapsed,
+            "checksum_ok": file_sha256(server.store.file_path(upload_id)) == digest,
+        }
+
+print(json.dumps(results, indent=4))
@@ -0,0 +1,75 @@
+"""
+Benchmark of the dataset uploads of a workflow launch, comparing one upload
+at a time with parallel uploads.
+
+Only the upload phase of the launch is timed (history creation and uploads),
+the workflow is not invoked and the histories are deleted afterwards.
+
+Usage:
+    python bench_uploads.py <server> <api_key> <workflow_name>
+        --input CAD=../test_files/dagmc.h5m
+        --input JSON_Config=../test_files/openmc_config.json
+"""
+
+import time
+import json
+import argparse
+import statistics
+
+from galaxy_session import GalaxySession
+
+parser = argparse.ArgumentParser(
+    prog="bench_uploads.py",
+    description="Time the dataset uploads of a workflow launch with different numbers of upload workers",
+)
+parser.add_argument("server", help="Galaxy server address")
+parser.add_argument("api_key", help="Galaxy API key")
+parser.add_argument("workflow_name", help="Workflow to prepare launches for")
+parser.add_argument(
+    "--input",
+    action="append",
+    default=[],
+    help="Workflow input as name=file_path/string, can be given multiple times",
+)
+parser.add_argument(
+    "--workers",
+    type=int,
+    nargs="+",
+    default=[1, 4],
+    help="Numbers of upload workers to compare, 1 is the sequential baseline",
+)
+parser.add_argument("--repeats", type=int, default=3, help="Launches per setting")
+
+args = parser.parse_args()
+
+inputs = dict(item.split("=", 1) for item in args.input)
+
+results = {}
+for workers in args.workers:
+    # Without deduplicate every repeat after the first would time dataset
+    # copies of the already uploaded inputs instead of uploads
+    session = GalaxySession(
+        args.server, args.api_key, upload_workers=workers, deduplicate=False
+    )
+    if not session.validate():
+        raise SystemExit("Server address or API key is not valid")
+    # Warm the workflow metadata so only the uploads are timed
+    session.get_inputs(args.workflow_name)
+
+    times = []
+    for _ in range(args.repeats):
+        start = time.perf_counter()
+        launch = session.prepare_launch(args.workflow_name, inputs)
+        times.append(time.perf_counter() - start)
+        if launch is False:
+            raise SystemExit("Could not prepare the launch, check the inputs")
+        session.gi.histories.delete_history(launch["history_id"], purge=True)
+
+    results[workers] = {
+        "mean_s": statistics.mean(times),
+        "min_s": min(times),
+        "max_s": max(times),
+    }
+    session.close()
+
+print(json.dumps(results, indent=4))
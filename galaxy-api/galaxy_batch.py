@@ -0,0 +1,329 @@
+"""
+Command line entry point for running galaxy workflows without the Omniverse
+extension, e.g. from render-farm nodes or CI.
+
+Runs every launch in a manifest against a galaxy instance, with at most
+--parallel workflows running at once, printing each step change as it
+happens and a throughput / latency summary at the end.
+
+A JSON manifest is a list of runs, or an object with a default "workflow"
+and "outputs" and a list of "runs":
+    {"workflow": "openmc_workflow", "runs": [
+        {"uid": "run_1", "inputs": {"CAD": "dagmc.h5m", "JSON_Config": "config_1.json"}},
+        {"inputs": {"CAD": "dagmc.h5m", "JSON_Config": "config_2.json"}, "outputs": ["TBR"]}
+    ]}
+A CSV manifest has one run per row and one column per workflow input, with
+optional "workflow" and "uid" columns. Relative file paths in either are
+taken from the directory of the manifest.
+
+Usage:
+    python galaxy_batch.py --server localhost:8080 --api-key <key> workflows
+    python galaxy_batch.py --server localhost:8080 --api-key <key> inputs <workflow>
+    python galaxy_batch.py --server localhost:8080 --api-key <key> run manifest.json
+        --workflow openmc_workflow --parallel 8 --output-dir runs --summary summary.json
+"""
+
+import os
+import sys
+import csv
+import json
+import time
+import uuid
+import asyncio
+import argparse
+import statistics
+import logging as log
+
+from async_launch import launch_workflow_async
+from helper_functs import get_session, set_cache_dir
+from invocation_watcher import WorkflowFailedError
+
+RESERVED_COLUMNS = ('workflow', 'uid', 'outputs')
+
+
+def read_manifest(manifest_file, workflow=None, outputs=None):
+    """
+    Function to read the runs of a JSON or CSV manifest
+
+    Args:
+        manifest_file (string): Path of the manifest
+        workflow (string): Workflow for runs that do not name one
+        outputs (array of strings): Outputs to save for runs that do not
+            list them, None for every output
+
+    Returns:
+        runs (array of dicts): format: [{'workflow': name, 'uid': uid,
+            'inputs': {input_name: input_string/filename, ...},
+            'outputs': [name, ...] or None}, ...]
+
+    Raises:
+        ValueError if a run has no workflow
+    """
+    base_dir = os.path.dirname(os.path.abspath(manifest_file))
+
+    if manifest_file.lower().endswith('.csv'):
+        with open(manifest_file, 'r', newline='') as f_read:
+            entries = []
+            for row in csv.DictReader(f_read):
+                entry = {
+                    'inputs': {
+                        name: value for name, value in row.items()
+                        if name not in RESERVED_COLUMNS
+                    },
+                }
+                for name in ('workflow', 'uid'):
+                    if row.get(name):
+                        entry[name] = row[name]
+                if row.get('outputs'):
+                    entry['outputs'] = row['outputs'].split(';')
+                entries.append(entry)
+    else:
+        with open(manifest_file, 'r') as f_read:
+            entries = json.load(f_read)
+        if isinstance(entries, dict):
+            workflow = entries.get('workflow', workflow)
+            outputs = entries.get('outputs', outputs)
+            entries = entries['runs']
+
+    runs = []
+    for i, entry in enumerate(entries):
+        run_workflow = entry.get('workflow', workflow)
+        if not run_workflow:
+            raise ValueError(f"Run {i} of {manifest_file} has no workflow, use --workflow to set one")
+
+        inputs = {}
+        for name, value in entry['inputs'].items():
+            # Inputs naming a file next to the manifest are sent as files
+            if isinstance(value, str) and not os.path.isabs(value) \
+                    and os.path.isfile(os.path.join(base_dir, value)):
+                value = os.path.join(base_dir, value)
+            inputs[name] = value
+
+        runs.append({
+            'workflow': run_workflow,
+            'uid': entry.get('uid') or str(uuid.uuid4()),
+            'inputs': inputs,
+            'outputs': entry.get('outputs', outputs),
+        })
+    return runs
+
+
+def summarise(results, wall_seconds, request_count):
+    """
+    Function to sum up the runs of a batch
+
+    Args:
+        results (array of dicts): Result of each run, see run_one
+        wall_seconds (float): Time taken by the whole batch
+        request_count (int): Requests sent to galaxy during the batch
+
+    Returns:
+        summary (dict)
+    """
+    finished = [result for result in results if result['state'] == 'ok']
+    latencies = sorted(result['seconds'] for result in finished)
+
+    latency = None
+    if len(latencies) > 0:
+        latency = {
+            'mean': statistics.mean(latencies),
+            'p50': latencies[len(latencies) // 2],
+            'p95': latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+            'min': latencies[0],
+            'max': latencies[-1],
+        }
+
+    phase_seconds = {}
+    for result in finished:
+        for name, seconds in result.get('phase_seconds', {}).items():
+            phase_seconds.setdefault(name, []).append(seconds)
+
+    return {
+        'runs': len(results),
+        'ok': len(finished),
+        'failed': len(results) - len(finished),
+        'cached': sum(1 for result in results if result.get('cached')),
+        'wall_seconds': wall_seconds,
+        'runs_per_minute': 60 * len(finished) / wall_seconds if wall_seconds > 0 else 0.0,
+        'latency_seconds': latency,
+        'mean_phase_seconds': {
+            name: statistics.mean(values) for name, values in phase_seconds.items()
+        },
+        'requests': request_count,
+        'results': results,
+    }
+
+
+async def run_one(session, run, index, total, args):
+    """
+    Launch one run of the manifest and follow it to the end
+
+    Returns:
+        result (dict): format: {'uid': uid, 'workflow': name,
+            'state': 'ok' / 'error' / 'failed', 'error': message,
+            'invocation_id': id, 'seconds': latency, 'cached': bool,
+            'files': [path, ...], 'phase_seconds': {phase: seconds}}
+    """
+    prefix = f"[{index + 1}/{total} {run['uid']}]"
+    result = {
+        'uid': run['uid'],
+        'workflow': run['workflow'],
+        'state': 'failed',
+        'error': None,
+        'invocation_id': None,
+        'seconds': None,
+        'cached': False,
+        'files': [],
+    }
+
+    start = time.perf_counter()
+    try:
+        handle = await launch_workflow_async(
+            session,
+            run['workflow'],
+            run['inputs'],
+            uid=run['uid'],
+            poll_interval=args.poll_interval,
+            outputs=run['outputs'],
+            use_cache=not args.no_cache and args.output_dir is not None
+        )
+        if handle is False:
+            result['error'] = 'Workflow failed to launch'
+            print(f"{prefix} failed to launch", flush=True)
+            return result
+
+        result['invocation_id'] = handle.invocation_id
+        result['cached'] = handle.cached
+        print(f"{prefix} {'cached' if handle.cached else 'invoked'} {handle.invocation_id}", flush=True)
+
+        try:
+            async for event in handle.events():
+                print(f"{prefix} {event['label']}: {event['state']}", flush=True)
+        except WorkflowFailedError as e:
+            result['state'] = 'error'
+            result['error'] = str(e)
+            print(f"{prefix} failed: {e}", flush=True)
+            return result
+
+        if args.output_dir is not None:
+            result['files'] = await handle.download_outputs(
+                os.path.join(args.output_dir, run['uid']),
+                outputs=run['outputs'],
+                delete_history=not args.keep_histories
+            )
+        else:
+            await handle.finish(delete_history=not args.keep_histories)
+        if not handle.cached:
+            result['phase_seconds'] = handle.metrics.to_dict()['summary']['phase_seconds']
+
+        result['state'] = 'ok'
+        result['seconds'] = time.perf_counter() - start
+        print(f"{prefix} finished in {result['seconds']:.1f}s", flush=True)
+    except Exception as e:
+        log.exception(f"Run {run['uid']} failed")
+        result['error'] = str(e)
+        print(f"{prefix} failed: {e}", flush=True)
+    return result
+
+
+async def run_batch(session, runs, args):
+    """
+    Run every launch of the manifest with at most args.parallel running at
+    once, all followed from one event loop
+
+    Returns:
+        results (array of dicts): Result of each run, in manifest order
+    """
+    semaphore = asyncio.Semaphore(max(1, args.parallel))
+
+    async def limited(index, run):
+        async with semaphore:
+            return await run_one(session, run, index, len(runs), args)
+
+    return await asyncio.gather(*(
+        limited(index, run) for index, run in enumerate(runs)
+    ))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="galaxy_batch.py",
+        description="Run galaxy workflows headless from a manifest of launches",
+    )
+    parser.add_argument("--server", default=os.environ.get("GALAXY_SERVER", "localhost:8080"), help="Galaxy server address, default $GALAXY_SERVER")
+    parser.add_argument("--api-key", default=os.environ.get("GALAXY_API_KEY"), help="Galaxy API key, default $GALAXY_API_KEY")
+    parser.add_argument("--cache-dir", default=None, help="Directory to keep the workflow, upload and result caches in")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Log the requests made to galaxy")
+
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("workflows", help="List the workflows on the server")
+    for command in ("inputs", "outputs"):
+        sub = commands.add_parser(command, help=f"List the {command} of a workflow")
+        sub.add_argument("workflow", help="Workflow name")
+
+    run = commands.add_parser("run", help="Run every launch in a manifest")
+    run.add_argument("manifest", help="JSON or CSV manifest of launches")
+    run.add_argument("--workflow", default=None, help="Workflow for runs that do not name one")
+    run.add_argument("--outputs", nargs="+", default=None, help="Outputs to save, default every output")
+    run.add_argument("--parallel", type=int, default=4, help="Maximum number of runs at once")
+    run.add_argument("--output-dir", default=None, help="Save the outputs of each run in <output-dir>/<uid>")
+    run.add_argument("--summary", default=None, help="JSON file to write the summary to")
+    run.add_argument("--poll-interval", type=float, default=1.0, help="Shortest time between polls of a run")
+    run.add_argument("--no-cache", action="store_true", help="Always run, never reuse the outputs of an identical earlier run")
+    run.add_argument("--keep-histories", action="store_true", help="Do not delete the histories of runs once finished (and saved with --output-dir)")
+
+    args = parser.parse_args(argv)
+
+    log.basicConfig(level=log.DEBUG if args.verbose else log.WARNING)
+    if args.api_key is None:
+        parser.error("an API key is needed, use --api-key or $GALAXY_API_KEY")
+    if args.cache_dir is not None:
+        set_cache_dir(args.cache_dir)
+
+    session = get_session(args.server, args.api_key)
+    if session is None:
+        print(f"Could not connect to {args.server} with the given API key", file=sys.stderr)
+        return 2
+
+    if args.command == "workflows":
+        print(json.dumps(session.get_workflows(refresh=True), indent=4))
+        return 0
+    if args.command in ("inputs", "outputs"):
+        if args.command == "inputs":
+            found = session.get_inputs(args.workflow)
+        else:
+            found = session.get_outputs(args.workflow)
+        if found is False:
+            return 1
+        print(json.dumps(found, indent=4))
+        return 0
+
+    try:
+        runs = read_manifest(args.manifest, workflow=args.workflow, outputs=args.outputs)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Could not read manifest {args.manifest}: {e}", file=sys.stderr)
+        return 2
+
+    print(f"Running {len(runs)} launches, {args.parallel} at a time", flush=True)
+    session.reset_request_count()
+    start = time.perf_counter()
+    results = asyncio.run(run_batch(session, runs, args))
+    summary = summarise(results, time.perf_counter() - start, session.request_count)
+
+    print(
+        f"{summary['ok']}/{summary['runs']} runs finished ({summary['cached']} cached) "
+        f"in {summary['wall_seconds']:.1f}s, {summary['runs_per_minute']:.2f} runs/min",
+        flush=True
+    )
+    if summary['latency_seconds'] is not None:
+        latency = summary['latency_seconds']
+        print(f"Latency mean {latency['mean']:.1f}s, p50 {latency['p50']:.1f}s, p95 {latency['p95']:.1f}s, max {latency['max']:.1f}s")
+    if args.summary is not None:
+        with open(args.summary, 'w') as f_write:
+            json.dump(summary, f_write, indent=4)
+
+    return 0 if summary['failed'] == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,1235 @@
+import uuid
+import os
+import json
+import time
+import tempfile
+import threading
+import logging as log
+
+from concurrent.futures import ThreadPoolExecutor
+
+from os import path
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from bioblend import ConnectionError
+from bioblend.galaxy import GalaxyInstance
+
+from input_index import InputIndex
+from result_cache import ResultCache, cacheable_dir, result_key, value_sha256
+from run_metrics import RunMetrics, current_metrics, submit_with_context, call_hook
+from invocation_watcher import InvocationWatcher, WorkflowFailedError
+from tus_upload import TusUploader, DEFAULT_CHUNK_SIZE
+from workflow_cache import WorkflowMetadataCache
+
+
+# History that holds one copy of each input file, later launches copy the
+# datasets from here instead of uploading the file again
+INPUT_CACHE_HISTORY = 'omniverse_input_cache'
+
+# Dataset states that mean the content of a cached input can not be used
+BAD_DATASET_STATES = {'error', 'discarded', 'failed_metadata'}
+
+
+class PooledGalaxyInstance(GalaxyInstance):
+    """
+    GalaxyInstance that sends its API requests through a shared keep-alive
+    requests.Session and counts and times every request made to the server
+
+    bioblend calls the module level requests.get/post/... for every request,
+    which opens a new connection each time. These overrides mirror the
+    bioblend implementations but use the pooled session instead.
+    Multipart (file attached) posts are left to bioblend.
+    """
+
+    def __init__(self, url, key, session):
+        self._galaxy_session = session
+        super().__init__(url=url, key=key)
+
+    def _send(self, method, url, **kwargs):
+        """Send a request through the pooled session, timing and counting it"""
+        start = time.perf_counter()
+        r = self._galaxy_session.http.request(method, url, **kwargs)
+        if kwargs.get('stream'):
+            received = int(r.headers.get('Content-Length') or 0)
+        else:
+            received = len(r.content)
+        data = kwargs.get('data')
+        self._galaxy_session.record_request(
+            method,
+            url,
+            r.status_code,
+            time.perf_counter() - start,
+            sent=len(data) if data is not None else 0,
+            received=received
+        )
+        return r
+
+    def make_get_request(self, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        kwargs.setdefault('verify', self.verify)
+        return self._send('GET', url, headers=self.json_headers, **kwargs)
+
+    def make_post_request(
+        self,
+        url,
+        payload=None,
+        params=None,
+        files_attached=False
+    ):
+        if files_attached:
+            start = time.perf_counter()
+            try:
+                return super().make_post_request(
+                    url, payload=payload, params=params, files_attached=True
+                )
+            finally:
+                self._galaxy_session.record_request(
+                    'POST', url, None, time.perf_counter() - start
+                )
+        r = self._send(
+            'POST',
+            url,
+            params=params,
+            data=json.dumps(payload) if payload is not None else None,
+            headers=self.json_headers,
+            timeout=self.timeout,
+            allow_redirects=False,
+            verify=self.verify,
+        )
+        return _decode_response(r)
+
+    def make_delete_request(self, url, payload=None, params=None):
+        return self._send(
+            'DELETE',
+            url,
+            params=params,
+            data=json.dumps(payload) if payload is not None else None,
+            headers=self.json_headers,
+            timeout=self.timeout,
+            allow_redirects=False,
+            verify=self.verify,
+        )
+
+    def make_put_request(self, url, payload=None, params=None):
+        r = self._send(
+            'PUT',
+            url,
+            params=params,
+            data=json.dumps(payload) if payload is not None else None,
+            headers=self.json_headers,
+            timeout=self.timeout,
+            allow_redirects=False,
+            verify=self.verify,
+        )
+        return _decode_response(r)
+
+    def make_patch_request(self, url, payload=None, params=None):
+        r = self._send(
+            'PATCH',
+            url,
+            params=params,
+            data=json.dumps(payload) if payload is not None else None,
+            headers=self.json_headers,
+            timeout=self.timeout,
+            allow_redirects=False,
+            verify=self.verify,
+        )
+        return _decode_response(r)
+
+
+def _decode_response(r):
+    """
+    Decode a JSON response the same way bioblend does for POST/PUT/PATCH
+
+    Args:
+        r (requests.Response): Response from the galaxy server
+
+    Returns:
+        Decoded JSON content of the response
+
+    Raises:
+        bioblend.ConnectionError if the status code is not 200 or the
+            content can not be decoded
+    """
+    if r.status_code == 200:
+        try:
+            return r.json()
+        except Exception as e:
+            raise ConnectionError(
+                f"Request was successful, but cannot decode the response content: {e}",
+                body=r.content,
+                status_code=r.status_code,
+            )
+    raise ConnectionError(
+        f"Unexpected HTTP status code: {r.status_code}",
+        body=r.text,
+        status_code=r.status_code,
+    )
+
+
+def new_upload(gi, history, name, string):
+    """
+    Function to upload a string to a galaxy history as a dataset
+        the string is sent from memory as pasted content, so no file is
+        written and uploads of the same name can run at the same time
+
+    Args:
+        gi (GalaxyInstance): GalaxyInstance object
+        history (string): History ID
+        name (string): Name of the dataset
+        string (string or bytes): String to be uploaded to the history,
+            bytes must be UTF-8 encoded text
+
+    Returns:
+        upload (dict): Dictionary of the uploaded dataset
+    """
+    if isinstance(string, bytes):
+        try:
+            string = string.decode('utf-8')
+        except UnicodeDecodeError:
+            raise ValueError(
+                f"Input {name} is binary, binary inputs must be given as a file path"
+            )
+    return gi.tools.paste_content(string, history, file_name=name)
+
+
+class GalaxySession:
+    """
+    Reusable connection to a galaxy instance
+
+    Holds a keep-alive HTTP connection pool and a single GalaxyInstance,
+    checks the server address and API key once and then exposes the helper
+    functions from helper_functs as methods. Every request sent to the
+    server is counted in request_count.
+
+    Workflow names, ids and the parsed inputs / outputs of each workflow are
+    kept in a WorkflowMetadataCache, which can be shared between sessions.
+
+    Args:
+        server (string): Galaxy server address
+        api_key (string): User generated string from galaxy instance
+            to create: User > Preferences > Manage API Key > Create a new key
+        pool_size (int): Number of connections kept alive in the pool
+        timeout (float): Timeout in seconds for each request, None to wait
+            indefinitely
+        metadata_cache (WorkflowMetadataCache): Cache for the workflow
+            metadata, a new in-memory cache is used if not given
+        upload_workers (int): Maximum number of datasets uploaded at the
+            same time for one launch
+        download_workers (int): Maximum number of outputs downloaded at the
+            same time for one run
+        input_index (InputIndex): Index of input files already on the
+            server, a new in-memory index is used if not given. Set
+            deduplicate to False to always upload input files
+        deduplicate (bool): If true, input files whose content is already
+            on the server are copied from the input cache history instead
+            of being uploaded again
+        tus_threshold (int): Files of at least this many bytes are sent
+            through the resumable, chunked tus upload, None to never use it
+        tus_chunk_size (int): Bytes sent per request for tus uploads
+        tus_parallel_chunks (int): Parts of a tus upload sent at once
+        tus_state_file (string): Optional path of the JSON file used to
+            resume interrupted tus uploads
+        result_cache (ResultCache): Cache of the downloaded outputs of
+            earlier runs, a new in-memory cache is used if not given
+        on_metrics (callable): Called with the timing breakdown of each run
+            launched with this session, see run_metrics.RunMetrics.to_dict
+    """
+
+    def __init__(
+        self,
+        server,
+        api_key,
+        pool_size=10,
+        timeout=None,
+        metadata_cache=None,
+        upload_workers=4,
+        download_workers=4,
+        input_index=None,
+        deduplicate=True,
+        tus_threshold=64 * 1024 * 1024,
+        tus_chunk_size=DEFAULT_CHUNK_SIZE,
+        tus_parallel_chunks=4,
+        tus_state_file=None,
+        result_cache=None,
+        on_metrics=None
+    ):
+        self.server = server
+        self.api_key = api_key
+        self.timeout = timeout
+        self.upload_workers = upload_workers
+        self.download_workers = download_workers
+
+        if input_index is None:
+            input_index = InputIndex()
+        self.input_index = input_index
+        self.deduplicate = deduplicate
+        self._input_history_id = None
+        self._input_history_lock = threading.Lock()
+
+        self.tus_threshold = tus_threshold
+        self.tus_chunk_size = tus_chunk_size
+        self.tus_parallel_chunks = tus_parallel_chunks
+        self.tus_state_file = tus_state_file
+
+        if metadata_cache is None:
+            metadata_cache = WorkflowMetadataCache()
+        self.metadata_cache = metadata_cache
+
+        if result_cache is None:
+            result_cache = ResultCache()
+        self.result_cache = result_cache
+        self.on_metrics = on_metrics
+
+        self.http = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=pool_size,
+            pool_maxsize=pool_size
+        )
+        self.http.mount('http://', adapter)
+        self.http.mount('https://', adapter)
+
+        self.request_count = 0
+        self._count_lock = threading.Lock()
+
+        self._gi = None
+        self._valid = None
+
+    def count_request(self):
+        """Increment the counter of requests sent to the galaxy server"""
+        with self._count_lock:
+            self.request_count += 1
+
+    def record_request(self, method, url, status, seconds, sent=0, received=0):
+        """
+        Count a request sent to the galaxy server and record it against the
+        run being worked on, if any
+
+        Args:
+            method (string): HTTP method
+            url (string): Requested URL
+            status (int): HTTP status code, None if not known
+            seconds (float): Time taken by the request
+            sent (int): Bytes in the request body
+            received (int): Bytes in the response body
+        """
+        self.count_request()
+        metrics = current_metrics()
+        if metrics is not None:
+            metrics.add_request(
+                method, url, status, seconds, sent=sent, received=received
+            )
+
+    def reset_request_count(self):
+        """
+        Reset the request counter
+
+        Returns:
+            count (int): Number of requests made before the reset
+        """
+        with self._count_lock:
+            count = self.request_count
+            self.request_count = 0
+        return count
+
+    def close(self):
+        """Close all pooled connections"""
+        self.http.close()
+
+    @property
+    def gi(self):
+        """The GalaxyInstance shared by all calls made with this session"""
+        if self._gi is None:
+            self._gi = PooledGalaxyInstance(
+                url=self._resolve_url(),
+                key=self.api_key,
+                session=self
+            )
+            self._gi.timeout = self.timeout
+        return self._gi
+
+    def _resolve_url(self):
+        """
+        Add a scheme to the server address if one was not given, trying
+        https first as bioblend does, but only once per session
+
+        Returns:
+            url (string): Server address including the scheme
+
+        Raises:
+            ValueError if the server can not be reached with either scheme
+        """
+        if urlparse(self.server).scheme:
+            return self.server
+
+        for scheme in ('https://', 'http://'):
+            try:
+                self.count_request()
+                r = self.http.get(scheme + self.server, timeout=self.timeout)
+                r.raise_for_status()
+                return scheme + self.server
+            except requests.RequestException:
+                continue
+        raise ValueError(f"Missing scheme in url {self.server}")
+
+    def validate(self):
+        """
+        Check the server address and API key are valid, this only talks to
+        the server the first time it is called
+
+        Returns:
+            True if server and api key are valid
+            False if server or api key are invalid
+        """
+        if self._valid is not None:
+            return self._valid
+
+        # Building the GalaxyInstance resolves the server address
+        try:
+            self.gi
+        except ValueError:
+            log.error("Server address is not valid")
+            return False
+
+        try:
+            self._workflow_index(refresh=True)
+        except Exception:
+            log.error("API key is not valid")
+            return False
+
+        self._valid = True
+        return True
+
+    def _workflow_index(self, refresh=False):
+        """
+        Get the name to workflow mapping of the galaxy instance, from the
+        metadata cache while it is fresh or from the server otherwise
+
+        Args:
+            refresh (bool): If true, always fetch the list from the server
+
+        Returns:
+            index (dict): format: {name: {'id': id, 'update_time': time}}
+        """
+        index = None
+        if not refresh:
+            index = self.metadata_cache.get_index(self.server)
+        if index is None:
+            index = self.metadata_cache.set_index(
+                self.server,
+                self.gi.workflows.get_workflows()
+            )
+        return index
+
+    def _find_workflow(self, workflow_name):
+        """
+        Get the id and update time of workflow_name, refreshing the workflow
+        list once if the name is not found
+
+        Args:
+            workflow_name (string): Target workflow name
+
+        Returns:
+            workflow (dict): format: {'id': id, 'update_time': time}
+            None if the workflow does not exist
+        """
+        index = self._workflow_index()
+        if workflow_name not in index:
+            index = self._workflow_index(refresh=True)
+        return index.get(workflow_name)
+
+    def get_workflows(self, refresh=False):
+        """
+        Function to get an array of workflows available on the galaxy instance
+
+        Args:
+            refresh (bool): If true, fetch the list from the server again
+                instead of using the one stored on the session
+
+        Returns:
+            workflows (array of strings): Workflows available to be run on the
+                galaxy instance
+        """
+        if not self.validate():
+            return False
+
+        return list(self._workflow_index(refresh=refresh))
+
+    def check_workflow(self, workflow_name):
+        """
+        Function to check if the workflow that is being referenced is part of
+        the workflows available on the galaxy instance
+
+        Args:
+            workflow_name (string): Target workflow name
+
+        Returns:
+            True if workflow exists
+            False if workflow does not exist
+        """
+        if not self.validate():
+            return False
+
+        if self._find_workflow(workflow_name) is None:
+            log.error(f"Workflow {workflow_name} not found on galaxy instance")
+            return False
+        return True
+
+    def workflow_metadata(self, workflow_name):
+        """
+        Get the parsed inputs and outputs of workflow_name, only exporting
+        the workflow from the server if it is not cached for its current
+        update time
+
+        Args:
+            workflow_name (string): Target workflow name
+
+        Returns:
+            metadata (dict): format: {'inputs': [(type, name, id), ...],
+                'outputs': [name, ...]}
+        """
+        workflow = self._find_workflow(workflow_name)
+        metadata = self.metadata_cache.get(
+            self.server, workflow['id'], workflow['update_time']
+        )
+        if metadata is not None:
+            return metadata
+
+        steps = self.gi.workflows.export_workflow_dict(workflow['id'])['steps']
+        metadata = {
+            'inputs': parse_inputs(steps),
+            'outputs': parse_outputs(steps),
+        }
+        self.metadata_cache.set(
+            self.server,
+            workflow['id'],
+            workflow['update_time'],
+            metadata['inputs'],
+            metadata['outputs']
+        )
+        return metadata
+
+    def get_inputs(self, workflow_name):
+        """
+        Function to get an array of inputs for a given galaxy workflow
+
+        Args:
+            workflow_name (string): Target workflow name
+
+        Returns:
+            inputs (array of strings): Input files expected by the workflow,
+                these will be in the same order as they should be given in
+                the main call
+                format: [(type, name, id), ...]
+        """
+        if not self.check_workflow(workflow_name):
+            return False
+
+        return self.workflow_metadata(workflow_name)['inputs']
+
+    def get_outputs(self, workflow_name):
+        """
+        Function to get an array of outputs for a given galaxy workflow
+
+        Args:
+            workflow_name (string): Target workflow name
+
+        Returns:
+            outputs (array of strings): Output files given by the workflow,
+                these are the names that can be requested as workflow outputs
+        """
+        if not self.check_workflow(workflow_name):
+            return False
+
+        return self.workflow_metadata(workflow_name)['outputs']
+
+    def result_key(self, workflow_name, inputs, outputs=None):
+        """
+        Function to get the result cache key of a run, from the workflow id
+        and version and the content of every input
+
+        Args:
+            workflow_name (string): Target workflow name
+            inputs (dict): Dictionary of inputs for the workflow
+                format: {input_name: input_string/filename, ...}
+            outputs (array of strings): Names of the outputs to save, None
+                for every output of the run
+
+        Returns:
+            key (string): Key for the result cache
+            None if the workflow does not exist
+        """
+        workflow = self._find_workflow(workflow_name)
+        if workflow is None:
+            return None
+
+        input_hashes = {}
+        for name, value in inputs.items():
+            if isinstance(value, str) and path.isfile(value):
+                input_hashes[name] = 'file:' + self.input_index.hash_file(value)
+            else:
+                input_hashes[name] = 'value:' + value_sha256(value)
+
+        return result_key(
+            self.server,
+            workflow['id'],
+            workflow['update_time'],
+            input_hashes,
+            outputs=outputs
+        )
+
+    def prepare_launch(
+        self,
+        workflow_name,
+        inputs,
+        uid=None,
+        history_id=None,
+        uploaded=None
+    ):
+        """
+        Function to create the history for a workflow run and upload the
+        inputs to it, ready for the workflow to be invoked
+
+        Args:
+            workflow_name (string): Target workflow name
+            inputs (dict): Dictionary of inputs for the workflow, these should
+                be named the same as the inputs in the workflow
+                format: {input_name: input_string/filename, ...}
+            uid (string): Unique identifier for the workflow run
+            history_id (string): Existing history to run the workflow in,
+                a new history is created if not given
+            uploaded (dict): Dataset inputs already in the history, these
+                are used as they are instead of being uploaded again
+                format: {input_name: {'src': 'hda', 'id': dataset_id}, ...}
+
+        Returns:
+            launch (dict): format: {'workflow_id': id, 'history_id': id,
+                'uid': uid, 'inputs': {step_id: input, ...}}
+            False if the workflow or its inputs are not valid
+        """
+        expected_inputs = self.get_inputs(workflow_name)
+        if expected_inputs is False:
+            return False
+
+        gi = self.gi
+        api_workflow = self._find_workflow(workflow_name)
+
+        # Sort the inputs into datasets to upload and parameters
+        workflow_inputs = {}
+        datasets = {}
+
+        if uploaded is None:
+            uploaded = {}
+
+        for wf_input in expected_inputs:
+            if wf_input[0] == "dataset" and wf_input[1] in uploaded:
+                workflow_inputs[str(wf_input[2])] = uploaded[wf_input[1]]
+                continue
+            if wf_input[1] not in inputs:
+                continue
+            if wf_input[0] == "dataset":
+                datasets[str(wf_input[2])] = (wf_input[1], inputs[wf_input[1]])
+            elif wf_input[0] == "parameter":
+                workflow_inputs[str(wf_input[2])] = inputs[wf_input[1]]
+
+        # Check that all inputs are present before uploading anything
+        if len(workflow_inputs) + len(datasets) != len(expected_inputs):
+            log.error("Not all inputs were provided or were not named correctly")
+            return False
+
+        # Create new history with name history_name
+        if uid is None:
+            uid = str(uuid.uuid4())
+
+        if history_id is None:
+            history_id = gi.histories.create_history(
+                name=workflow_name + '_' + uid
+            )['id']
+
+        # Upload all the datasets for this launch at the same time
+        workflow_inputs.update(self.upload_inputs(history_id, datasets))
+
+        return {
+            'workflow_id': api_workflow['id'],
+            'history_id': history_id,
+            'uid': uid,
+            'inputs': workflow_inputs,
+        }
+
+    def upload_dataset(self, history_id, name, value):
+        """
+        Function to upload a single workflow input to a history
+
+        Args:
+            history_id (string): History ID
+            name (string): Name of the workflow input
+            value (string or bytes): Path of a file to upload, or the content
+                of the dataset as a string / bytes
+
+        Returns:
+            dataset_id (string): ID of the dataset in the history
+        """
+        # Check for case of input being a file or a string
+        if isinstance(value, str) and path.isfile(value):
+            if self.deduplicate:
+                return self._upload_deduplicated(history_id, value)
+            upload = self.upload_file(value, history_id)
+        else:
+            upload = new_upload(self.gi, history_id, name, value)
+        return upload['outputs'][0]['id']
+
+    def upload_file(self, file_path, history_id):
+        """
+        Function to upload a file to a history, large files go through the
+        resumable tus upload so an interrupted upload does not start again
+        from zero
+
+        Args:
+            file_path (string): Path of the file to upload
+            history_id (string): History ID
+
+        Returns:
+            upload (dict): Dictionary of the uploaded dataset
+        """
+        if self.tus_threshold is None \
+                or path.getsize(file_path) < self.tus_threshold:
+            return self.gi.tools.upload_file(file_path, history_id)
+
+        uploader = TusUploader(
+            self.http,
+            self.gi.url + '/upload/resumable_upload/',
+            api_key=self.api_key,
+            chunk_size=self.tus_chunk_size,
+            parallel_chunks=self.tus_parallel_chunks,
+            state_file=self.tus_state_file,
+            timeout=self.timeout,
+            on_response=self.record_request
+        )
+        session_id = uploader.upload(file_path)
+        return self.gi.tools.post_to_fetch(file_path, history_id, session_id)
+
+    def _input_history(self):
+        """
+        Get the id of the history holding the cached input files, creating
+        it if it does not exist yet
+
+        Returns:
+            history_id (string): ID of the input cache history
+        """
+        with self._input_history_lock:
+            if self._input_history_id is None:
+                histories = self.gi.histories.get_histories(
+                    name=INPUT_CACHE_HISTORY
+                )
+                if len(histories) > 0:
+                    self._input_history_id = histories[0]['id']
+                else:
+                    self._input_history_id = self.gi.histories.create_history(
+                        name=INPUT_CACHE_HISTORY
+                    )['id']
+            return self._input_history_id
+
+    def _upload_deduplicated(self, history_id, file_path):
+        """
+        Function to get a file into a history, copying an existing dataset
+        with the same content if there is one and uploading the file to the
+        input cache history otherwise
+
+        Args:
+            history_id (string): History ID
+            file_path (string): Path of the file to upload
+
+        Returns:
+            dataset_id (string): ID of the dataset in the history
+        """
+        gi = self.gi
+        digest = self.input_index.hash_file(file_path)
+        size = os.path.getsize(file_path)
+
+        cached = self.input_index.lookup(self.server, digest)
+        if cached is not None and self._verify_cached_input(cached, digest):
+            return gi.histories.copy_dataset(
+                history_id, cached['dataset_id']
+            )['id']
+
+        upload = self.upload_file(file_path, self._input_history())
+        dataset_id = upload['outputs'][0]['id']
+        self.input_index.record(self.server, digest, dataset_id, size)
+        return gi.histories.copy_dataset(history_id, dataset_id)['id']
+
+    def _verify_cached_input(self, cached, digest):
+        """
+        Check a cached input dataset still exists and holds the content with
+        the given hash. The SHA-256 computed by galaxy is used when it is
+        available, otherwise the size is checked and galaxy is asked to
+        compute the hash for the next launch
+
+        Args:
+            cached (dict): Index entry, format: {'dataset_id': id, 'size': n}
+            digest (string): Hex SHA-256 digest of the local file
+
+        Returns:
+            True if the dataset can be used in place of an upload
+            False if the file needs uploading again
+        """
+        gi = self.gi
+        try:
+            dataset = gi.datasets.show_dataset(cached['dataset_id'])
+        except ConnectionError:
+            dataset = None
+
+        if dataset is None or dataset.get('deleted') or dataset.get('purged') \
+                or dataset.get('state') in BAD_DATASET_STATES:
+            log.info(f"Cached input {cached['dataset_id']} is no longer available, uploading again")
+            self.input_index.forget(self.server, digest)
+            return False
+
+        for dataset_hash in dataset.get('hashes') or []:
+            if dataset_hash.get('hash_function') == 'SHA-256':
+                if dataset_hash.get('hash_value') == digest:
+                    return True
+                log.warning(f"Checksum of cached input {cached['dataset_id']} does not match, uploading again")
+                self.input_index.forget(self.server, digest)
+                return False
+
+        size = dataset.get('file_size')
+        if size is not None and size != cached['size']:
+            log.warning(f"Size of cached input {cached['dataset_id']} does not match, uploading again")
+            self.input_index.forget(self.server, digest)
+            return False
+
+        if dataset.get('state') == 'ok':
+            try:
+                gi.make_put_request(
+                    f"{gi.url}/datasets/{cached['dataset_id']}/hash",
+                    payload={'hash_function': 'SHA-256'}
+                )
+            except ConnectionError:
+                log.info(f"Could not request a checksum for {cached['dataset_id']}")
+        return True
+
+    def upload_inputs(self, history_id, datasets):
+        """
+        Function to upload the dataset inputs of a launch in parallel, using
+        at most upload_workers uploads at once
+
+        Args:
+            history_id (string): History ID
+            datasets (dict): Datasets to upload, keyed by however the caller
+                refers to the inputs, e.g. the workflow step id in
+                prepare_launch or the input name in a sweep
+                format: {key: (input_name, file_path/string), ...}
+
+        Returns:
+            workflow_inputs (dict): Uploaded datasets under the same keys
+                format: {key: {'src': 'hda', 'id': dataset_id}, ...}
+        """
+        if len(datasets) == 0:
+            return {}
+
+        workers = max(1, min(self.upload_workers, len(datasets)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                key: submit_with_context(
+                    executor, self.upload_dataset, history_id, name, value
+                )
+                for key, (name, value) in datasets.items()
+            }
+            return {
+                key: {'src': 'hda', 'id': future.result()}
+                for key, future in futures.items()
+            }
+
+    def invoke(self, launch):
+        """
+        Function to invoke a workflow prepared by prepare_launch
+
+        Args:
+            launch (dict): Prepared launch returned by prepare_launch
+
+        Returns:
+            invocation (dict): Invocation as returned by the galaxy API
+        """
+        return self.gi.workflows.invoke_workflow(
+            workflow_id=launch['workflow_id'],
+            inputs=launch['inputs'],
+            history_id=launch['history_id']
+        )
+
+    def output_datasets(
+        self,
+        history_id,
+        invocation_id,
+        outputs=None,
+        exclude_ids=(),
+        invocation_only=False
+    ):
+        """
+        Function to find the datasets of a run to download
+
+        Args:
+            history_id (string): History ID
+            invocation_id (string): Invocation ID
+            outputs (array of strings): Names of the outputs wanted, as given
+                by get_outputs (dataset names or workflow output labels),
+                None for every dataset in the history
+            exclude_ids (array of strings): Dataset IDs to leave out, e.g.
+                the inputs uploaded for the run
+            invocation_only (bool): If true, only datasets made by the jobs
+                of this invocation are considered, for histories shared by
+                several runs (e.g. the points of a sweep)
+
+        Returns:
+            dataset_ids (array of strings): IDs of the datasets to download
+        """
+        gi = self.gi
+        exclude_ids = set(exclude_ids)
+
+        scope = None
+        if invocation_only:
+            invocation = gi.invocations.show_invocation(invocation_id)
+            scope = {output['id'] for output in invocation.get('outputs', {}).values()}
+            for step in invocation.get('steps', []):
+                if step.get('job_id') is not None:
+                    job = gi.jobs.show_job(step['job_id'])
+                    scope.update(output['id'] for output in job.get('outputs', {}).values())
+
+        dataset_ids = []
+        for dataset in gi.datasets.get_datasets(history_id=history_id):
+            if dataset['id'] in exclude_ids or dataset.get('deleted'):
+                continue
+            if scope is not None and dataset['id'] not in scope:
+                continue
+            if outputs is None or dataset['name'] in outputs:
+                dataset_ids.append(dataset['id'])
+
+        if outputs is not None:
+            # Workflow outputs can also be picked by their label
+            invocation = gi.invocations.show_invocation(invocation_id)
+            for label, output in invocation.get('outputs', {}).items():
+                if label in outputs and output['id'] not in dataset_ids:
+                    dataset_ids.append(output['id'])
+
+            if len(dataset_ids) == 0:
+                log.warning(f"None of the outputs {outputs} were found in history {history_id}")
+
+        return dataset_ids
+
+    def download_outputs(
+        self,
+        history_id,
+        invocation_id,
+        dest_dir,
+        outputs=None,
+        exclude_ids=(),
+        invocation_only=False
+    ):
+        """
+        Function to download the outputs of a run and the biocompute object
+        of the invocation straight into dest_dir. The datasets are
+        downloaded at the same time (at most download_workers at once) and
+        streamed to disk so large files are never held in memory
+
+        Args:
+            history_id (string): History ID
+            invocation_id (string): Invocation ID
+            dest_dir (string): Directory to save the files in
+            outputs (array of strings): Names of the outputs to download,
+                None for every dataset in the history
+            exclude_ids (array of strings): Dataset IDs to leave out, e.g.
+                the inputs uploaded for the run
+            invocation_only (bool): See output_datasets
+
+        Returns:
+            files (array of strings): Paths of the saved files
+        """
+        gi = self.gi
+        dataset_ids = self.output_datasets(
+            history_id,
+            invocation_id,
+            outputs=outputs,
+            exclude_ids=exclude_ids,
+            invocation_only=invocation_only
+        )
+
+        files = []
+        if len(dataset_ids) > 0:
+            workers = max(1, min(self.download_workers, len(dataset_ids)))
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = [
+                    submit_with_context(
+                        executor,
+                        gi.datasets.download_dataset,
+                        file_path=dest_dir,
+                        dataset_id=dataset_id,
+                        use_default_filename=True
+                    )
+                    for dataset_id in dataset_ids
+                ]
+                files = [future.result() for future in futures]
+
+        download = gi.invocations.get_invocation_biocompute_object(
+            invocation_id=invocation_id
+        )
+        dict_to_save = json.dumps(download)
+        bco_fname = dest_dir + os.sep + 'biocompute_object.json'
+        with open(bco_fname, 'w') as f_write:
+            f_write.write(dict_to_save)
+        files.append(bco_fname)
+        return files
+
+    def launch_workflow(
+        self,
+        workflow_name,
+        inputs,
+        uid=None,
+        from_omni=False,
+        outputs=None,
+        output_dir=None,
+        on_change=None,
+        use_cache=True
+    ):
+        """
+        Function to call galaxy workflow via API
+
+        The time spent in each phase of the run, every API request and the
+        galaxy metrics of each job are recorded, saved as run_metrics.json
+        next to the outputs and passed to on_metrics, see
+        run_metrics.RunMetrics
+
+        Args:
+            workflow_name (string): Target workflow name
+            inputs (dict): Dictionary of inputs for the workflow, these should
+                be named the same as the inputs in the workflow
+                format: {input_name: input_string/filename, ...}
+            uid (string): Unique identifier for the workflow run
+            from_omni (bool): If true, the function will save the files to a
+                location where they can be accessed by the omniverse extension
+            outputs (array of strings): Names of the outputs to save, None
+                to save every output of the run
+            output_dir (string): Directory to save the outputs in, if not
+                given with from_omni a temporary directory is used
+            on_change (callable): Called with each step change event while
+                the workflow runs, see InvocationWatcher
+            use_cache (bool): With from_omni and output_dir, return the
+                outputs of an earlier run of the same workflow version with
+                the same inputs if there is one, and cache the outputs of
+                this run. Set to False to always run the workflow
+
+        Returns:
+            True if workflow successfully launched
+            False if workflow failed to launch
+            With from_omni, output_dir if given (or the directory of the
+                cached outputs), otherwise the TemporaryDirectory holding
+                the outputs
+        """
+        if uid is None:
+            uid = str(uuid.uuid4())
+        metrics = RunMetrics(workflow_name, uid)
+
+        with metrics.phase('validate'):
+            if not self.check_workflow(workflow_name):
+                return False
+
+            # Outputs saved to a temporary directory do not outlive the
+            # call so are never cached
+            key = None
+            if (
+                from_omni and output_dir is not None and use_cache
+                and cacheable_dir(output_dir)
+            ):
+                key = self.result_key(workflow_name, inputs, outputs=outputs)
+                cached = self.result_cache.get(key)
+                if cached is not None:
+                    log.info(f"Using cached outputs of invocation {cached['invocation_id']} in {cached['dir']}")
+                    return cached['dir']
+
+        with metrics.phase('upload'):
+            launch = self.prepare_launch(workflow_name, inputs, uid=uid)
+        if launch is False:
+            return False
+        metrics.history_id = launch['history_id']
+
+        gi = self.gi
+
+        # Call workflow, following the invocation it returns rather than
+        # looking it up as other runs of the workflow may have started since
+        with metrics.phase('invoke'):
+            invocation_id = self.invoke(launch)['id']
+        metrics.invocation_id = invocation_id
+
+        def step_changed(event):
+            metrics.on_step_change(event)
+            if on_change is not None:
+                on_change(event)
+
+        # Wait for the jobs of every step, not just the first one, to finish
+        watcher = InvocationWatcher(self, invocation_id, on_change=step_changed)
+        try:
+            with metrics.phase('wait'):
+                watcher.wait()
+        except WorkflowFailedError as e:
+            log.error(str(e))
+            self.report_metrics(metrics, watcher, 'error')
+            return False
+
+        if not from_omni:
+            self.report_metrics(metrics, watcher, 'ok')
+            return True
+
+        # From omniverse we want to save files in a location where we can
+        # access, pull the outputs from the history straight into it
+        if output_dir is None:
+            tempdir = tempfile.TemporaryDirectory()
+            dest_dir = tempdir.name
+        else:
+            tempdir = output_dir
+            dest_dir = output_dir
+            os.makedirs(dest_dir, exist_ok=True)
+
+        with metrics.phase('download'):
+            files = self.download_outputs(
+                launch['history_id'],
+                invocation_id,
+                dest_dir,
+                outputs=outputs,
+                exclude_ids=input_dataset_ids(launch)
+            )
+        with metrics.phase('cleanup'):
+            gi.histories.delete_history(history_id=launch['history_id'])
+
+        files.append(self.report_metrics(metrics, watcher, 'ok', dest_dir))
+        if key is not None:
+            self.result_cache.put(
+                key, dest_dir, files, invocation_id=invocation_id
+            )
+        return tempdir
+
+    def report_metrics(self, metrics, watcher, state, dest_dir=None):
+        """
+        Function to finish the timing breakdown of a run: fetch the galaxy
+        metrics of each of its jobs, save it next to the outputs and pass it
+        to the on_metrics hook
+
+        Args:
+            metrics (RunMetrics): Metrics of the run
+            watcher (InvocationWatcher): Watcher that followed the run
+            state (string): Final state of the run, 'ok' or 'error'
+            dest_dir (string): Directory the outputs were saved in, None to
+                not save the metrics
+
+        Returns:
+            file_path (string): Path of the saved metrics, None if not saved
+        """
+        gi = self.gi
+        with metrics.phase('job_metrics'):
+            for step in watcher.steps.values():
+                if step['job_id'] is None or step['job_id'] in metrics.jobs:
+                    continue
+                try:
+                    metrics.add_job(
+                        gi.jobs.show_job(step['job_id']),
+                        gi.jobs.get_metrics(step['job_id'])
+                    )
+                except ConnectionError as e:
+                    # Collections of jobs and purged jobs have no metrics
+                    log.debug(f"No metrics for job {step['job_id']}: {e}")
+        metrics.finish(state)
+
+        file_path = None
+        if dest_dir is not None:
+            file_path = metrics.write(dest_dir)
+        call_hook(self.on_metrics, metrics)
+        return file_path
+
+
+def input_dataset_ids(launch):
+    """
+    Function to get the IDs of the datasets uploaded for a launch
+
+    Args:
+        launch (dict): Prepared launch returned by prepare_launch
+
+    Returns:
+        dataset_ids (array of strings): IDs of the input datasets
+    """
+    return [
+        wf_input['id'] for wf_input in launch['inputs'].values()
+        if isinstance(wf_input, dict) and wf_input.get('src') == 'hda'
+    ]
+
+
+def parse_inputs(steps):
+    """
+    Function to pull the workflow inputs out of the steps of an exported
+    workflow dict
+
+    Args:
+        steps (dict): Steps of the exported workflow
+
+    Returns:
+        inputs (array of tuples): format: [(type, name, id), ...]
+    """
+    input_array = []
+    for step in steps:
+        inputs = steps[step]['inputs']
+        name = steps[step]['name']
+
+        # Some of the steps don't take inputs so have to skip these
+        # And only pull the inputs from input datasets, not individual tools
+        if len(inputs) > 0 and name == "Input dataset":
+            for wf_input in inputs:
+                input_array.append(
+                    ('dataset', wf_input['name'], steps[step]['id'])
+                )
+        if len(inputs) > 0 and name == "Input parameter":
+            for wf_input in inputs:
+                input_array.append(
+                    ('parameter', wf_input['name'], steps[step]['id'])
+                )
+
+    return input_array
+
+
+def parse_outputs(steps):
+    """
+    Function to pull the output names out of the steps of an exported
+    workflow dict, using the new name where an output has been renamed
+
+    Args:
+        steps (dict): Steps of the exported workflow
+
+    Returns:
+        outputs (array of strings): Output names of the workflow
+    """
+    outputs = []
+
+    for step in steps:
+        # Some of the steps don't take inputs so have to skip these
+        if not len(steps[step]) > 0:
+            continue
+
+        if 'outputs' not in steps[step]:
+            continue
+
+        output_dict = steps[step]['outputs']
+
+        if not len(output_dict) > 0:
+            continue
+
+        # See if output has been renamed & grab that name instead
+        if 'post_job_actions' in steps[step]:
+            post_job_actions = steps[step]['post_job_actions']
+            if 'RenameDatasetActionFile' in post_job_actions:
+                action_file = post_job_actions['RenameDatasetActionFile']
+                name = action_file['action_arguments']['newname']
+                outputs.append(name)
+                continue
+
+        for output in output_dict:
+            outputs.append(output['name'])
+
+    return outputs
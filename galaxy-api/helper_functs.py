@@ -1,35 +1,123 @@
-import uuid
 import os
-import json
-import tempfile
-import logging as log
+import asyncio
+import threading
 
-from os import remove
-from os import path
+from async_launch import launch_workflow_async as _launch_workflow_async
+from galaxy_session import GalaxySession, new_upload  # noqa: F401
+from input_index import InputIndex
+from result_cache import ResultCache
+from invocation_watcher import WorkflowFailedError  # noqa: F401
+from sweep import run_sweep
+from workflow_cache import WorkflowMetadataCache
 
-from bioblend.galaxy import GalaxyInstance
 
+# Sessions are shared between calls so the connection pool, the server / key
+# validation and the workflow list are reused rather than rebuilt each call
+_sessions = {}
+_sessions_lock = threading.Lock()
 
-def new_upload(gi, history, name, string):
+# Workflow metadata and the index of uploaded inputs are shared by all
+# sessions, see set_cache_dir to keep them on disk between runs
+_metadata_cache = WorkflowMetadataCache()
+_input_index = InputIndex()
+_tus_state_file = None
+_result_cache = ResultCache()
+_metrics_hook = None
+
+
+def set_cache_dir(cache_dir, max_result_bytes=10 * 1024 ** 3):
+    """
+    Function to keep the workflow metadata cache, the index of uploaded
+    inputs, the state of unfinished large uploads and the index of cached
+    run outputs on disk in cache_dir so they survive process restarts
+
+    Args:
+        cache_dir (string): Directory to store the cache files in
+        max_result_bytes (int): Total size of cached run outputs indexed
+            before the least recently used are forgotten, their files are
+            never deleted
+    """
+    global _metadata_cache, _input_index, _tus_state_file, _result_cache
+
+    _metadata_cache = WorkflowMetadataCache(
+        cache_file=os.path.join(cache_dir, 'workflow_metadata.json')
+    )
+    _input_index = InputIndex(
+        index_file=os.path.join(cache_dir, 'input_index.json')
+    )
+    _tus_state_file = os.path.join(cache_dir, 'tus_uploads.json')
+    _result_cache = ResultCache(
+        max_bytes=max_result_bytes,
+        index_file=os.path.join(cache_dir, 'results.json')
+    )
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.metadata_cache = _metadata_cache
+            session.input_index = _input_index
+            session.tus_state_file = _tus_state_file
+            session.result_cache = _result_cache
+
+
+def set_metrics_hook(hook):
     """
-    Function to upload a string to a galaxy history as a dataset
-        write the string to a file then upload the file to the history
-        then remove the file
+    Function to set the hook every launched run passes its timing breakdown
+    to, e.g. to feed it into other metrics systems
 
     Args:
-        gi (GalaxyInstance): GalaxyInstance object
-        history (string): History ID
-        name (string): Name of the dataset
-        string (string): String to be uploaded to the history
+        hook (callable): Called with the dict from
+            run_metrics.RunMetrics.to_dict once each run has finished, None
+            to remove the hook
+    """
+    global _metrics_hook
+
+    _metrics_hook = hook
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.on_metrics = hook
+
+
+def get_session(server, api_key):
+    """
+    Function to get the shared GalaxySession for a server and API key,
+    creating and validating it on first use
+
+    Args:
+        server (string): Galaxy server address
+        api_key (string): User generated string from galaxy instance
+            to create: User > Preferences > Manage API Key > Create a new key
 
     Returns:
-        upload (dict): Dictionary of the uploaded dataset
+        session (GalaxySession): Validated session for the galaxy instance
+        None if server or api key are invalid
     """
-    with open(name, 'w') as f:
-        f.write(string)
-    upload = gi.tools.upload_file(name, history)
-    remove(name)
-    return upload
+    with _sessions_lock:
+        session = _sessions.get((server, api_key))
+    if session is not None:
+        return session
+
+    # Validating talks to the server, so it is done outside the lock to not
+    # hold up sessions of other servers behind a slow or unreachable one
+    session = GalaxySession(
+        server,
+        api_key,
+        metadata_cache=_metadata_cache,
+        input_index=_input_index,
+        tus_state_file=_tus_state_file,
+        result_cache=_result_cache,
+        on_metrics=_metrics_hook
+    )
+    if not session.validate():
+        session.close()
+        return None
+
+    with _sessions_lock:
+        shared = _sessions.setdefault((server, api_key), session)
+        # The hook may have changed while validating
+        shared.on_metrics = _metrics_hook
+    if shared is not session:
+        # Another thread validated the same server first
+        session.close()
+    return shared
 
 
 def check_server_api(server, api_key):
@@ -45,20 +133,7 @@ def check_server_api(server, api_key):
         True if server and api key are valid
         False if server or api key are invalid
     """
-    try:
-        GalaxyInstance(url=server)
-    except ValueError:
-        log.error("Server address is not valid")
-        return False
-
-    try:
-        gi = GalaxyInstance(url=server, key=api_key)
-        gi.workflows.get_workflows()
-    except Exception:
-        log.error("API key is not valid")
-        return False
-
-    return True
+    return get_session(server, api_key) is not None
 
 
 def check_workflow(server, api_key, workflow_name):
@@ -76,13 +151,10 @@ def check_workflow(server, api_key, workflow_name):
         True if workflow exists
         False if workflow does not exist
     """
-    workflow_galaxy = get_workflows(server, api_key)
-
-    if workflow_name not in workflow_galaxy:
-        log.error(f"Workflow {workflow_name} not found on galaxy instance")
+    session = get_session(server, api_key)
+    if session is None:
         return False
-    else:
-        return True
+    return session.check_workflow(workflow_name)
 
 
 def launch_workflow(
@@ -91,7 +163,11 @@ def launch_workflow(
     workflow_name,
     inputs,
     uid=None,
-    from_omni=False
+    from_omni=False,
+    outputs=None,
+    output_dir=None,
+    on_change=None,
+    use_cache=True
 ):
     """
     Function to call galaxy workflow via API
@@ -107,115 +183,182 @@ def launch_workflow(
         uid (string): Unique identifier for the workflow run
         from_omni (bool): If true, the function will save the files to a
             location where they can be accessed by the omniverse extension
+        outputs (array of strings): Names of the outputs to save, None
+            to save every output of the run
+        output_dir (string): Directory to save the outputs in, if not
+            given with from_omni a temporary directory is used
+        on_change (callable): Called with each step change event while the
+            workflow runs, see invocation_watcher.InvocationWatcher
+        use_cache (bool): With from_omni and output_dir, reuse the outputs
+            of an earlier identical run, False to always run the workflow
 
     Returns:
         True if workflow successfully launched
         False if workflow failed to launch
+        With from_omni, output_dir if given (or the directory of the
+            cached outputs), otherwise the TemporaryDirectory holding the
+            outputs
     """
-    # Check server and api key are valid
-    if not check_server_api(server=server, api_key=api_key):
-        return False
-    # Check workflow is accessible / exists
-    if not check_workflow(
-        server=server,
-        api_key=api_key,
-        workflow_name=workflow_name
-    ):
+    session = get_session(server, api_key)
+    if session is None:
         return False
+    return session.launch_workflow(
+        workflow_name,
+        inputs,
+        uid=uid,
+        from_omni=from_omni,
+        outputs=outputs,
+        output_dir=output_dir,
+        on_change=on_change,
+        use_cache=use_cache
+    )
 
-    expected_inputs = get_inputs(
-                                server=server,
-                                api_key=api_key,
-                                workflow_name=workflow_name
-                            )
-
-    gi = GalaxyInstance(url=server, key=api_key)
-
-    # Create new history with name history_name
-    if uid is None:
-        uid = str(uuid.uuid4())
-
-    new_hist = gi.histories.create_history(name=workflow_name + '_' + uid)
-
-    # Upload files and parameters to the history
-    workflow_inputs = {}
-
-    # Setup wf_inputs for the workflow
-    for wf_input in expected_inputs:
-
-        if wf_input[0] == "dataset":
-            uploads = []
-            for name, string in inputs.items():
-                if wf_input[1] != name:
-                    continue
-                # Check for case of input being a file or a string
-                if path.isfile(string):
-                    # Input is a file
-                    uploads.append(
-                        gi.tools.upload_file(string, new_hist['id'])
-                    )
-                else:
-                    # Input is a string
-                    uploads.append(
-                        new_upload(gi, new_hist['id'], name, string)
-                    )
-            workflow_inputs[str(wf_input[2])] = {
-                'src': 'hda',
-                'id': uploads[-1]['outputs'][0]['id']
-            }
-        elif wf_input[0] == "parameter":
-            for name, string in inputs.items():
-                if wf_input[1] == name:
-                    workflow_inputs[str(wf_input[2])] = string
-
-    # Get list of workflows, searching for workflow with name workflow_name
-    api_workflow = gi.workflows.get_workflows(name=workflow_name)
-
-    # Check that all inputs are present before launching
-    if len(workflow_inputs) != len(expected_inputs):
-        log.error("Not all inputs were provided or were not named correctly")
-        return False
 
-    # Call workflow
-    gi.workflows.invoke_workflow(
-        workflow_id=api_workflow[0]['id'],
-        inputs=workflow_inputs,
-        history_id=new_hist['id']
+async def launch_workflow_async(
+    server,
+    api_key,
+    workflow_name,
+    inputs,
+    uid=None,
+    poll_interval=1.0,
+    on_change=None,
+    outputs=None,
+    use_cache=True
+):
+    """
+    Function to launch a galaxy workflow without blocking the event loop,
+    returning as soon as the workflow has been invoked
+
+    Args:
+        server (string): Galaxy server address
+        api_key (string): User generated string from galaxy instance
+            to create: User > Preferences > Manage API Key > Create a new key
+        workflow_name (string): Target workflow name
+        inputs (dict): Dictionary of inputs for the workflow, these should
+            be named the same as the inputs in the workflow
+            format: {input_name: input_string/filename, ...}
+        uid (string): Unique identifier for the workflow run
+        poll_interval (float): Shortest time in seconds between polls of
+            the server while waiting on the invocation
+        on_change (callable): Called with each step change event, see
+            invocation_watcher.InvocationWatcher
+        outputs (array of strings): Names of the outputs that will be
+            downloaded, part of the result cache key
+        use_cache (bool): If true, an earlier identical run is returned
+            from the result cache instead of launching the workflow
+
+    Returns:
+        handle (InvocationHandle): Handle on the running invocation, see
+            async_launch.InvocationHandle
+        handle (CachedResult): Outputs of an earlier identical run, see
+            async_launch.CachedResult
+        False if workflow failed to launch
+    """
+    loop = asyncio.get_event_loop()
+    session = await loop.run_in_executor(None, get_session, server, api_key)
+    if session is None:
+        return False
+    return await _launch_workflow_async(
+        session,
+        workflow_name,
+        inputs,
+        uid=uid,
+        poll_interval=poll_interval,
+        on_change=on_change,
+        outputs=outputs,
+        use_cache=use_cache
     )
 
-    # Gets the invocation of the above workflow and then waits for it to
-    # complete (need to check max time on this - especially for long sim runs)
-    invocation_workflow = gi.invocations.get_invocations(
-        workflow_id=api_workflow[0]['id']
+
+async def launch_sweep_async(
+    server,
+    api_key,
+    workflow_name,
+    base_config,
+    config_input,
+    grid=None,
+    samples=None,
+    inputs=None,
+    max_concurrent=8,
+    poll_interval=5.0,
+    outputs=None,
+    output_dir=None,
+    on_result=None
+):
+    """
+    Function to run a workflow for every point of a parameter sweep over an
+    OpenMC config, sharing one history and one upload of the other inputs
+
+    Args:
+        server (string): Galaxy server address
+        api_key (string): User generated string from galaxy instance
+            to create: User > Preferences > Manage API Key > Create a new key
+        workflow_name (string): Target workflow name
+        base_config (dict or string): Config the sweep starts from, or the
+            path of its JSON file
+        config_input (string): Name of the workflow input the config of
+            each point is given to
+        grid (dict): format: {parameter: [value, ...], ...} where parameter
+            is the dotted path of the value, e.g. 'settings.particles'
+        samples (array of dicts): format: [{parameter: value, ...}, ...]
+        inputs (dict): Other inputs of the workflow, shared by every point
+            format: {input_name: input_string/filename, ...}
+        max_concurrent (int): Maximum number of points running at once
+        poll_interval (float): Shortest time in seconds between polls of
+            the server for each running point
+        outputs (array of strings): Labels of the workflow outputs to
+            download, None for every workflow output
+        output_dir (string): If given, the outputs of each point are saved
+            in output_dir/<point uid>
+        on_result (callable): Called with the row of each point as it
+            finishes
+
+    Returns:
+        results (SweepResults): Results table of the sweep, see
+            sweep.SweepResults
+        False if the workflow or its inputs are not valid
+    """
+    loop = asyncio.get_event_loop()
+    session = await loop.run_in_executor(None, get_session, server, api_key)
+    if session is None:
+        return False
+    return await run_sweep(
+        session,
+        workflow_name,
+        base_config,
+        config_input,
+        grid=grid,
+        samples=samples,
+        inputs=inputs,
+        max_concurrent=max_concurrent,
+        poll_interval=poll_interval,
+        outputs=outputs,
+        output_dir=output_dir,
+        on_result=on_result
     )
-    invocation_id = invocation_workflow[0]['id']
-    gi.invocations.wait_for_invocation(invocation_id=invocation_id)
-
-    # Find the job created by the invocation
-    job = gi.jobs.get_jobs(invocation_id=invocation_id)
-    # Wait for this job to finish
-    gi.jobs.wait_for_job(job_id=job[0]['id'])
-
-    # From omniverse we want to save files in a location where we can access
-    # Pull all the files from the history and save them to a temp location
-    if from_omni:
-        tempdir = tempfile.TemporaryDirectory()
-        for dataset in gi.datasets.get_datasets(history_id=new_hist['id']):
-            download = gi.datasets.download_dataset(
-                file_path=tempdir.name,
-                dataset_id=dataset['id'],
-                use_default_filename=True
-            )
-        download = gi.invocations.get_invocation_biocompute_object(
-            invocation_id=invocation_workflow[0]['id']
-        )
-        dict_to_save = json.dumps(download)
-        bco_fname = tempdir.name + os.sep + 'biocompute_object.json'
-        with open(bco_fname, 'w') as f_write:
-            f_write.write(dict_to_save)
-
-        gi.histories.delete_history(history_id=new_hist['id'])
-        return tempdir
+
+
+def launch_sweep(server, api_key, workflow_name, base_config, config_input, **kwargs):
+    """
+    Blocking version of launch_sweep_async, for use outside of an event loop
+
+    Returns:
+        results (SweepResults): Results table of the sweep
+        False if the workflow or its inputs are not valid
+    """
+    return asyncio.run(launch_sweep_async(
+        server, api_key, workflow_name, base_config, config_input, **kwargs
+    ))
+
+
+def result_cache_stats():
+    """
+    Function to get the hit / miss statistics of the shared result cache
+
+    Returns:
+        stats (dict): See result_cache.ResultCache.stats
+    """
+    return _result_cache.stats()
 
 
 def get_inputs(server, api_key, workflow_name):
@@ -233,39 +376,10 @@ def get_inputs(server, api_key, workflow_name):
             will be in the same order as they should be given in the main call
             format: [(type, name, id), ...]
     """
-    # Check server and api key are valid
-    if not check_server_api(server=server, api_key=api_key):
-        return False
-    # Check workflow exists
-    if not check_workflow(
-        server=server,
-        api_key=api_key,
-        workflow_name=workflow_name
-    ):
+    session = get_session(server, api_key)
+    if session is None:
         return False
-
-    gi = GalaxyInstance(url=server, key=api_key)
-    api_workflow = gi.workflows.get_workflows(name=workflow_name)
-    steps = gi.workflows.export_workflow_dict(api_workflow[0]['id'])['steps']
-    input_array = []
-    for step in steps:
-        inputs = steps[step]['inputs']
-        name = steps[step]['name']
-
-        # Some of the steps don't take inputs so have to skip these
-        # And only pull the inputs from input datasets, not individual tools
-        if len(inputs) > 0 and name == "Input dataset":
-            for wf_input in inputs:
-                input_array.append(
-                    ('dataset', wf_input['name'], steps[step]['id'])
-                )
-        if len(inputs) > 0 and name == "Input parameter":
-            for wf_input in inputs:
-                input_array.append(
-                    ('parameter', wf_input['name'], steps[step]['id'])
-                )
-
-    return input_array
+    return session.get_inputs(workflow_name)
 
 
 def get_outputs(server, api_key, workflow_name):
@@ -282,47 +396,10 @@ def get_outputs(server, api_key, workflow_name):
         outputs (array of strings): Output files given by the workflow,
             these are the names that can be requested as workflow outputs
     """
-    # Check server and api key are valid
-    if not check_server_api(server=server, api_key=api_key):
-        return False
-    if not check_workflow(
-        server=server,
-        api_key=api_key,
-        workflow_name=workflow_name
-    ):
+    session = get_session(server, api_key)
+    if session is None:
         return False
-
-    gi = GalaxyInstance(url=server, key=api_key)
-    api_workflow = gi.workflows.get_workflows(name=workflow_name)
-    steps = gi.workflows.export_workflow_dict(api_workflow[0]['id'])['steps']
-    outputs = []
-
-    for step in steps:
-        # Some of the steps don't take inputs so have to skip these
-        if not len(steps[step]) > 0:
-            continue
-
-        if 'outputs' not in steps[step]:
-            continue
-
-        output_dict = steps[step]['outputs']
-
-        if not len(output_dict) > 0:
-            continue
-
-        # See if output has been renamed & grab that name instead
-        if 'post_job_actions' in steps[step]:
-            post_job_actions = steps[step]['post_job_actions']
-            if 'RenameDatasetActionFile' in post_job_actions:
-                action_file = post_job_actions['RenameDatasetActionFile']
-                name = action_file['action_arguments']['newname']
-                outputs.append(name)
-                continue
-
-        for output in output_dict:
-            outputs.append(output['name'])
-
-    return outputs
+    return session.get_outputs(workflow_name)
 
 
 def get_workflows(server, api_key):
@@ -338,13 +415,7 @@ def get_workflows(server, api_key):
         workflows (array of strings): Workflows available to be run on the
             galaxy instance provided
     """
-    # Check server and api key are valid
-    if not check_server_api(server=server, api_key=api_key):
+    session = get_session(server, api_key)
+    if session is None:
         return False
-
-    gi = GalaxyInstance(url=server, key=api_key)
-    workflows_dict = gi.workflows.get_workflows()
-    workflows = []
-    for item in workflows_dict:
-        workflows.append(item['name'])
-    return workflows
+    return session.get_workflows(refresh=True)
@@ -0,0 +1,140 @@
+import os
+import hashlib
+import threading
+
+from json_store import load_json, save_json
+
+
+HASH_CHUNK_SIZE = 8 * 1024 * 1024
+
+
+def file_sha256(file_path, chunk_size=HASH_CHUNK_SIZE):
+    """
+    Function to get the SHA-256 of a file without reading it all into memory
+
+    Args:
+        file_path (string): Path of the file to hash
+        chunk_size (int): Number of bytes read at a time
+
+    Returns:
+        digest (string): Hex SHA-256 digest of the file
+    """
+    sha = hashlib.sha256()
+    with open(file_path, 'rb') as f_read:
+        for chunk in iter(lambda: f_read.read(chunk_size), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+class InputIndex:
+    """
+    Index from the content hash of workflow input files to datasets that
+    already hold that content on a galaxy server
+
+    Hashing a large file is only done again if its size or modification
+    time changes. If index_file is given the index is stored on disk as
+    JSON so it survives process restarts.
+
+    Args:
+        index_file (string): Optional path of the on-disk JSON index
+    """
+
+    def __init__(self, index_file=None):
+        self.index_file = index_file
+
+        self._lock = threading.Lock()
+        self._datasets = {}
+        self._hashes = {}
+
+        if index_file is not None:
+            self._load()
+
+    def hash_file(self, file_path):
+        """
+        Get the SHA-256 of a file, reusing the stored hash if the file has
+        not changed since it was last hashed
+
+        Args:
+            file_path (string): Path of the file to hash
+
+        Returns:
+            digest (string): Hex SHA-256 digest of the file
+        """
+        file_path = os.path.abspath(file_path)
+        stat = os.stat(file_path)
+        with self._lock:
+            stored = self._hashes.get(file_path)
+        if stored is not None and stored['size'] == stat.st_size \
+                and stored['mtime_ns'] == stat.st_mtime_ns:
+            return stored['sha256']
+
+        digest = file_sha256(file_path)
+        with self._lock:
+            self._hashes[file_path] = {
+                'size': stat.st_size,
+                'mtime_ns': stat.st_mtime_ns,
+                'sha256': digest,
+            }
+        self._save()
+        return digest
+
+    def lookup(self, server, digest):
+        """
+        Get the dataset holding the content with the given hash
+
+        Args:
+            server (string): Galaxy server address
+            digest (string): Hex SHA-256 digest of the content
+
+        Returns:
+            entry (dict): format: {'dataset_id': id, 'size': bytes}
+            None if the content is not on the server
+        """
+        with self._lock:
+            entry = self._datasets.get(_key(server, digest))
+        return dict(entry) if entry is not None else None
+
+    def record(self, server, digest, dataset_id, size):
+        """
+        Record that a dataset on the server holds the content with the
+        given hash
+
+        Args:
+            server (string): Galaxy server address
+            digest (string): Hex SHA-256 digest of the content
+            dataset_id (string): Encoded dataset id
+            size (int): Size of the content in bytes
+        """
+        with self._lock:
+            self._datasets[_key(server, digest)] = {
+                'dataset_id': dataset_id,
+                'size': size,
+            }
+        self._save()
+
+    def forget(self, server, digest):
+        """
+        Remove the dataset recorded for a hash, e.g. once it has been purged
+
+        Args:
+            server (string): Galaxy server address
+            digest (string): Hex SHA-256 digest of the content
+        """
+        with self._lock:
+            self._datasets.pop(_key(server, digest), None)
+        self._save()
+
+    def _load(self):
+        data = load_json(self.index_file, 'input index')
+        self._datasets = data.get('datasets', {})
+        self._hashes = data.get('hashes', {})
+
+    def _save(self):
+        if self.index_file is None:
+            return
+        with self._lock:
+            save_json(self.index_file, {'datasets': self._datasets, 'hashes': self._hashes})
+
+
+def _key(server, digest):
+    return f"{server}|{digest}"
@@ -0,0 +1,239 @@
+import time
+import logging as log
+
+
+# Invocation states after which galaxy will not schedule any more steps
+INVOCATION_TERMINAL_STATES = {'scheduled', 'cancelled', 'failed'}
+INVOCATION_FAILED_STATES = {'cancelled', 'failed'}
+
+# Job states that will not change without user intervention
+JOB_TERMINAL_STATES = {'ok', 'error', 'deleted', 'deleting', 'skipped', 'paused'}
+JOB_FAILED_STATES = {'error', 'deleted', 'deleting', 'paused'}
+
+
+class WorkflowFailedError(Exception):
+    """
+    Raised when an invocation fails or any of its steps' jobs fail
+
+    Args:
+        invocation_id (string): Invocation ID
+        failed_steps (array of dicts): Steps that failed, see
+            InvocationWatcher.steps
+        invocation_state (string): State of the invocation
+    """
+
+    def __init__(self, invocation_id, failed_steps, invocation_state):
+        self.invocation_id = invocation_id
+        self.failed_steps = failed_steps
+        self.invocation_state = invocation_state
+
+        if failed_steps:
+            details = ', '.join(
+                f"step {step['order_index']} ({step['label']}): {step['state']}"
+                for step in failed_steps
+            )
+        else:
+            details = f"invocation {invocation_state}"
+        super().__init__(f"Invocation {invocation_id} failed - {details}")
+
+
+def _combined_state(states):
+    """
+    Reduce the job state counts of a step to a single state
+
+    Args:
+        states (dict): format: {job_state: count, ...}
+
+    Returns:
+        state (string): Failed state if any job failed, 'ok' if all jobs
+            finished, otherwise the state of the least finished job
+    """
+    if len(states) == 0:
+        return 'new'
+    if len(states) == 1:
+        return next(iter(states))
+    for state in states:
+        if state in JOB_FAILED_STATES:
+            return state
+    for state in ('running', 'queued', 'new'):
+        if state in states:
+            return state
+    if all(state in JOB_TERMINAL_STATES for state in states):
+        return 'ok'
+    return 'running'
+
+
+class InvocationWatcher:
+    """
+    Follows every step of a workflow invocation until the whole workflow
+    has finished
+
+    Polls the invocation (for scheduling and the job of each step) and the
+    step jobs summary (for the state of each job), starting at min_interval
+    and backing off towards max_interval while nothing changes. Each change
+    in the state of a step is passed to on_change and yielded by events().
+
+    Args:
+        session (GalaxySession): Session the workflow was launched with
+        invocation_id (string): ID returned by invoke_workflow
+        on_change (callable): Called with each step change event, format:
+            {'invocation_id': id, 'order_index': n, 'label': label,
+            'job_id': id, 'previous': state, 'state': state}
+        min_interval (float): Seconds between polls while steps are changing
+        max_interval (float): Longest wait between polls
+        backoff (float): Factor the interval grows by after a poll with no
+            changes
+    """
+
+    def __init__(
+        self,
+        session,
+        invocation_id,
+        on_change=None,
+        min_interval=1.0,
+        max_interval=30.0,
+        backoff=1.5
+    ):
+        self.session = session
+        self.invocation_id = invocation_id
+        self.on_change = on_change
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+
+        self.interval = min_interval
+        self.invocation_state = 'new'
+        self.steps = {}
+
+    def poll(self):
+        """
+        Poll the server once and update the state of every step
+
+        Returns:
+            events (array of dicts): Step changes since the last poll
+        """
+        gi = self.session.gi
+        invocation = gi.invocations.show_invocation(self.invocation_id)
+        summary = gi.invocations.get_invocation_step_jobs_summary(
+            self.invocation_id
+        )
+        job_states = {job['id']: job.get('states', {}) for job in summary}
+
+        events = []
+        if invocation['state'] != self.invocation_state:
+            events.append(self._event(
+                None, 'invocation', None,
+                self.invocation_state, invocation['state']
+            ))
+            self.invocation_state = invocation['state']
+
+        for step in invocation.get('steps', []):
+            job_id = step.get('job_id') or step.get('implicit_collection_jobs_id')
+            if job_id is None:
+                # Input steps and steps not yet scheduled have no jobs
+                state = step.get('state') or 'new'
+            else:
+                state = _combined_state(job_states.get(job_id, {}))
+
+            order_index = step.get('order_index')
+            label = step.get('workflow_step_label') or str(order_index)
+            previous = self.steps.get(order_index)
+            self.steps[order_index] = {
+                'order_index': order_index,
+                'label': label,
+                'job_id': job_id,
+                'state': state,
+            }
+            if previous is None or previous['state'] != state:
+                events.append(self._event(
+                    order_index, label, job_id,
+                    previous['state'] if previous is not None else None,
+                    state
+                ))
+
+        if len(events) > 0:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.max_interval, self.interval * self.backoff)
+
+        for event in events:
+            if self.on_change is not None:
+                self.on_change(event)
+        return events
+
+    def _event(self, order_index, label, job_id, previous, state):
+        return {
+            'invocation_id': self.invocation_id,
+            'order_index': order_index,
+            'label': label,
+            'job_id': job_id,
+            'previous': previous,
+            'state': state,
+        }
+
+    def failed_steps(self):
+        """Steps whose jobs have failed"""
+        return [
+            step for step in self.steps.values()
+            if step['job_id'] is not None and step['state'] in JOB_FAILED_STATES
+        ]
+
+    @property
+    def failed(self):
+        """True if the invocation or any of its jobs failed"""
+        return self.invocation_state in INVOCATION_FAILED_STATES \
+            or len(self.failed_steps()) > 0
+
+    @property
+    def done(self):
+        """True once the invocation and the jobs of every step are terminal"""
+        if self.failed:
+            return True
+        if self.invocation_state not in INVOCATION_TERMINAL_STATES:
+            return False
+        return all(
+            step['state'] in JOB_TERMINAL_STATES
+            for step in self.steps.values() if step['job_id'] is not None
+        )
+
+    def check(self):
+        """
+        Raise if the invocation has failed
+
+        Raises:
+            WorkflowFailedError if the invocation or any step failed
+        """
+        if self.failed:
+            raise WorkflowFailedError(
+                self.invocation_id,
+                self.failed_steps(),
+                self.invocation_state
+            )
+
+    def wait(self, timeout=None):
+        """
+        Block until every step of the invocation has finished
+
+        Args:
+            timeout (float): Maximum seconds to wait, None to wait
+                indefinitely
+
+        Returns:
+            steps (dict): Final state of each step keyed by order index
+
+        Raises:
+            WorkflowFailedError if the invocation or any step failed
+            TimeoutError if the invocation is not finished in time
+        """
+        start = time.time()
+        while True:
+            self.poll()
+            if self.done:
+                self.check()
+                return self.steps
+            if timeout is not None and time.time() - start > timeout:
+                raise TimeoutError(
+                    f"Invocation {self.invocation_id} did not finish within {timeout} seconds"
+                )
+            log.debug(f"Invocation {self.invocation_id} {self.invocation_state}, next poll in {self.interval:.1f}s")
+            time.sleep(self.interval)
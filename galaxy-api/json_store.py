@@ -0,0 +1,55 @@
+import os
+import json
+import tempfile
+import logging as log
+
+
+def load_json(file_path, description='JSON file'):
+    """
+    Function to read an on-disk JSON store, e.g. a cache index
+
+    Args:
+        file_path (string): Path of the JSON file
+        description (string): What the file holds, used in the warning
+            logged if it cannot be read
+
+    Returns:
+        data (dict): Contents of the file, empty if the file does not
+            exist or cannot be read
+    """
+    if file_path is None or not os.path.exists(file_path):
+        return {}
+    try:
+        with open(file_path, 'r') as f_read:
+            return json.load(f_read)
+    except (OSError, ValueError):
+        log.warning(f"Could not read {description} {file_path}, starting empty")
+        return {}
+
+
+def save_json(file_path, data):
+    """
+    Function to write an on-disk JSON store atomically
+
+    The data is written to a uniquely named temporary file in the same
+    directory and renamed over file_path, so a crash never leaves a half
+    written file and concurrent writers (threads, processes or containers
+    sharing the directory) never write to the same temporary file.
+
+    Args:
+        file_path (string): Path of the JSON file
+        data (dict): JSON serialisable contents
+    """
+    file_dir = os.path.dirname(os.path.abspath(file_path))
+    os.makedirs(file_dir, exist_ok=True)
+    fd, temp_file = tempfile.mkstemp(
+        dir=file_dir, prefix=os.path.basename(file_path) + '.', suffix='.tmp'
+    )
+    try:
+        with os.fdopen(fd, 'w') as f_write:
+            json.dump(data, f_write)
+        os.replace(temp_file, file_path)
+    except BaseException:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+        raise
@@ -0,0 +1,749 @@
+"""
+Local stand-in for the parts of the galaxy REST API used by helper_functs
+and GalaxySession, used to load-test and benchmark the client without a
+galaxy container.
+
+Covers the workflow list and export, histories, pasted / multipart / tus
+uploads (through mock_tus.TusStore), dataset copies, listing, hashing and
+download, invocations with their step job summaries, jobs with their
+metrics, and the biocompute object. Jobs are not run, each tool step of an
+invocation queues and runs for a configurable time and then produces
+outputs of a configurable size.
+"""
+
+import re
+import json
+import time
+import uuid
+import hashlib
+import tempfile
+import threading
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from mock_tus import TusStore
+
+
+TUS_PATH = '/api/upload/resumable_upload/'
+
+# Workflow exported like the OpenMC workflow: two input datasets and one
+# tool step producing the tracks and the TBR tally
+DEFAULT_WORKFLOW = {
+    'name': 'openmc_workflow',
+    'steps': {
+        '0': {
+            'id': 0, 'name': 'Input dataset', 'label': 'CAD',
+            'inputs': [{'name': 'CAD', 'description': ''}], 'outputs': [],
+        },
+        '1': {
+            'id': 1, 'name': 'Input dataset', 'label': 'Config',
+            'inputs': [{'name': 'Config', 'description': ''}], 'outputs': [],
+        },
+        '2': {
+            'id': 2, 'name': 'OpenMC', 'label': 'openmc',
+            'inputs': [],
+            'outputs': [
+                {'name': 'Tracks', 'type': 'h5'},
+                {'name': 'TBR', 'type': 'out'},
+            ],
+            'post_job_actions': {},
+        },
+    },
+}
+
+CHUNK = 1024 * 1024
+
+
+def _new_id():
+    return uuid.uuid4().hex[:16]
+
+
+class GalaxyState:
+    """
+    Workflows, histories, datasets, invocations and jobs held by the
+    stand-in server
+
+    Args:
+        api_key (string): Key requests must send as x-api-key, None to
+            accept any key
+        latency (float): Seconds added to every request
+        workflow (dict): Exported workflow served as the only real workflow,
+            format as DEFAULT_WORKFLOW
+        extra_workflows (int): Number of filler workflows added to the
+            workflow list, to grow the size of that response
+        output_size (int): Bytes in each dataset made by a tool step
+        schedule_seconds (float): Time before a new invocation is scheduled
+        queue_seconds (float): Time each job waits in the queue
+        run_seconds (float): Time each job runs for
+        fail_steps (array of strings): Labels of tool steps whose jobs fail
+        upload_dir (string): Directory for uploaded files
+    """
+
+    def __init__(
+        self,
+        api_key=None,
+        latency=0.0,
+        workflow=None,
+        extra_workflows=0,
+        output_size=1024,
+        schedule_seconds=0.0,
+        queue_seconds=0.0,
+        run_seconds=0.1,
+        fail_steps=(),
+        upload_dir=None
+    ):
+        self.api_key = api_key
+        self.latency = latency
+        self.output_size = output_size
+        self.schedule_seconds = schedule_seconds
+        self.queue_seconds = queue_seconds
+        self.run_seconds = run_seconds
+        self.fail_steps = set(fail_steps)
+
+        self.tus = TusStore(upload_dir, base_path=TUS_PATH, latency=0.0)
+
+        self._lock = threading.Lock()
+        self.histories = {}
+        self.datasets = {}
+        self.invocations = {}
+        self.jobs = {}
+        self.request_counts = {}
+
+        if workflow is None:
+            workflow = DEFAULT_WORKFLOW
+        self.workflows = {}
+        self.add_workflow(workflow)
+        for i in range(extra_workflows):
+            self.add_workflow({'name': f'filler_workflow_{i}', 'steps': {}})
+
+    def add_workflow(self, workflow):
+        """
+        Add an exported workflow dict to the server
+
+        Returns:
+            workflow_id (string)
+        """
+        workflow_id = _new_id()
+        with self._lock:
+            self.workflows[workflow_id] = {
+                'id': workflow_id,
+                'name': workflow['name'],
+                'update_time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'steps': workflow['steps'],
+            }
+        return workflow_id
+
+    def reset_counts(self):
+        """
+        Returns:
+            counts (dict): Requests per route since the last reset
+        """
+        with self._lock:
+            counts = self.request_counts
+            self.request_counts = {}
+        return counts
+
+    ##################
+    # ROUTING
+    ##################
+
+    def handle(self, method, path, headers, body):
+        """
+        Handle one request
+
+        Returns:
+            (status, headers, body) where body is bytes or a
+                (length, iterator of bytes) tuple for streamed downloads
+        """
+        if self.latency:
+            time.sleep(self.latency)
+
+        url = urlparse(path)
+        query = parse_qs(url.query)
+
+        if url.path.startswith(TUS_PATH.rstrip('/')):
+            self._count(method, 'upload/resumable_upload')
+            return self.tus.handle(method, url.path, headers, body)
+
+        if self.api_key is not None and headers.get('x-api-key') != self.api_key:
+            self._count(method, 'unauthorized')
+            return 403, {}, _json({'err_msg': 'Provided API key is not valid.'})
+
+        for route_method, pattern, name in ROUTES:
+            if route_method != method:
+                continue
+            match = re.fullmatch(pattern, url.path)
+            if match is not None:
+                self._count(method, name)
+                payload = _decode_body(headers, body)
+                return getattr(self, name)(*match.groups(), query=query, payload=payload)
+
+        self._count(method, 'not_found')
+        return 404, {}, _json({'err_msg': f'No route for {method} {url.path}'})
+
+    def _count(self, method, name):
+        with self._lock:
+            key = f'{method} {name}'
+            self.request_counts[key] = self.request_counts.get(key, 0) + 1
+
+    ##################
+    # SERVER
+    ##################
+
+    def version(self, query, payload):
+        return 200, {}, _json({'version_major': '23.1', 'version_minor': '1', 'extra': {}})
+
+    def root(self, query, payload):
+        return 200, {'Content-Type': 'text/html'}, b'<html>galaxy stand-in</html>'
+
+    ##################
+    # WORKFLOWS
+    ##################
+
+    def list_workflows(self, query, payload):
+        with self._lock:
+            workflows = [
+                {'id': wf['id'], 'name': wf['name'], 'update_time': wf['update_time'],
+                 'model_class': 'StoredWorkflow', 'deleted': False}
+                for wf in self.workflows.values()
+            ]
+        return 200, {}, _json(workflows)
+
+    def export_workflow(self, workflow_id, query, payload):
+        workflow = self.workflows.get(workflow_id)
+        if workflow is None:
+            return 404, {}, _json({'err_msg': 'Workflow not found'})
+        return 200, {}, _json({
+            'a_galaxy_workflow': 'true',
+            'format-version': '0.1',
+            'name': workflow['name'],
+            'steps': workflow['steps'],
+        })
+
+    def invoke_workflow(self, workflow_id, query, payload):
+        workflow = self.workflows.get(workflow_id)
+        if workflow is None:
+            return 404, {}, _json({'err_msg': 'Workflow not found'})
+        history_id = payload.get('history_id')
+        history = payload.get('history', '')
+        if history.startswith('hist_id='):
+            history_id = history[len('hist_id='):]
+        if history_id not in self.histories:
+            return 400, {}, _json({'err_msg': 'History not found'})
+
+        invocation_id = _new_id()
+        now = time.time()
+        start = now + self.schedule_seconds
+        steps = []
+        outputs = {}
+        for key in sorted(workflow['steps'], key=int):
+            step = workflow['steps'][key]
+            label = step.get('label') or str(step['id'])
+            if step['name'] in ('Input dataset', 'Input parameter'):
+                steps.append({
+                    'id': _new_id(), 'order_index': step['id'],
+                    'workflow_step_label': label, 'job_id': None,
+                    'state': 'scheduled',
+                })
+                continue
+
+            job_id = _new_id()
+            queued = start
+            running = queued + self.queue_seconds
+            finished = running + self.run_seconds
+            start = finished
+            output_ids = []
+            for output in step.get('outputs', []):
+                dataset_id = self._add_dataset(
+                    history_id, output['name'], output.get('type', 'data'),
+                    size=self.output_size, job_id=job_id
+                )
+                outputs[output['name']] = {'id': dataset_id, 'src': 'hda'}
+                output_ids.append(dataset_id)
+            with self._lock:
+                self.jobs[job_id] = {
+                    'id': job_id,
+                    'tool_id': step['name'],
+                    'history_id': history_id,
+                    'create_time': now,
+                    'queued': queued,
+                    'running': running,
+                    'finished': finished,
+                    'failed': label in self.fail_steps,
+                    'outputs': output_ids,
+                }
+            steps.append({
+                'id': _new_id(), 'order_index': step['id'],
+                'workflow_step_label': label, 'job_id': job_id,
+                'state': 'scheduled',
+            })
+
+        with self._lock:
+            self.invocations[invocation_id] = {
+                'id': invocation_id,
+                'workflow_id': workflow_id,
+                'history_id': history_id,
+                'create_time': now,
+                'scheduled': now + self.schedule_seconds,
+                'cancelled': False,
+                'steps': steps,
+                'outputs': outputs,
+                'inputs': payload.get('inputs', {}),
+            }
+        return 200, {}, _json(self._invocation(invocation_id))
+
+    ##################
+    # HISTORIES
+    ##################
+
+    def create_history(self, query, payload):
+        history_id = _new_id()
+        history = {
+            'id': history_id,
+            'name': payload.get('name', 'Unnamed history'),
+            'deleted': False,
+            'purged': False,
+        }
+        with self._lock:
+            self.histories[history_id] = history
+        return 200, {}, _json(history)
+
+    def list_histories(self, query, payload):
+        with self._lock:
+            histories = [
+                dict(history) for history in self.histories.values()
+                if not history['deleted']
+            ]
+        return 200, {}, _json(histories)
+
+    def delete_history(self, history_id, query, payload):
+        with self._lock:
+            history = self.histories.get(history_id)
+            if history is None:
+                return 404, {}, _json({'err_msg': 'History not found'})
+            history['deleted'] = True
+            for dataset in self.datasets.values():
+                if dataset['history_id'] == history_id:
+                    dataset['deleted'] = True
+        return 200, {}, _json(history)
+
+    def copy_content(self, history_id, query, payload):
+        source = self.datasets.get(payload.get('content'))
+        if source is None or history_id not in self.histories:
+            return 404, {}, _json({'err_msg': 'Dataset not found'})
+        dataset_id = _new_id()
+        with self._lock:
+            self.datasets[dataset_id] = dict(
+                source, id=dataset_id, history_id=history_id, deleted=False,
+                hashes=list(source['hashes'])
+            )
+        return 200, {}, _json(self._dataset(dataset_id))
+
+    ##################
+    # UPLOADS
+    ##################
+
+    def run_tool(self, query, payload):
+        inputs = payload.get('inputs', {})
+        if isinstance(inputs, str):
+            inputs = json.loads(inputs)
+        history_id = payload.get('history_id')
+        if history_id not in self.histories:
+            return 400, {}, _json({'err_msg': 'History not found'})
+
+        content = payload.get('files_0|url_paste')
+        if content is None:
+            content = payload.get('files_0|file_data', b'')
+        if isinstance(content, str):
+            content = content.encode('utf-8')
+        name = inputs.get('files_0|NAME') or 'Pasted Entry'
+        dataset_id = self._add_dataset(history_id, name, 'txt', content=content)
+        return 200, {}, _json(self._upload_response(dataset_id))
+
+    def fetch(self, query, payload):
+        history_id = payload.get('history_id')
+        if history_id not in self.histories:
+            return 400, {}, _json({'err_msg': 'History not found'})
+        file_data = payload['files_0|file_data']
+        upload_id = file_data['session_id']
+        if upload_id not in self.tus.uploads:
+            return 400, {}, _json({'err_msg': 'Upload not found'})
+        with open(self.tus.file_path(upload_id), 'rb') as f_read:
+            content = f_read.read()
+        name = payload['targets'][0]['elements'][0].get('name') or file_data.get('name')
+        dataset_id = self._add_dataset(history_id, name, 'data', content=content)
+        return 200, {}, _json(self._upload_response(dataset_id))
+
+    def _upload_response(self, dataset_id):
+        return {
+            'outputs': [self._dataset(dataset_id)],
+            'jobs': [{'id': _new_id(), 'state': 'ok'}],
+            'implicit_collections': [],
+            'output_collections': [],
+        }
+
+    ##################
+    # DATASETS
+    ##################
+
+    def _add_dataset(self, history_id, name, ext, content=None, size=0, job_id=None):
+        dataset_id = _new_id()
+        if content is not None:
+            size = len(content)
+        with self._lock:
+            self.datasets[dataset_id] = {
+                'id': dataset_id,
+                'history_id': history_id,
+                'name': name,
+                'extension': ext,
+                'file_size': size,
+                'content': content,
+                'sha256': hashlib.sha256(content).hexdigest() if content is not None else None,
+                'job_id': job_id,
+                'deleted': False,
+                'hashes': [],
+            }
+        return dataset_id
+
+    def _dataset_state(self, dataset):
+        if dataset['job_id'] is None:
+            return 'ok'
+        state = self._job_state(self.jobs[dataset['job_id']])
+        if state in ('new', 'queued', 'running'):
+            return state
+        return 'ok' if state == 'ok' else 'error'
+
+    def _dataset(self, dataset_id):
+        dataset = self.datasets[dataset_id]
+        return {
+            'id': dataset_id,
+            'history_id': dataset['history_id'],
+            'name': dataset['name'],
+            'state': self._dataset_state(dataset),
+            'file_ext': dataset['extension'],
+            'extension': dataset['extension'],
+            'file_size': dataset['file_size'],
+            'deleted': dataset['deleted'],
+            'purged': False,
+            'visible': True,
+            'hashes': list(dataset['hashes']),
+            'creating_job': dataset['job_id'],
+            'history_content_type': 'dataset',
+            'model_class': 'HistoryDatasetAssociation',
+            'download_url': f'/api/datasets/{dataset_id}/display',
+        }
+
+    def list_datasets(self, query, payload):
+        history_id = query.get('history_id', [None])[0]
+        with self._lock:
+            ids = [
+                dataset_id for dataset_id, dataset in self.datasets.items()
+                if history_id is None or dataset['history_id'] == history_id
+            ]
+        return 200, {}, _json([self._dataset(dataset_id) for dataset_id in ids])
+
+    def show_dataset(self, dataset_id, query, payload):
+        if dataset_id not in self.datasets:
+            return 404, {}, _json({'err_msg': 'Dataset not found'})
+        return 200, {}, _json(self._dataset(dataset_id))
+
+    def hash_dataset(self, dataset_id, query, payload):
+        dataset = self.datasets.get(dataset_id)
+        if dataset is None:
+            return 404, {}, _json({'err_msg': 'Dataset not found'})
+        if dataset['sha256'] is not None and not dataset['hashes']:
+            dataset['hashes'].append({
+                'hash_function': 'SHA-256',
+                'hash_value': dataset['sha256'],
+            })
+        return 200, {}, _json({'id': _new_id(), 'ready': True})
+
+    def display_dataset(self, dataset_id, query, payload):
+        dataset = self.datasets.get(dataset_id)
+        if dataset is None:
+            return 404, {}, _json({'err_msg': 'Dataset not found'})
+        filename = f"{dataset['name']}.{dataset['extension']}"
+        headers = {
+            'Content-Type': 'application/octet-stream',
+            'Content-Disposition': f'attachment; filename="{filename}"',
+        }
+        if dataset['content'] is not None:
+            return 200, headers, dataset['content']
+        return 200, headers, (dataset['file_size'], _filler(dataset['file_size']))
+
+    ##################
+    # INVOCATIONS AND JOBS
+    ##################
+
+    def _job_state(self, job, now=None):
+        if now is None:
+            now = time.time()
+        if job.get('cancelled'):
+            return 'deleted'
+        if now < job['queued']:
+            return 'new'
+        if now < job['running']:
+            return 'queued'
+        if now < job['finished']:
+            return 'running'
+        return 'error' if job['failed'] else 'ok'
+
+    def _invocation(self, invocation_id):
+        invocation = self.invocations[invocation_id]
+        now = time.time()
+        if invocation['cancelled']:
+            state = 'cancelled'
+        elif now < invocation['scheduled']:
+            state = 'new'
+        else:
+            state = 'scheduled'
+        return {
+            'id': invocation_id,
+            'model_class': 'WorkflowInvocation',
+            'workflow_id': invocation['workflow_id'],
+            'history_id': invocation['history_id'],
+            'state': state,
+            'steps': [dict(step) for step in invocation['steps']],
+            'outputs': invocation['outputs'] if state == 'scheduled' else {},
+            'inputs': invocation['inputs'],
+        }
+
+    def show_invocation(self, invocation_id, query, payload):
+        if invocation_id not in self.invocations:
+            return 404, {}, _json({'err_msg': 'Invocation not found'})
+        return 200, {}, _json(self._invocation(invocation_id))
+
+    def cancel_invocation(self, invocation_id, query, payload):
+        invocation = self.invocations.get(invocation_id)
+        if invocation is None:
+            return 404, {}, _json({'err_msg': 'Invocation not found'})
+        with self._lock:
+            invocation['cancelled'] = True
+            for step in invocation['steps']:
+                job = self.jobs.get(step['job_id'])
+                if job is not None and self._job_state(job) not in ('ok', 'error'):
+                    job['cancelled'] = True
+        return 200, {}, _json(self._invocation(invocation_id))
+
+    def step_jobs_summary(self, invocation_id, query, payload):
+        invocation = self.invocations.get(invocation_id)
+        if invocation is None:
+            return 404, {}, _json({'err_msg': 'Invocation not found'})
+        now = time.time()
+        summary = []
+        for step in invocation['steps']:
+            job = self.jobs.get(step['job_id'])
+            if job is None:
+                continue
+            state = self._job_state(job, now)
+            summary.append({
+                'id': job['id'],
+                'model': 'Job',
+                'populated_state': 'ok',
+                'states': {state: 1},
+            })
+        return 200, {}, _json(summary)
+
+    def biocompute(self, invocation_id, query, payload):
+        invocation = self.invocations.get(invocation_id)
+        if invocation is None:
+            return 404, {}, _json({'err_msg': 'Invocation not found'})
+        return 200, {}, _json({
+            'object_id': f'mock://invocations/{invocation_id}',
+            'spec_version': 'https://w3id.org/ieee/ieee-2791-schema/2791object.json',
+            'provenance_domain': {'name': self.workflows[invocation['workflow_id']]['name']},
+            'description_domain': {
+                'pipeline_steps': [
+                    {'step_number': step['order_index'], 'name': step['workflow_step_label']}
+                    for step in invocation['steps']
+                ],
+            },
+        })
+
+    def show_job(self, job_id, query, payload):
+        job = self.jobs.get(job_id)
+        if job is None:
+            return 404, {}, _json({'err_msg': 'Job not found'})
+        return 200, {}, _json({
+            'id': job_id,
+            'tool_id': job['tool_id'],
+            'history_id': job['history_id'],
+            'state': self._job_state(job),
+            'create_time': _iso(job['create_time']),
+            'update_time': _iso(min(time.time(), job['finished'])),
+            'outputs': {
+                str(i): {'id': dataset_id, 'src': 'hda'}
+                for i, dataset_id in enumerate(job['outputs'])
+            },
+        })
+
+    def job_metrics(self, job_id, query, payload):
+        job = self.jobs.get(job_id)
+        if job is None:
+            return 404, {}, _json({'err_msg': 'Job not found'})
+        if self._job_state(job) not in ('ok', 'error'):
+            return 200, {}, _json([])
+        runtime = job['finished'] - job['running']
+        return 200, {}, _json([
+            _metric('runtime_seconds', runtime),
+            _metric('start_epoch', job['running']),
+            _metric('end_epoch', job['finished']),
+            _metric('galaxy_slots', 1),
+            _metric('galaxy_memory_mb', 4096),
+        ])
+
+
+# (method, path pattern, GalaxyState method)
+ROUTES = [
+    ('GET', r'/', 'root'),
+    ('GET', r'/api/version', 'version'),
+    ('GET', r'/api/workflows', 'list_workflows'),
+    ('GET', r'/api/workflows/download/([^/]+)', 'export_workflow'),
+    ('POST', r'/api/workflows/([^/]+)/invocations', 'invoke_workflow'),
+    ('GET', r'/api/histories', 'list_histories'),
+    ('POST', r'/api/histories', 'create_history'),
+    ('DELETE', r'/api/histories/([^/]+)', 'delete_history'),
+    ('POST', r'/api/histories/([^/]+)/contents', 'copy_content'),
+    ('POST', r'/api/tools', 'run_tool'),
+    ('POST', r'/api/tools/fetch', 'fetch'),
+    ('GET', r'/api/datasets', 'list_datasets'),
+    ('GET', r'/api/datasets/([^/]+)', 'show_dataset'),
+    ('PUT', r'/api/datasets/([^/]+)/hash', 'hash_dataset'),
+    ('GET', r'/api/datasets/([^/]+)/display', 'display_dataset'),
+    ('GET', r'/api/invocations/([^/]+)', 'show_invocation'),
+    ('DELETE', r'/api/invocations/([^/]+)', 'cancel_invocation'),
+    ('GET', r'/api/invocations/([^/]+)/step_jobs_summary', 'step_jobs_summary'),
+    ('GET', r'/api/invocations/([^/]+)/biocompute', 'biocompute'),
+    ('GET', r'/api/jobs/([^/]+)', 'show_job'),
+    ('GET', r'/api/jobs/([^/]+)/metrics', 'job_metrics'),
+]
+
+
+def _json(data):
+    return json.dumps(data).encode('utf-8')
+
+
+def _iso(timestamp):
+    fraction = f'{timestamp % 1:.6f}'[1:]
+    return time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(timestamp)) + fraction
+
+
+def _metric(name, value):
+    return {
+        'name': name,
+        'plugin': 'core',
+        'raw_value': str(value),
+        'value': str(value),
+        'title': name,
+    }
+
+
+def _filler(size):
+    block = b'0123456789abcdef' * (CHUNK // 16)
+    sent = 0
+    while sent < size:
+        chunk = block[:min(CHUNK, size - sent)]
+        sent += len(chunk)
+        yield chunk
+
+
+def _decode_body(headers, body):
+    """Decode a JSON, form or multipart request body into a dict"""
+    if not body:
+        return {}
+    content_type = headers.get('Content-Type', '')
+    if content_type.startswith('multipart/form-data'):
+        return _parse_multipart(content_type, body)
+    try:
+        return json.loads(body)
+    except ValueError:
+        return {}
+
+
+def _parse_multipart(content_type, body):
+    boundary = content_type.split('boundary=', 1)[1].strip('"').encode('ascii')
+    fields = {}
+    for part in body.split(b'--' + boundary):
+        if b'\r\n\r\n' not in part:
+            continue
+        head, value = part.split(b'\r\n\r\n', 1)
+        name = re.search(rb'name="([^"]+)"', head)
+        if name is None:
+            continue
+        value = value[:-2] if value.endswith(b'\r\n') else value
+        key = name.group(1).decode('utf-8')
+        if b'filename=' in head:
+            fields[key] = value
+        else:
+            text = value.decode('utf-8')
+            try:
+                fields[key] = json.loads(text) if key == 'inputs' else text
+            except ValueError:
+                fields[key] = text
+    return fields
+
+
+class _GalaxyHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def _handle(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length) if length else b''
+        status, headers, content = self.server.state.handle(
+            self.command, self.path, self.headers, body
+        )
+        self.send_response(status)
+        headers = dict(headers)
+        headers.setdefault('Content-Type', 'application/json')
+        for key, value in headers.items():
+            self.send_header(key, value)
+        if isinstance(content, tuple):
+            length, chunks = content
+        else:
+            length, chunks = len(content), [content]
+        self.send_header('Content-Length', str(length))
+        self.end_headers()
+        if self.command == 'HEAD':
+            return
+        for chunk in chunks:
+            self.wfile.write(chunk)
+
+    do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = do_HEAD = do_OPTIONS = _handle
+
+    def log_message(self, format, *args):
+        pass
+
+
+class GalaxyStubServer:
+    """
+    Threaded galaxy stand-in running in the background on a free local port
+
+    Args:
+        **kwargs: Passed on to GalaxyState, e.g. latency, output_size,
+            run_seconds or fail_steps
+    """
+
+    def __init__(self, **kwargs):
+        self._tempdir = None
+        if kwargs.get('upload_dir') is None:
+            self._tempdir = tempfile.TemporaryDirectory()
+            kwargs['upload_dir'] = self._tempdir.name
+        self.state = GalaxyState(**kwargs)
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), _GalaxyHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.state = self.state
+        self.url = f"http://127.0.0.1:{self.httpd.server_port}"
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self._tempdir is not None:
+            self._tempdir.cleanup()
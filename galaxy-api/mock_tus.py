@@ -0,0 +1,177 @@
+"""
+Local stand-in for a tus upload server (tusd), used to benchmark the
+resumable uploads in tus_upload.py without a galaxy instance.
+
+Supports the creation, concatenation and termination-free core of the tus
+1.0.0 protocol, stores uploads in a directory and can be told to drop
+connections part way through to exercise resuming.
+"""
+
+import os
+import uuid
+import time
+import tempfile
+import threading
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class TusStore:
+    """
+    Uploads held by the stand-in server
+
+    Args:
+        storage_dir (string): Directory to write the uploaded files to
+        base_path (string): URL path the uploads are served under
+        latency (float): Seconds added to every request
+        fail_after (int): Number of PATCH requests accepted before every
+            further PATCH fails, None to never fail
+    """
+
+    def __init__(self, storage_dir, base_path='/files/', latency=0.0, fail_after=None):
+        self.storage_dir = storage_dir
+        self.base_path = base_path
+        self.latency = latency
+        self.fail_after = fail_after
+
+        self.uploads = {}
+        self.patch_count = 0
+        self.bytes_received = 0
+        self._lock = threading.Lock()
+
+    def file_path(self, upload_id):
+        return os.path.join(self.storage_dir, upload_id)
+
+    def handle(self, method, path, headers, body):
+        """
+        Handle one tus request
+
+        Returns:
+            (status, headers, body)
+        """
+        if self.latency:
+            time.sleep(self.latency)
+
+        tus_headers = {'Tus-Resumable': '1.0.0'}
+
+        if method == 'OPTIONS':
+            tus_headers.update({
+                'Tus-Version': '1.0.0',
+                'Tus-Extension': 'creation,concatenation',
+            })
+            return 204, tus_headers, b''
+
+        if method == 'POST':
+            concat = headers.get('Upload-Concat', '')
+            upload_id = uuid.uuid4().hex
+            if concat.startswith('final;'):
+                part_ids = [
+                    url.rstrip('/').rsplit('/', 1)[-1]
+                    for url in concat[len('final;'):].split()
+                ]
+                with open(self.file_path(upload_id), 'wb') as f_write:
+                    for part_id in part_ids:
+                        with open(self.file_path(part_id), 'rb') as f_read:
+                            f_write.write(f_read.read())
+                length = os.path.getsize(self.file_path(upload_id))
+                upload = {'length': length, 'offset': length}
+            else:
+                length = int(headers['Upload-Length'])
+                open(self.file_path(upload_id), 'wb').close()
+                upload = {'length': length, 'offset': 0}
+            with self._lock:
+                self.uploads[upload_id] = upload
+            tus_headers['Location'] = self.base_path + upload_id
+            return 201, tus_headers, b''
+
+        upload_id = path.rstrip('/').rsplit('/', 1)[-1]
+        with self._lock:
+            upload = self.uploads.get(upload_id)
+        if upload is None:
+            return 404, tus_headers, b''
+
+        if method == 'HEAD':
+            tus_headers.update({
+                'Upload-Offset': str(upload['offset']),
+                'Upload-Length': str(upload['length']),
+            })
+            return 200, tus_headers, b''
+
+        if method == 'PATCH':
+            with self._lock:
+                self.patch_count += 1
+                failing = self.fail_after is not None \
+                    and self.patch_count > self.fail_after
+            if failing:
+                return 500, tus_headers, b'simulated connection drop'
+            if int(headers['Upload-Offset']) != upload['offset']:
+                return 409, tus_headers, b'offset mismatch'
+            with open(self.file_path(upload_id), 'r+b') as f_write:
+                f_write.seek(upload['offset'])
+                f_write.write(body)
+            with self._lock:
+                upload['offset'] += len(body)
+                self.bytes_received += len(body)
+            tus_headers['Upload-Offset'] = str(upload['offset'])
+            return 204, tus_headers, b''
+
+        return 405, tus_headers, b''
+
+
+class _TusHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def _handle(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length) if length else b''
+        status, headers, content = self.server.store.handle(
+            self.command, self.path, self.headers, body
+        )
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(content)
+
+    do_OPTIONS = do_POST = do_HEAD = do_PATCH = _handle
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TusStubServer:
+    """
+    Threaded tus server running in the background on a free local port
+
+    Args:
+        storage_dir (string): Directory for the uploads, a temporary
+            directory is used if not given
+        latency (float): Seconds added to every request
+        fail_after (int): Number of PATCH requests accepted before every
+            further PATCH fails, None to never fail
+    """
+
+    def __init__(self, storage_dir=None, latency=0.0, fail_after=None):
+        self._tempdir = None
+        if storage_dir is None:
+            self._tempdir = tempfile.TemporaryDirectory()
+            storage_dir = self._tempdir.name
+        self.store = TusStore(storage_dir, latency=latency, fail_after=fail_after)
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), _TusHandler)
+        self.httpd.store = self.store
+        self.url = f"http://127.0.0.1:{self.httpd.server_port}/files/"
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self._tempdir is not None:
+            self._tempdir.cleanup()
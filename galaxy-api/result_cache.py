@@ -0,0 +1,246 @@
+import os
+import json
+import time
+import tempfile
+import hashlib
+import threading
+import logging as log
+
+from json_store import load_json, save_json
+
+
+def value_sha256(value):
+    """
+    Function to get the SHA-256 of a workflow input given as a value rather
+    than a file, e.g. pasted text or a parameter
+
+    Args:
+        value: String, bytes or any JSON serialisable value
+
+    Returns:
+        digest (string): Hex SHA-256 digest of the value
+    """
+    if isinstance(value, str):
+        value = value.encode('utf-8')
+    elif not isinstance(value, bytes):
+        value = json.dumps(value, sort_keys=True).encode('utf-8')
+    return hashlib.sha256(value).hexdigest()
+
+
+def result_key(server, workflow_id, update_time, input_hashes, outputs=None):
+    """
+    Function to build the cache key of a workflow run
+
+    Args:
+        server (string): Galaxy server address
+        workflow_id (string): Encoded workflow id
+        update_time (string): Update time of the workflow, changes with
+            every new version of the workflow
+        input_hashes (dict): Content hash of each input
+            format: {input_name: digest, ...}
+        outputs (array of strings): Names of the outputs saved, None for
+            every output
+
+    Returns:
+        key (string): Hex SHA-256 of the run description
+    """
+    description = {
+        'server': server,
+        'workflow_id': workflow_id,
+        'update_time': update_time,
+        'inputs': input_hashes,
+        'outputs': sorted(outputs) if outputs is not None else None,
+    }
+    return value_sha256(json.dumps(description, sort_keys=True))
+
+
+def cacheable_dir(dest_dir):
+    """
+    Function to check if outputs saved in a directory can be cached, those
+    in the temporary directory may be removed at any time so are never
+    cached
+
+    Args:
+        dest_dir (string): Directory the outputs are saved in
+
+    Returns:
+        True if the outputs can be cached
+    """
+    temp_dir = os.path.realpath(tempfile.gettempdir())
+    dest_dir = os.path.realpath(dest_dir)
+    return os.path.commonpath([temp_dir, dest_dir]) != temp_dir
+
+
+class ResultCache:
+    """
+    Cache of the downloaded outputs of workflow runs, keyed by result_key
+
+    Each entry points at the directory the outputs of a run were saved in
+    (e.g. omni-data/<uid>), so a hit hands back those files without
+    launching the workflow again. The directories belong to the caller, the
+    cache never deletes files: once the total size of the entries is over
+    max_bytes the least recently used entries are dropped from the index
+    and their files left in place. An entry whose files have been deleted
+    outside of the cache is dropped on lookup.
+
+    If index_file is given the cache index is stored on disk as JSON so it
+    survives process restarts.
+
+    Args:
+        max_bytes (int): Total size of the cached outputs before the least
+            recently used entries are dropped from the index, None for no
+            limit
+        index_file (string): Optional path of the on-disk JSON index
+    """
+
+    def __init__(self, max_bytes=10 * 1024 ** 3, index_file=None):
+        self.max_bytes = max_bytes
+        self.index_file = index_file
+
+        self._lock = threading.Lock()
+        self._entries = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if index_file is not None:
+            self._load()
+
+    def get(self, key):
+        """
+        Get the outputs of an earlier run
+
+        Args:
+            key (string): Key from result_key
+
+        Returns:
+            entry (dict): format: {'dir': path, 'files': [path, ...],
+                'size': bytes, 'invocation_id': id, 'stored_at': time,
+                'last_used': time}
+            None if the run is not cached
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and not all(
+                os.path.isfile(file_path) for file_path in entry['files']
+            ):
+                log.info(f"Cached outputs in {entry['dir']} are missing, running again")
+                del self._entries[key]
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            entry['last_used'] = time.time()
+            entry = dict(entry, files=list(entry['files']))
+        self._save()
+        return entry
+
+    def put(self, key, output_dir, files, invocation_id=None):
+        """
+        Store the outputs of a run, dropping the least recently used runs
+        from the index if the cache is over max_bytes
+
+        Args:
+            key (string): Key from result_key
+            output_dir (string): Directory the outputs were saved in
+            files (array of strings): Paths of the saved files
+            invocation_id (string): Invocation that made the outputs
+        """
+        files = [os.path.abspath(file_path) for file_path in files]
+        now = time.time()
+        with self._lock:
+            self._entries[key] = {
+                'dir': os.path.abspath(output_dir),
+                'files': files,
+                'size': sum(os.path.getsize(file_path) for file_path in files),
+                'invocation_id': invocation_id,
+                'stored_at': now,
+                'last_used': now,
+            }
+            self._evict(keep=key)
+        self._save()
+
+    def forget(self, key):
+        """
+        Remove a run from the cache, leaving its files in place
+
+        Args:
+            key (string): Key from result_key
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+        self._save()
+
+    def clear(self):
+        """Remove every run from the cache, leaving their files in place"""
+        with self._lock:
+            self._entries = {}
+        self._save()
+
+    def size(self):
+        """Total size in bytes of the cached outputs"""
+        with self._lock:
+            return sum(entry['size'] for entry in self._entries.values())
+
+    def stats(self):
+        """
+        Returns:
+            stats (dict): format: {'hits': n, 'misses': n, 'hit_rate': r,
+                'evictions': n, 'entries': n, 'size': bytes,
+                'max_bytes': bytes}
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups > 0 else 0.0,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'size': sum(entry['size'] for entry in self._entries.values()),
+                'max_bytes': self.max_bytes,
+            }
+
+    def _evict(self, keep=None):
+        """
+        Drop the least recently used entries from the index until the cache
+        fits in max_bytes, must be called holding the lock. Their files are
+        left in place
+
+        Args:
+            keep (string): Key that is never evicted, e.g. the one just stored
+
+        Returns:
+            evicted (array of dicts): Entries removed
+        """
+        evicted = []
+        if self.max_bytes is None:
+            return evicted
+
+        total = sum(entry['size'] for entry in self._entries.values())
+        for key, entry in sorted(
+            self._entries.items(), key=lambda item: item[1]['last_used']
+        ):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            del self._entries[key]
+            total -= entry['size']
+            evicted.append(entry)
+            log.info(f"Dropping cached outputs in {entry['dir']} from the result cache")
+        self.evictions += len(evicted)
+        return evicted
+
+    def _load(self):
+        self._entries = load_json(self.index_file, 'result cache').get('entries', {})
+
+    def _save(self):
+        if self.index_file is None:
+            return
+        with self._lock:
+            save_json(self.index_file, {'entries': self._entries})
@@ -0,0 +1,334 @@
+import os
+import json
+import time
+import calendar
+import threading
+import contextvars
+import logging as log
+
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+
+METRICS_FILE = 'run_metrics.json'
+
+# Metrics of the run the current thread / task is working on, requests made
+# while it is set are recorded against that run
+_current = contextvars.ContextVar('run_metrics', default=None)
+
+
+def current_metrics():
+    """
+    Returns:
+        metrics (RunMetrics): Metrics of the run being worked on, None if no
+            run is being recorded
+    """
+    return _current.get()
+
+
+def submit_with_context(executor, func, *args, **kwargs):
+    """
+    Function to submit work to a thread pool so requests it makes are
+    recorded against the run that submitted it
+
+    Args:
+        executor (concurrent.futures.Executor): Pool to submit to
+        func (callable): Function to call
+        *args, **kwargs: Arguments for func
+
+    Returns:
+        future (concurrent.futures.Future)
+    """
+    return executor.submit(contextvars.copy_context().run, func, *args, **kwargs)
+
+
+def _epoch(timestamp):
+    """Convert a galaxy ISO time (UTC, no zone) to seconds since the epoch"""
+    if timestamp is None:
+        return None
+    seconds, _, fraction = timestamp.partition('.')
+    epoch = calendar.timegm(time.strptime(seconds, '%Y-%m-%dT%H:%M:%S'))
+    if fraction:
+        epoch += float('0.' + fraction)
+    return epoch
+
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return value
+
+
+class RunMetrics:
+    """
+    Timing breakdown of one workflow run
+
+    Records the phases of the launch on the client (validate, upload,
+    invoke, wait, download, ...), every API request made during them with
+    its duration and the bytes sent and received, when each workflow step
+    was first seen in each job state, and the galaxy job metrics of each
+    step (runtime_seconds, start_epoch, end_epoch, ...).
+
+    From these each job gets
+        queue_seconds: job created to first seen running (or to the start
+            of the tool command if the running state was not seen)
+        startup_seconds: time in the running state not spent in the tool
+            command, e.g. pulling and starting the container
+        runtime_seconds: galaxy measured runtime of the tool command
+    Step states are seen by polling, so the first two are only as precise
+    as the poll interval.
+
+    Args:
+        workflow_name (string): Target workflow name
+        uid (string): Unique identifier for the workflow run
+    """
+
+    def __init__(self, workflow_name=None, uid=None):
+        self.workflow_name = workflow_name
+        self.uid = uid
+        self.invocation_id = None
+        self.history_id = None
+        self.state = 'running'
+        self.started = time.time()
+        self.finished = None
+
+        self.phases = []
+        self.requests = []
+        self.steps = {}
+        self.jobs = {}
+
+        self._phase = None
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def activate(self):
+        """Record the requests made by the current thread against this run"""
+        token = _current.set(self)
+        try:
+            yield self
+        finally:
+            _current.reset(token)
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Time a phase of the run, requests made inside it are recorded
+        against the phase
+
+        Args:
+            name (string): Name of the phase
+        """
+        previous = self._phase
+        self._phase = name
+        start = time.time()
+        try:
+            with self.activate():
+                yield self
+        finally:
+            end = time.time()
+            self._phase = previous
+            with self._lock:
+                self.phases.append({
+                    'name': name,
+                    'start': start,
+                    'end': end,
+                    'seconds': end - start,
+                })
+
+    def add_request(self, method, url, status, seconds, sent=0, received=0):
+        """
+        Record one API request
+
+        Args:
+            method (string): HTTP method
+            url (string): Requested URL
+            status (int): HTTP status code, None if no response
+            seconds (float): Time taken by the request
+            sent (int): Bytes in the request body
+            received (int): Bytes in the response body
+        """
+        with self._lock:
+            self.requests.append({
+                'phase': self._phase,
+                'method': method,
+                'path': urlparse(url).path,
+                'status': status,
+                'start': time.time() - seconds,
+                'seconds': seconds,
+                'bytes_sent': sent or 0,
+                'bytes_received': received or 0,
+            })
+
+    def on_step_change(self, event):
+        """
+        Record a step change event from InvocationWatcher, pass as (or call
+        from) its on_change
+        """
+        if event['order_index'] is None:
+            key = 'invocation'
+        else:
+            key = event['order_index']
+        with self._lock:
+            step = self.steps.setdefault(key, {
+                'label': event['label'],
+                'job_id': event['job_id'],
+                'states': {},
+            })
+            if event['job_id'] is not None:
+                step['job_id'] = event['job_id']
+            step['states'].setdefault(event['state'], time.time())
+
+    def add_job(self, job, job_metrics):
+        """
+        Record the details and galaxy metrics of one job
+
+        Args:
+            job (dict): Job as returned by JobsClient.show_job
+            job_metrics (array of dicts): Metrics as returned by
+                JobsClient.get_metrics
+        """
+        with self._lock:
+            self.jobs[job['id']] = {
+                'tool_id': job.get('tool_id'),
+                'state': job.get('state'),
+                'create_time': _epoch(job.get('create_time')),
+                'update_time': _epoch(job.get('update_time')),
+                'metrics': {
+                    metric['name']: _number(metric.get('raw_value', metric.get('value')))
+                    for metric in job_metrics
+                },
+            }
+
+    def finish(self, state):
+        """
+        Args:
+            state (string): Final state of the run, 'ok', 'error' or
+                'cancelled'
+        """
+        self.state = state
+        self.finished = time.time()
+
+    def _job_breakdown(self, job_id, job):
+        running = None
+        terminal = None
+        for step in self.steps.values():
+            if step['job_id'] == job_id:
+                running = step['states'].get('running')
+                terminal = min(
+                    (seen for state, seen in step['states'].items()
+                     if state not in ('new', 'queued', 'running')),
+                    default=None
+                )
+        metrics = job['metrics']
+        runtime = metrics.get('runtime_seconds')
+        breakdown = {
+            'queue_seconds': None,
+            'startup_seconds': None,
+            'runtime_seconds': runtime,
+        }
+        start = metrics.get('start_epoch')
+        if job['create_time'] is not None:
+            if running is not None:
+                breakdown['queue_seconds'] = max(0.0, running - job['create_time'])
+            elif isinstance(start, float):
+                # The running state was missed between polls, the start of
+                # the tool command also counts any startup time as queued
+                breakdown['queue_seconds'] = max(0.0, start - job['create_time'])
+        if running is not None and isinstance(runtime, float):
+            end = metrics.get('end_epoch')
+            if not isinstance(end, float):
+                end = terminal
+            if end is not None:
+                breakdown['startup_seconds'] = max(0.0, end - running - runtime)
+        return breakdown
+
+    def to_dict(self):
+        """
+        Returns:
+            metrics (dict): Everything recorded for the run, with totals
+                under 'summary'
+        """
+        with self._lock:
+            phases = [dict(phase) for phase in self.phases]
+            requests = [dict(request) for request in self.requests]
+            steps = {str(key): dict(step) for key, step in self.steps.items()}
+            jobs = {
+                job_id: dict(job, **self._job_breakdown(job_id, job))
+                for job_id, job in self.jobs.items()
+            }
+
+        phase_seconds = {}
+        for phase in phases:
+            phase_seconds[phase['name']] = phase_seconds.get(phase['name'], 0.0) + phase['seconds']
+
+        requests_by_phase = {}
+        for request in requests:
+            totals = requests_by_phase.setdefault(request['phase'] or 'other', {
+                'requests': 0, 'seconds': 0.0, 'bytes_sent': 0, 'bytes_received': 0,
+            })
+            totals['requests'] += 1
+            totals['seconds'] += request['seconds']
+            totals['bytes_sent'] += request['bytes_sent']
+            totals['bytes_received'] += request['bytes_received']
+
+        end = self.finished if self.finished is not None else time.time()
+        return {
+            'workflow_name': self.workflow_name,
+            'uid': self.uid,
+            'invocation_id': self.invocation_id,
+            'history_id': self.history_id,
+            'state': self.state,
+            'started': self.started,
+            'finished': self.finished,
+            'summary': {
+                'total_seconds': end - self.started,
+                'phase_seconds': phase_seconds,
+                'requests': len(requests),
+                'bytes_sent': sum(request['bytes_sent'] for request in requests),
+                'bytes_received': sum(request['bytes_received'] for request in requests),
+                'requests_by_phase': requests_by_phase,
+                'queue_seconds': sum(job['queue_seconds'] or 0.0 for job in jobs.values()),
+                'startup_seconds': sum(job['startup_seconds'] or 0.0 for job in jobs.values()),
+                'runtime_seconds': sum(
+                    job['runtime_seconds'] for job in jobs.values()
+                    if isinstance(job['runtime_seconds'], float)
+                ),
+            },
+            'phases': phases,
+            'steps': steps,
+            'jobs': jobs,
+            'requests': requests,
+        }
+
+    def write(self, dest_dir):
+        """
+        Save the metrics as JSON in dest_dir, next to biocompute_object.json
+
+        Args:
+            dest_dir (string): Directory the outputs of the run are saved in
+
+        Returns:
+            file_path (string): Path of the saved file
+        """
+        file_path = os.path.join(dest_dir, METRICS_FILE)
+        with open(file_path, 'w') as f_write:
+            json.dump(self.to_dict(), f_write)
+        return file_path
+
+
+def call_hook(hook, metrics):
+    """
+    Pass the metrics of a run to a user hook, a failing hook is logged and
+    does not fail the run
+
+    Args:
+        hook (callable): Called with the dict from RunMetrics.to_dict
+        metrics (RunMetrics): Metrics of the run
+    """
+    if hook is None:
+        return
+    try:
+        hook(metrics.to_dict())
+    except Exception as e:
+        log.error(f"Run metrics hook failed: {e}")
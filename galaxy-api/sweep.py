@@ -0,0 +1,412 @@
+import os
+import csv
+import copy
+import json
+import uuid
+import asyncio
+import itertools
+import logging as log
+
+from async_launch import InvocationHandle, run_blocking
+from invocation_watcher import WorkflowFailedError
+
+
+def set_parameter(config, parameter, value):
+    """
+    Function to set one value of an OpenMC config, as created by
+    templates/openmc_json_creator.py
+
+    Args:
+        config (dict): Config to change in place
+        parameter (string): Dotted path of the value, e.g.
+            'geometry.blanket_thickness' or 'settings.particles'
+        value: New value
+
+    Raises:
+        ValueError if a block on the path is not in the config
+    """
+    *blocks, key = parameter.split('.')
+    target = config
+    for block in blocks:
+        if not isinstance(target.get(block), dict):
+            raise ValueError(f"Sweep parameter {parameter} - block {block} is not in the config")
+        target = target[block]
+    target[key] = value
+
+
+def sweep_points(grid=None, samples=None):
+    """
+    Function to list the points of a sweep, lazily so sweeps of thousands of
+    points are never held in memory at once
+
+    Args:
+        grid (dict): Values to take every combination of
+            format: {parameter: [value, ...], ...}
+        samples (array of dicts): Points to run as they are
+            format: [{parameter: value, ...}, ...]
+
+    Returns:
+        points (iterator of dicts): format: {parameter: value, ...}, the
+            grid points followed by the samples
+    """
+    iterators = []
+    if grid:
+        names = list(grid)
+        iterators.append(
+            dict(zip(names, values))
+            for values in itertools.product(*(grid[name] for name in names))
+        )
+    if samples:
+        iterators.append(dict(sample) for sample in samples)
+    return itertools.chain(*iterators)
+
+
+def sweep_configs(base_config, grid=None, samples=None):
+    """
+    Function to generate the config of each point of a sweep
+
+    Args:
+        base_config (dict or string): Config the sweep starts from, or the
+            path of its JSON file
+        grid (dict): See sweep_points
+        samples (array of dicts): See sweep_points
+
+    Returns:
+        configs (iterator of tuples): format: (point, config)
+    """
+    if isinstance(base_config, str):
+        with open(base_config, 'r') as f_read:
+            base_config = json.load(f_read)
+
+    for point in sweep_points(grid=grid, samples=samples):
+        config = copy.deepcopy(base_config)
+        for parameter, value in point.items():
+            set_parameter(config, parameter, value)
+        yield point, config
+
+
+class SweepResults:
+    """
+    Results of a sweep, one row per point in the order the points were
+    given, indexed by the values of the sweep parameters
+
+    Each row holds the parameter values and
+    {'uid': uid, 'invocation_id': id, 'state': 'ok' / 'error' / 'failed',
+    'error': message, 'outputs': {label: dataset_id, ...},
+    'files': [path, ...]}
+
+    Args:
+        parameters (array of strings): Names of the sweep parameters
+        history_id (string): History holding every run of the sweep
+    """
+
+    columns = ['uid', 'invocation_id', 'state', 'error', 'outputs', 'files']
+
+    def __init__(self, parameters, history_id):
+        self.parameters = list(parameters)
+        self.history_id = history_id
+        self.rows = []
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def key(self, point):
+        """Index of a point, the tuple of its parameter values"""
+        return tuple(point.get(parameter) for parameter in self.parameters)
+
+    def index(self):
+        """
+        Returns:
+            index (dict): format: {(value, ...): row, ...}
+        """
+        return {self.key(row): row for row in self.rows}
+
+    def get(self, **point):
+        """
+        Find the row of a point, e.g.
+        results.get(**{'geometry.blanket_thickness': 90})
+
+        Returns:
+            row (dict): None if the point was not in the sweep
+        """
+        key = self.key(point)
+        for row in self.rows:
+            if self.key(row) == key:
+                return row
+        return None
+
+    def succeeded(self):
+        """Rows of the points whose runs finished"""
+        return [row for row in self.rows if row['state'] == 'ok']
+
+    def to_csv(self, file_path):
+        """
+        Function to write the results table as CSV, outputs and files are
+        written as JSON
+
+        Args:
+            file_path (string): Path of the CSV file
+        """
+        with open(file_path, 'w', newline='') as f_write:
+            writer = csv.writer(f_write)
+            writer.writerow(self.parameters + self.columns)
+            for row in self.rows:
+                writer.writerow(
+                    [row.get(parameter) for parameter in self.parameters]
+                    + [row['uid'], row['invocation_id'], row['state'],
+                       row['error'], json.dumps(row['outputs']),
+                       json.dumps(row['files'])]
+                )
+
+    def to_dataframe(self):
+        """
+        Function to get the results as a pandas DataFrame indexed by the
+        sweep parameters, pandas is only needed for this method
+
+        Returns:
+            dataframe (pandas.DataFrame)
+        """
+        import pandas as pd
+
+        dataframe = pd.DataFrame(
+            self.rows,
+            columns=self.parameters + self.columns
+        )
+        return dataframe.set_index(self.parameters)
+
+
+def _start_sweep(session, workflow_name, inputs, config_input, uid):
+    """
+    Create the history of a sweep and upload the inputs every point shares
+
+    Returns:
+        (history_id, uploaded) or (False, False) if the workflow or inputs
+            are not valid
+    """
+    expected_inputs = session.get_inputs(workflow_name)
+    if expected_inputs is False:
+        return False, False
+
+    names = [wf_input[1] for wf_input in expected_inputs]
+    if config_input not in names:
+        log.error(f"Workflow {workflow_name} has no input named {config_input}")
+        return False, False
+
+    # Every point needs the shared inputs, fail the sweep once rather than
+    # each point on its own
+    missing = [
+        name for name in names if name != config_input and name not in inputs
+    ]
+    if missing:
+        log.error(f"Sweep inputs {', '.join(missing)} of workflow {workflow_name} were not given")
+        return False, False
+
+    history_id = session.gi.histories.create_history(
+        name=workflow_name + '_sweep_' + uid
+    )['id']
+
+    datasets = {
+        wf_input[1]: (wf_input[1], inputs[wf_input[1]])
+        for wf_input in expected_inputs
+        if wf_input[0] == 'dataset' and wf_input[1] in inputs
+        and wf_input[1] != config_input
+    }
+    return history_id, session.upload_inputs(history_id, datasets)
+
+
+def _invocation_outputs(session, invocation_id):
+    invocation = session.gi.invocations.show_invocation(invocation_id)
+    return {
+        label: output['id']
+        for label, output in invocation.get('outputs', {}).items()
+    }
+
+
+async def _run_point(
+    session,
+    workflow_name,
+    inputs,
+    config_input,
+    history_id,
+    uploaded,
+    point,
+    config,
+    uid,
+    poll_interval,
+    outputs,
+    output_dir
+):
+    row = dict(point)
+    row.update({
+        'uid': uid,
+        'invocation_id': None,
+        'state': 'failed',
+        'error': None,
+        'outputs': {},
+        'files': [],
+    })
+
+    point_inputs = dict(inputs)
+    point_inputs[config_input] = json.dumps(config)
+
+    try:
+        launch = await run_blocking(
+            session.prepare_launch,
+            workflow_name,
+            point_inputs,
+            uid=uid,
+            history_id=history_id,
+            uploaded=uploaded
+        )
+        if launch is False:
+            row['error'] = 'Launch could not be prepared'
+            return row
+
+        invocation = await run_blocking(session.invoke, launch)
+        row['invocation_id'] = invocation['id']
+
+        handle = InvocationHandle(
+            session,
+            invocation,
+            launch,
+            poll_interval=poll_interval,
+            shared_history=True
+        )
+        try:
+            await handle.wait()
+        except WorkflowFailedError as e:
+            row['state'] = 'error'
+            row['error'] = str(e)
+            return row
+
+        row['outputs'] = await run_blocking(
+            _invocation_outputs, session, invocation['id']
+        )
+        if output_dir is not None:
+            row['files'] = await handle.download_outputs(
+                os.path.join(output_dir, uid), outputs=outputs
+            )
+        row['state'] = 'ok'
+    except Exception as e:
+        log.error(f"Sweep point {point} failed: {e}")
+        row['error'] = str(e)
+    return row
+
+
+async def run_sweep(
+    session,
+    workflow_name,
+    base_config,
+    config_input,
+    grid=None,
+    samples=None,
+    inputs=None,
+    max_concurrent=8,
+    poll_interval=5.0,
+    outputs=None,
+    output_dir=None,
+    on_result=None,
+    uid=None
+):
+    """
+    Function to run a workflow once for every point of a parameter sweep
+    over an OpenMC config
+
+    All the runs go into one history. The inputs shared by every point
+    (e.g. the CAD file) are uploaded once and each point only uploads its
+    own config. At most max_concurrent points are running at any time and
+    they are all followed from the event loop, so no thread is held per run
+    and the points are generated as they are needed.
+
+    Args:
+        session (GalaxySession): Session for the galaxy instance
+        workflow_name (string): Target workflow name
+        base_config (dict or string): Config the sweep starts from, or the
+            path of its JSON file
+        config_input (string): Name of the workflow input the config of
+            each point is given to
+        grid (dict): Values to take every combination of
+            format: {parameter: [value, ...], ...} where parameter is the
+            dotted path of the value, e.g. 'plasma_params.ion_temperature_centre'
+        samples (array of dicts): Points to run as they are
+            format: [{parameter: value, ...}, ...]
+        inputs (dict): Other inputs of the workflow, shared by every point
+            format: {input_name: input_string/filename, ...}
+        max_concurrent (int): Maximum number of points running at once
+        poll_interval (float): Shortest time in seconds between polls of
+            the server for each running point
+        outputs (array of strings): Labels of the workflow outputs to
+            download, None for every workflow output
+        output_dir (string): If given, the outputs of each point are saved
+            in output_dir/<point uid>, otherwise they are left on the server
+        on_result (callable): Called with the row of each point as it
+            finishes
+        uid (string): Unique identifier for the sweep
+
+    Returns:
+        results (SweepResults): Results table of the sweep
+        False if the workflow or its inputs are not valid
+    """
+    if inputs is None:
+        inputs = {}
+    if uid is None:
+        uid = str(uuid.uuid4())
+    if isinstance(base_config, str):
+        with open(base_config, 'r') as f_read:
+            base_config = json.load(f_read)
+
+    parameters = list(grid or {})
+    for sample in samples or []:
+        parameters.extend(name for name in sample if name not in parameters)
+
+    # Check every parameter before anything is sent to the server
+    for parameter in parameters:
+        try:
+            set_parameter(copy.deepcopy(base_config), parameter, None)
+        except ValueError as e:
+            log.error(str(e))
+            return False
+
+    history_id, uploaded = await run_blocking(
+        _start_sweep, session, workflow_name, inputs, config_input, uid
+    )
+    if history_id is False:
+        return False
+
+    results = SweepResults(parameters, history_id)
+
+    configs = enumerate(sweep_configs(base_config, grid=grid, samples=samples))
+    rows = {}
+
+    async def worker():
+        # Workers share the one generator, each taking the next point as
+        # soon as its last run has finished
+        for i, (point, config) in configs:
+            row = await _run_point(
+                session,
+                workflow_name,
+                inputs,
+                config_input,
+                history_id,
+                uploaded,
+                point,
+                config,
+                f"{uid}_{i}",
+                poll_interval,
+                outputs,
+                output_dir
+            )
+            rows[i] = row
+            if on_result is not None:
+                on_result(row)
+
+    await asyncio.gather(*(worker() for _ in range(max(1, max_concurrent))))
+
+    results.rows = [rows[i] for i in sorted(rows)]
+    failed = len(results) - len(results.succeeded())
+    if failed > 0:
+        log.warning(f"{failed} of {len(results)} sweep points did not finish")
+    return results
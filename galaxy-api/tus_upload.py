@@ -0,0 +1,309 @@
+import os
+import time
+import base64
+import threading
+import contextvars
+import logging as log
+
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin
+
+import requests
+
+from json_store import load_json, save_json
+
+
+TUS_VERSION = '1.0.0'
+
+DEFAULT_CHUNK_SIZE = 16 * 1024 * 1024
+
+# One lock per state file shared by every uploader in the process, uploads of
+# different files (each with its own TusUploader) read-modify-write the same
+# state file from several threads
+_state_locks = {}
+_state_locks_lock = threading.Lock()
+
+
+def _state_lock_for(state_file):
+    key = os.path.abspath(state_file) if state_file is not None else None
+    with _state_locks_lock:
+        return _state_locks.setdefault(key, threading.RLock())
+
+
+class TusUploadError(Exception):
+    """Raised when the tus server rejects part of an upload"""
+
+
+class TusUploader:
+    """
+    Chunked, resumable uploads to a tus endpoint such as the galaxy tusd
+    service (/api/upload/resumable_upload)
+
+    The file is split into parallel_chunks parts that are uploaded at the
+    same time, each in requests of chunk_size bytes, and then joined on the
+    server with the tus concatenation extension. If the server does not
+    support concatenation the file is sent as a single upload.
+
+    The upload URLs are kept in state_file so an upload that is interrupted
+    carries on from the last chunk the server received when it is started
+    again for the same, unchanged, file.
+
+    Args:
+        http (requests.Session): Session to send the requests with
+        endpoint (string): URL of the tus endpoint
+        api_key (string): Galaxy API key, sent as the x-api-key header
+        chunk_size (int): Number of bytes sent in each PATCH request
+        parallel_chunks (int): Number of parts uploaded at the same time
+        state_file (string): Optional path of the JSON file holding the
+            state of unfinished uploads
+        timeout (float): Timeout in seconds for each request
+        on_request (callable): Called with no arguments before each request,
+            e.g. GalaxySession.count_request
+        on_response (callable): Called after each request with
+            (method, url, status, seconds, sent=bytes, received=bytes),
+            e.g. GalaxySession.record_request
+    """
+
+    def __init__(
+        self,
+        http,
+        endpoint,
+        api_key=None,
+        chunk_size=DEFAULT_CHUNK_SIZE,
+        parallel_chunks=4,
+        state_file=None,
+        timeout=None,
+        on_request=None,
+        on_response=None
+    ):
+        self.http = http
+        self.endpoint = endpoint.rstrip('/') + '/'
+        self.chunk_size = chunk_size
+        self.parallel_chunks = max(1, parallel_chunks)
+        self.state_file = state_file
+        self.timeout = timeout
+        self.on_request = on_request
+        self.on_response = on_response
+
+        self.headers = {'Tus-Resumable': TUS_VERSION}
+        if api_key is not None:
+            self.headers['x-api-key'] = api_key
+
+        self._state_lock = _state_lock_for(state_file)
+        self._extensions = None
+
+    def _request(self, method, url, headers=None, data=None):
+        if self.on_request is not None:
+            self.on_request()
+        request_headers = dict(self.headers)
+        if headers is not None:
+            request_headers.update(headers)
+        start = time.perf_counter()
+        r = self.http.request(
+            method,
+            url,
+            headers=request_headers,
+            data=data,
+            timeout=self.timeout
+        )
+        if self.on_response is not None:
+            self.on_response(
+                method,
+                url,
+                r.status_code,
+                time.perf_counter() - start,
+                sent=len(data) if data is not None else 0,
+                received=len(r.content)
+            )
+        return r
+
+    def supports_concatenation(self):
+        """
+        Ask the server which tus extensions it supports
+
+        Returns:
+            True if the server supports the concatenation extension
+        """
+        if self._extensions is None:
+            try:
+                r = self._request('OPTIONS', self.endpoint)
+                extensions = r.headers.get('Tus-Extension', '')
+                self._extensions = {ext.strip() for ext in extensions.split(',')}
+            except requests.RequestException:
+                self._extensions = set()
+        return 'concatenation' in self._extensions
+
+    def upload(self, file_path):
+        """
+        Upload a file, resuming an earlier interrupted upload of the same
+        file if there is one
+
+        Args:
+            file_path (string): Path of the file to upload
+
+        Returns:
+            session_id (string): Upload id to pass to the galaxy fetch API
+        """
+        file_path = os.path.abspath(file_path)
+        file_size = os.path.getsize(file_path)
+        key = self._state_key(file_path)
+
+        state = self._load_state().get(key)
+        if state is None:
+            state = {'parts': self._plan_parts(file_size), 'final': None}
+
+        if state['final'] is None:
+            self._save_state(key, state)
+            workers = min(self.parallel_chunks, len(state['parts']))
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                # Parts run in the caller's context so on_response can tell
+                # which upload the requests belong to
+                futures = [
+                    executor.submit(
+                        contextvars.copy_context().run,
+                        self._upload_part, file_path, key, state, part
+                    )
+                    for part in state['parts']
+                ]
+                for future in futures:
+                    future.result()
+
+            if len(state['parts']) == 1:
+                state['final'] = state['parts'][0]['url']
+            else:
+                state['final'] = self._concatenate(state['parts'])
+            self._save_state(key, state)
+
+        self._save_state(key, None)
+        return state['final'].rstrip('/').rsplit('/', 1)[-1]
+
+    def _plan_parts(self, file_size):
+        """
+        Split a file into the parts uploaded at the same time
+
+        Args:
+            file_size (int): Size of the file in bytes
+
+        Returns:
+            parts (array of dicts): format: [{'start': offset,
+                'length': bytes, 'url': None}, ...]
+        """
+        parts = 1
+        if self.parallel_chunks > 1 and file_size > self.chunk_size \
+                and self.supports_concatenation():
+            parts = min(self.parallel_chunks, -(-file_size // self.chunk_size))
+
+        part_size = -(-file_size // parts) if file_size > 0 else 0
+        plan = []
+        for i in range(parts):
+            start = i * part_size
+            plan.append({
+                'start': start,
+                'length': max(0, min(part_size, file_size - start)),
+                'url': None,
+            })
+        return plan
+
+    def _create(self, length, partial, file_name):
+        headers = {
+            'Upload-Length': str(length),
+            'Upload-Metadata': 'filename ' + base64.b64encode(
+                file_name.encode('utf-8')
+            ).decode('ascii'),
+        }
+        if partial:
+            headers['Upload-Concat'] = 'partial'
+        r = self._request('POST', self.endpoint, headers=headers)
+        if r.status_code != 201:
+            raise TusUploadError(
+                f"Could not create upload, status {r.status_code}: {r.text}"
+            )
+        return urljoin(self.endpoint, r.headers['Location'])
+
+    def _offset(self, url):
+        """
+        Get the number of bytes the server has for an upload
+
+        Returns:
+            offset (int): Bytes received, None if the upload no longer exists
+        """
+        r = self._request('HEAD', url)
+        if r.status_code in (404, 410):
+            return None
+        if r.status_code != 200:
+            raise TusUploadError(
+                f"Could not get upload offset, status {r.status_code}"
+            )
+        return int(r.headers['Upload-Offset'])
+
+    def _upload_part(self, file_path, key, state, part):
+        """Upload one part of a file, resuming from the server offset"""
+        offset = None
+        if part['url'] is not None:
+            offset = self._offset(part['url'])
+            if offset is None:
+                log.info(f"Upload {part['url']} expired on the server, starting the part again")
+        if offset is None:
+            part['url'] = self._create(
+                part['length'],
+                partial=len(state['parts']) > 1,
+                file_name=os.path.basename(file_path)
+            )
+            self._save_state(key, state)
+            offset = 0
+
+        with open(file_path, 'rb') as f_read:
+            while offset < part['length']:
+                f_read.seek(part['start'] + offset)
+                chunk = f_read.read(min(self.chunk_size, part['length'] - offset))
+                r = self._request(
+                    'PATCH',
+                    part['url'],
+                    headers={
+                        'Upload-Offset': str(offset),
+                        'Content-Type': 'application/offset+octet-stream',
+                    },
+                    data=chunk
+                )
+                if r.status_code != 204:
+                    raise TusUploadError(
+                        f"Chunk at offset {offset} was rejected, status {r.status_code}: {r.text}"
+                    )
+                offset = int(r.headers['Upload-Offset'])
+
+    def _concatenate(self, parts):
+        urls = ' '.join(part['url'] for part in parts)
+        r = self._request(
+            'POST',
+            self.endpoint,
+            headers={'Upload-Concat': f"final;{urls}"}
+        )
+        if r.status_code != 201:
+            raise TusUploadError(
+                f"Could not join the uploaded parts, status {r.status_code}: {r.text}"
+            )
+        return urljoin(self.endpoint, r.headers['Location'])
+
+    ##################
+    # RESUME STATE
+    ##################
+
+    def _state_key(self, file_path):
+        stat = os.stat(file_path)
+        return f"{self.endpoint}|{file_path}|{stat.st_size}|{stat.st_mtime_ns}"
+
+    def _load_state(self):
+        with self._state_lock:
+            return load_json(self.state_file, 'tus upload state')
+
+    def _save_state(self, key, state):
+        """Store (or with state None, remove) the state of one upload"""
+        if self.state_file is None:
+            return
+        with self._state_lock:
+            all_state = self._load_state()
+            if state is None:
+                all_state.pop(key, None)
+            else:
+                all_state[key] = state
+            save_json(self.state_file, all_state)
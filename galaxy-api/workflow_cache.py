@@ -0,0 +1,223 @@
+import time
+import threading
+
+from json_store import load_json, save_json
+
+
+class WorkflowMetadataCache:
+    """
+    Cache of the parsed metadata of galaxy workflows
+
+    Holds the name to id mapping of the workflows on each server and, for
+    each workflow id and update time, the parsed input tuples and output
+    names (including RenameDatasetActionFile renames). Exporting a workflow
+    is only needed again when its update time changes.
+
+    The name to id mapping expires after ttl seconds, after which the
+    (small) workflow list is fetched again and compared against the stored
+    update times - this is the cheap freshness check. Metadata entries
+    without an update time are treated the same way. Entries older than
+    max_age are evicted regardless.
+
+    If cache_file is given the cache is also stored on disk as JSON so it
+    survives process restarts.
+
+    Args:
+        ttl (float): Seconds before the workflow list is checked again
+        max_age (float): Seconds before any metadata entry is evicted
+        cache_file (string): Optional path of the on-disk JSON cache
+    """
+
+    def __init__(self, ttl=300, max_age=7 * 24 * 3600, cache_file=None):
+        self.ttl = ttl
+        self.max_age = max_age
+        self.cache_file = cache_file
+
+        self._lock = threading.Lock()
+        self._index = {}
+        self._metadata = {}
+
+        if cache_file is not None:
+            self._load()
+
+    ##################
+    # WORKFLOW INDEX
+    ##################
+
+    def get_index(self, server):
+        """
+        Get the name to workflow mapping for a server if it is still fresh
+
+        Args:
+            server (string): Galaxy server address
+
+        Returns:
+            index (dict): format: {name: {'id': id, 'update_time': time}}
+            None if there is no fresh mapping for the server
+        """
+        with self._lock:
+            entry = self._index.get(server)
+            if entry is None or self._expired(entry['stored_at'], self.ttl):
+                return None
+            return entry['workflows']
+
+    def set_index(self, server, workflows):
+        """
+        Store the workflow list of a server as a name to workflow mapping
+
+        Args:
+            server (string): Galaxy server address
+            workflows (array of dicts): Workflows as returned by the galaxy
+                API, each with at least a name and an id
+
+        Returns:
+            index (dict): format: {name: {'id': id, 'update_time': time}}
+        """
+        index = {}
+        for workflow in workflows:
+            index[workflow['name']] = {
+                'id': workflow['id'],
+                'update_time': workflow.get('update_time'),
+            }
+        with self._lock:
+            self._index[server] = {
+                'stored_at': time.time(),
+                'workflows': index,
+            }
+        self._save()
+        return index
+
+    ##################
+    # METADATA
+    ##################
+
+    def get(self, server, workflow_id, update_time):
+        """
+        Get the stored metadata of a workflow version
+
+        Args:
+            server (string): Galaxy server address
+            workflow_id (string): Encoded workflow id
+            update_time (string): Update time of the workflow, as given in
+                the workflow list
+
+        Returns:
+            metadata (dict): format: {'inputs': [(type, name, id), ...],
+                'outputs': [name, ...]}
+            None if the workflow version is not cached
+        """
+        with self._lock:
+            entry = self._metadata.get(_key(server, workflow_id))
+            if entry is None or entry['update_time'] != update_time:
+                return None
+            if update_time is None and self._expired(entry['stored_at'], self.ttl):
+                return None
+            if self._expired(entry['stored_at'], self.max_age):
+                return None
+            return {
+                'inputs': [tuple(item) for item in entry['inputs']],
+                'outputs': list(entry['outputs']),
+            }
+
+    def set(self, server, workflow_id, update_time, inputs, outputs):
+        """
+        Store the parsed metadata of a workflow version, replacing any older
+        version of the same workflow
+
+        Args:
+            server (string): Galaxy server address
+            workflow_id (string): Encoded workflow id
+            update_time (string): Update time of the workflow
+            inputs (array of tuples): format: [(type, name, id), ...]
+            outputs (array of strings): Output names of the workflow
+        """
+        with self._lock:
+            self._metadata[_key(server, workflow_id)] = {
+                'update_time': update_time,
+                'stored_at': time.time(),
+                'inputs': [list(item) for item in inputs],
+                'outputs': list(outputs),
+            }
+        self._save()
+
+    def is_fresh(self, server, workflow_id, update_time):
+        """
+        Cheap check of whether the cached metadata of a workflow matches the
+        given update time, without touching the galaxy server
+
+        Args:
+            server (string): Galaxy server address
+            workflow_id (string): Encoded workflow id
+            update_time (string): Current update time of the workflow
+
+        Returns:
+            True if the cached metadata can be used
+            False otherwise
+        """
+        return self.get(server, workflow_id, update_time) is not None
+
+    ##################
+    # EVICTION
+    ##################
+
+    def evict_expired(self):
+        """
+        Remove expired workflow lists and metadata entries
+
+        Returns:
+            evicted (int): Number of entries removed
+        """
+        with self._lock:
+            stale_index = [
+                server for server, entry in self._index.items()
+                if self._expired(entry['stored_at'], self.ttl)
+            ]
+            for server in stale_index:
+                del self._index[server]
+
+            stale_metadata = [
+                key for key, entry in self._metadata.items()
+                if self._expired(entry['stored_at'], self.max_age)
+                or (
+                    entry['update_time'] is None
+                    and self._expired(entry['stored_at'], self.ttl)
+                )
+            ]
+            for key in stale_metadata:
+                del self._metadata[key]
+
+        evicted = len(stale_index) + len(stale_metadata)
+        if evicted > 0:
+            self._save()
+        return evicted
+
+    def clear(self):
+        """Remove everything from the cache, including the on-disk copy"""
+        with self._lock:
+            self._index = {}
+            self._metadata = {}
+        self._save()
+
+    @staticmethod
+    def _expired(stored_at, max_age):
+        return max_age is not None and time.time() - stored_at > max_age
+
+    ##################
+    # DISK
+    ##################
+
+    def _load(self):
+        data = load_json(self.cache_file, 'workflow cache')
+        self._index = data.get('index', {})
+        self._metadata = data.get('metadata', {})
+        self.evict_expired()
+
+    def _save(self):
+        if self.cache_file is None:
+            return
+        with self._lock:
+            save_json(self.cache_file, {'index': self._index, 'metadata': self._metadata})
+
+
+def _key(server, workflow_id):
+    return f"{server}|{workflow_id}"
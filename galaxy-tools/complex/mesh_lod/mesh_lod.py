@@ -0,0 +1,209 @@
+"""
+Level of detail generation for the CAD (h5m_to_stl) and track tube (vtp_obj) meshes.
+
+The mesh is decimated with VTK's quadric decimation to each triangle budget in turn, each level
+    from the one before it, and every level is written to one binary USD (usdc) file as a variant
+    of a "LOD" variant set on /Model. The viewer switches level by changing the variant selection,
+    without loading another file. The coarsest level is selected by default.
+
+A JSON report gives the triangle count, point count and size of the mesh arrays of each level.
+
+Usage: mesh_lod.py <mesh.stl|mesh.obj> <out.usd> --triangles 500000 100000 20000 [--report lod.json]
+"""
+
+import os
+import json
+import time
+import argparse
+
+import numpy as np
+from pxr import Gf, Usd, UsdGeom, Sdf, Vt
+from vtkmodules.util.numpy_support import vtk_to_numpy
+from vtkmodules.vtkFiltersCore import vtkCleanPolyData, vtkQuadricDecimation, vtkTriangleFilter
+from vtkmodules.vtkIOGeometry import vtkOBJReader, vtkSTLReader
+
+READERS = {"stl": vtkSTLReader, "obj": vtkOBJReader}
+
+
+def read_mesh(in_file, mesh_format):
+    """
+    Function to read a mesh as triangles with shared points
+
+    Args:
+        in_file (string): Path of the mesh
+        mesh_format (string): stl or obj
+
+    Returns:
+        mesh (vtkPolyData)
+    """
+    reader = READERS[mesh_format]()
+    reader.SetFileName(in_file)
+
+    # stl repeats the points of every triangle, decimation needs them merged to see the surface
+    clean = vtkCleanPolyData()
+    clean.SetInputConnection(reader.GetOutputPort())
+    triangles = vtkTriangleFilter()
+    triangles.SetInputConnection(clean.GetOutputPort())
+    triangles.Update()
+    return triangles.GetOutput()
+
+
+def decimate(mesh, target_triangles):
+    """
+    Function to bring a mesh down to about target_triangles with quadric decimation
+
+    Returns:
+        mesh (vtkPolyData)
+    """
+    decimation = vtkQuadricDecimation()
+    decimation.SetInputData(mesh)
+    decimation.SetTargetReduction(1.0 - target_triangles / mesh.GetNumberOfPolys())
+    decimation.VolumePreservationOn()
+    decimation.Update()
+    return decimation.GetOutput()
+
+
+def mesh_arrays(mesh):
+    """
+    Function to get the arrays of a triangle mesh in the types written to USD
+
+    Returns:
+        points (array): float32, shape (n, 3)
+        indices (array): int32, shape (m * 3,)
+    """
+    points = vtk_to_numpy(mesh.GetPoints().GetData()).astype(np.float32)
+    indices = vtk_to_numpy(mesh.GetPolys().GetConnectivityArray()).astype(np.int32)
+    return points, indices
+
+
+def build_levels(mesh, budgets):
+    """
+    Function to make the levels of detail, the full mesh then one per triangle budget
+
+    Budgets at or above the triangle count of the level before them are skipped.
+
+    Args:
+        mesh (vtkPolyData): Full mesh from read_mesh
+        budgets (array of ints): Triangle budgets
+
+    Returns:
+        levels (array of dicts): format: {'name': variant name, 'budget': triangles asked for,
+            'points': array, 'indices': array, 'seconds': decimation time}
+    """
+    points, indices = mesh_arrays(mesh)
+    levels = [{"name": "full", "budget": None, "points": points, "indices": indices, "seconds": 0.0}]
+    for budget in sorted(set(budgets), reverse=True):
+        if budget >= mesh.GetNumberOfPolys():
+            print(f"Budget of {budget} triangles is not below {mesh.GetNumberOfPolys()}, skipped")
+            continue
+        start = time.perf_counter()
+        mesh = decimate(mesh, budget)
+        points, indices = mesh_arrays(mesh)
+        levels.append({
+            "name": f"lod{len(levels)}",
+            "budget": budget,
+            "points": points,
+            "indices": indices,
+            "seconds": time.perf_counter() - start,
+        })
+    return levels
+
+
+def write_usd(levels, out_file, default_level, meters_per_unit):
+    """
+    Function to write the levels as the variants of the "LOD" variant set of /Model
+
+    Args:
+        levels (array of dicts): From build_levels
+        out_file (string): Path of the USD file, written as usdc
+        default_level (int): Index of the level selected when the file is opened
+        meters_per_unit (float): Length of a mesh unit in meters
+    """
+    # USD picks the file format from the extension, Galaxy dataset paths end in .dat
+    usd_file = out_file if os.path.splitext(out_file)[1] in (".usd", ".usdc") else out_file + ".usd"
+    layer = Sdf.Layer.CreateNew(usd_file, args={"format": "usdc"})
+    stage = Usd.Stage.Open(layer)
+    UsdGeom.SetStageUpAxis(stage, UsdGeom.Tokens.z)
+    UsdGeom.SetStageMetersPerUnit(stage, meters_per_unit)
+
+    model = UsdGeom.Xform.Define(stage, "/Model")
+    stage.SetDefaultPrim(model.GetPrim())
+
+    variant_set = model.GetPrim().GetVariantSets().AddVariantSet("LOD")
+    for level in levels:
+        variant_set.AddVariant(level["name"])
+        variant_set.SetVariantSelection(level["name"])
+        with variant_set.GetVariantEditContext():
+            mesh = UsdGeom.Mesh.Define(stage, "/Model/Mesh")
+            mesh.CreatePointsAttr(Vt.Vec3fArray.FromNumpy(level["points"]))
+            mesh.CreateFaceVertexCountsAttr(Vt.IntArray.FromNumpy(np.full(len(level["indices"]) // 3, 3, dtype=np.int32)))
+            mesh.CreateFaceVertexIndicesAttr(Vt.IntArray.FromNumpy(level["indices"]))
+            mesh.CreateSubdivisionSchemeAttr(UsdGeom.Tokens.none)
+            mesh.CreateExtentAttr(Vt.Vec3fArray([
+                Gf.Vec3f(*level["points"].min(axis=0).tolist()),
+                Gf.Vec3f(*level["points"].max(axis=0).tolist()),
+            ]))
+    variant_set.SetVariantSelection(levels[default_level]["name"])
+
+    layer.Save()
+    if usd_file != out_file:
+        os.replace(usd_file, out_file)
+
+
+def level_report(levels, out_file, default_level):
+    """
+    Function to report the size of each level
+
+    Returns:
+        report (dict): format: {'levels': [{'name', 'budget', 'triangles', 'points', 'mb',
+            'seconds'}], 'default': name, 'file_mb': size of the USD file}
+    """
+    return {
+        "levels": [
+            {
+                "name": level["name"],
+                "budget": level["budget"],
+                "triangles": len(level["indices"]) // 3,
+                "points": len(level["points"]),
+                # points, face vertex indices and face vertex counts as stored in USD
+                "mb": (level["points"].nbytes + level["indices"].nbytes * 4 // 3) / 1024 ** 2,
+                "seconds": level["seconds"],
+            }
+            for level in levels
+        ],
+        "default": levels[default_level]["name"],
+        "file_mb": os.path.getsize(out_file) / 1024 ** 2,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="mesh_lod.py",
+        description="Decimated levels of detail of a mesh as USD variants. Usage: mesh_lod.py <mesh.stl> <out.usd> --triangles 100000 20000",
+    )
+    parser.add_argument("in_file", help="Mesh to decimate. Format: stl or obj")
+    parser.add_argument("out_file", help="USD output file, written as binary usdc")
+    parser.add_argument("--triangles", type=int, nargs="+", required=True, help="Triangle budget of each level below the full mesh")
+    parser.add_argument("--format", choices=sorted(READERS), default=None, help="Mesh format, default from the file extension")
+    parser.add_argument("--default-level", type=int, default=-1, help="Index of the level selected on opening, 0 is the full mesh, default the coarsest")
+    parser.add_argument("--meters-per-unit", type=float, default=0.01, help="Length of a mesh unit in meters, DAGMC and OpenMC use cm")
+    parser.add_argument("--report", default=None, help="Triangle count and size of each level. Format: JSON")
+
+    args = parser.parse_args()
+
+    mesh_format = args.format or os.path.splitext(args.in_file)[1].lstrip(".").lower()
+    if mesh_format not in READERS:
+        parser.error(f"Cannot tell the mesh format of {args.in_file}, give --format")
+
+    levels = build_levels(read_mesh(args.in_file, mesh_format), args.triangles)
+    if not -len(levels) <= args.default_level < len(levels):
+        parser.error(f"--default-level {args.default_level} out of the {len(levels)} levels made")
+    write_usd(levels, args.out_file, args.default_level, args.meters_per_unit)
+
+    report = level_report(levels, args.out_file, args.default_level)
+    for level in report["levels"]:
+        print(f"{level['name']}: {level['triangles']} triangles, {level['points']} points, {level['mb']:.2f} MB")
+    print(f"{args.out_file}: {report['file_mb']:.2f} MB, {report['default']} selected")
+    if args.report is not None:
+        with open(args.report, "w") as write_file:
+            json.dump(report, write_file, indent=4)
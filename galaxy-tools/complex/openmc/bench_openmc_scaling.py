@@ -0,0 +1,125 @@
+"""
+Benchmark of OpenMC transport rate (particles per second) against thread count.
+
+Runs a small reference problem, a 14 MeV point source at the centre of a lithium
+    blanket shell inside a tungsten first wall, once for each thread count and reads the
+    transport time from the final statepoint. No CAD file is needed, so it can be run
+    in the tool container to pick the slots to give the openmc tool.
+
+Usage:
+    python bench_openmc_scaling.py --threads 1 2 4 8 --particles 20000 --output scaling.json
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+
+import openmc
+
+parser = argparse.ArgumentParser(
+    prog="bench_openmc_scaling.py",
+    description="Benchmark OpenMC particles per second against thread count",
+)
+parser.add_argument("--threads", type=int, nargs="+", default=[1, 2, 4, 8], help="Thread counts to test")
+parser.add_argument("--particles", type=int, default=20000, help="Particles per batch")
+parser.add_argument("--batches", type=int, default=5, help="Batches per run")
+parser.add_argument("--repeats", type=int, default=1, help="Runs per thread count, the fastest is kept")
+parser.add_argument("--output", default=None, help="JSON file to write the results to")
+
+args = parser.parse_args()
+
+
+def reference_model():
+    """Lithium blanket shell behind a tungsten first wall around a 14 MeV point source"""
+    blanket = openmc.Material(name="blanket")
+    blanket.add_element("Li", 1.0, enrichment=7.5, enrichment_target="Li6", enrichment_type="ao")
+    blanket.set_density("g/cm3", 0.534)
+
+    firstwall = openmc.Material(name="firstwall")
+    firstwall.add_element("W", 1.0)
+    firstwall.set_density("g/cm3", 19.3)
+
+    inner = openmc.Sphere(r=100.0)
+    wall = openmc.Sphere(r=103.0)
+    outer = openmc.Sphere(r=193.0, boundary_type="vacuum")
+
+    geometry = openmc.Geometry([
+        openmc.Cell(region=-inner),
+        openmc.Cell(region=+inner & -wall, fill=firstwall),
+        openmc.Cell(region=+wall & -outer, fill=blanket),
+    ])
+
+    source = openmc.Source()
+    source.space = openmc.stats.Point()
+    source.angle = openmc.stats.Isotropic()
+    source.energy = openmc.stats.Discrete([14.1e6], [1.0])
+
+    settings = openmc.Settings()
+    settings.run_mode = "fixed source"
+    settings.particles = args.particles
+    settings.batches = args.batches
+    settings.source = source
+
+    tbr_tally = openmc.Tally(name="TBR")
+    tbr_tally.scores = ["H3-production"]
+
+    return openmc.model.Model(
+        geometry=geometry,
+        materials=openmc.Materials([blanket, firstwall]),
+        settings=settings,
+        tallies=openmc.Tallies([tbr_tally]),
+    )
+
+
+def run(threads):
+    """
+    Returns:
+        seconds (float): Transport time of the fastest of args.repeats runs
+    """
+    best = None
+    for _ in range(args.repeats):
+        with tempfile.TemporaryDirectory() as workdir:
+            reference_model().export_to_xml(workdir)
+            start = time.perf_counter()
+            openmc.run(threads=threads, cwd=workdir, output=False)
+            wall = time.perf_counter() - start
+            with openmc.StatePoint(os.path.join(workdir, f"statepoint.{args.batches}.h5")) as statepoint:
+                seconds = float(statepoint.runtime.get("transport", wall))
+        best = seconds if best is None else min(best, seconds)
+    return best
+
+
+results = {
+    "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    "openmc": openmc.__version__,
+    "python": sys.version.split()[0],
+    "platform": platform.platform(),
+    "cpu_count": os.cpu_count(),
+    "parameters": vars(args),
+    "scaling": [],
+}
+
+baseline = None
+for threads in args.threads:
+    seconds = run(threads)
+    rate = args.particles * args.batches / seconds
+    if baseline is None:
+        baseline = rate / threads
+    results["scaling"].append({
+        "threads": threads,
+        "transport_seconds": seconds,
+        "particles_per_second": rate,
+        "speedup": rate / baseline,
+        "efficiency": rate / (baseline * threads),
+    })
+    print(f"{threads:4d} threads: {rate:12.0f} particles/s, speedup {rate / baseline:5.2f}", flush=True)
+
+output = json.dumps(results, indent=4)
+if args.output is not None:
+    with open(args.output, "w") as f_write:
+        f_write.write(output)
+print(output)
@@ -4,21 +4,77 @@ A very simple script to run an OpenMC simulation with a tokamak source and a ref
 
 The script takes in a geometry file, a settings file and an output file path as arguments.
 
+The run is parallelised with OpenMP threads and, if "mpi_processes" is set in the settings
+    block, MPI ranks. Both are limited to the cores allocated to the job (--slots, which the
+    Galaxy tool sets from ${GALAXY_SLOTS}). The parallel setup and the transport rate are written
+    to a JSON run info file next to the tallies.
+
+Statepoints are written every "statepoint_interval" batches of the settings block (default: only
+    at the end) and the latest complete one is copied to --statepoint-out when the run ends, fails or
+    is stopped with SIGTERM (e.g. by a scheduler walltime limit, a SIGKILL cannot be caught). Passing
+    a statepoint back in with --restart resumes the run from it, up to the batches of the config or
+    --extra-batches more than the statepoint holds, so a run can be extended without repeating the
+    batches already done.
+
+If "tbr_rel_error" is set in the settings block, the run continues past "batches" until the TBR
+    tally reaches that relative error or "max_batches" is hit. The TBR, its achieved relative error
+    and the batches used are written to the run info.
+
+The tokamak plasma source is sampled once into an OpenMC source file keyed by the hash of the
+    plasma shape and parameters, and kept in --source-cache so runs that only change the blanket,
+    particles or batches skip generating it. OpenMC draws the source particles from the file's sites
+    at random, so the file has a site for every source particle of the run (particles times the most
+    batches, at least 100000) unless "source_sites" is set, a warning is printed when sites are reused.
+
+With a "weight_windows" block in the settings (optional "dimension", "pilot_particles" and
+    "pilot_batches") a short analog pilot run first generates weight windows on a mesh over the
+    model, which the run then uses. They are saved to --weight-windows-out and can be given back
+    with --weight-windows to skip the pilot on later runs of the same geometry. The figure of merit
+    of the TBR, 1 / (relative error^2 * transport time), is reported with and without them. In
+    batch mode one pilot runs per group of configs sharing an OpenMC session. Weight windows need
+    OpenMC 0.14 or newer, the script stops with an error on older versions rather than running analog.
+
+Besides tallies.out every tally is saved as arrays of means and standard deviations per score and
+    filter bin (--tallies, npz), which tally_aggregate.py stacks across many runs.
+
+Given several configs sharing one geometry (or --output-dir) the script runs them as a batch in
+    this process through openmc.lib, loading the geometry and cross sections once for all configs
+    that only differ in particles, batches or seed, and writes the tallies, tracks and run info of
+    each config to --output-dir.
+
 It is intentionally kept simple as the intention is to use this as an example of integrating
     scientific codes into Galaxy workflows  rather than a proper scientific application.
 """
 
+import os
+import glob
+import re
 import math
 import json
+import time
+import shutil
+import signal
 import argparse
+import statistics
 
+import numpy as np
 import openmc
+import openmc.lib
 import neutronics_material_maker as nmm
-import openmc_plasma_source as ops
+
+from source_cache import DEFAULT_SITES, plasma_source
+
+# CPU time of the interpreter start and the imports above (mostly openmc), the wall time before
+# the first statement cannot be measured without timing in between the imports
+IMPORT_SECONDS = time.process_time()
+PROCESS_START = time.perf_counter()
+
+# First OpenMC with weight window generation and loading
+WEIGHT_WINDOW_VERSION = (0, 14)
 
 parser = argparse.ArgumentParser(
     prog="openmc_run.py",
-    description="OpenMC example run script. Useage: python openmc_run.py <geometry> <settings>",
+    description="OpenMC example run script. Useage: python openmc_run.py <geometry> <settings> [<settings> ...]",
 )
 
 parser.add_argument(
@@ -26,151 +82,894 @@ parser.add_argument(
     help="Geometry CAD file for simulation. Format: h5m"
 )
 parser.add_argument(
-    "config_file",
-    help="Settings file with the run settings for the neutronics simulation. Format: JSON",
+    "config_files",
+    nargs="+",
+    help="Settings file with the run settings for the neutronics simulation, several to run them as a batch. Format: JSON",
 )
-
-args = parser.parse_args()
-
-geometry_file = args.geometry_file
-config_file = args.config_file
-
-# Read in settings file and split to individual sections
-with open(config_file, 'r') as read_file:
-    config = json.load(read_file)
-
-geometry_config = config["geometry"]
-settings_config = config["settings"]
-plasma_config = config["plasma_params"]
-
-# Set up the openmc model to add all the simulation settings to
-model = openmc.model.Model()
-
-##################
-# MATERIALS
-##################
-
-# NOTE: Currently defining these statically
-# Could be easily done dynamically in future with the JSON configuration file
-blanket = nmm.Material.from_library(
-    name="Lithium",
-    enrichment=7.5,
-    enrichment_target="Li6",
-    enrichment_type="ao",
-).openmc_material
-blanket.name = "blanket"
-
-firstwall = nmm.Material.from_library(name="Tungsten").openmc_material
-firstwall.name = "firstwall"
-
-divertor = nmm.Material.from_library(name="Tungsten").openmc_material
-divertor.name = "divertor"
-
-plasma = nmm.Material.from_library(name="DT_plasma").openmc_material
-plasma.name = "plasma"
-
-materials = openmc.Materials([blanket, firstwall, divertor, plasma])
-model.materials = materials
-
-##################
-# GEOMETRY
-##################
-
-# NOTE: Currently defining most of this statically
-# Could be easily done dynamically in future with the JSON configuration file
-
-dagmc_univ = openmc.DAGMCUniverse(filename=geometry_file)
-
-# creates an edge of universe boundary surface
-vac_surf = openmc.Sphere(
-    r=geometry_config["outer_sphere"], surface_id=9999, boundary_type="vacuum"
+parser.add_argument(
+    "--output-dir",
+    default=None,
+    help="Directory to save the outputs of each config of a batch in",
 )
-
-# creates reflective surfaces at 0 and 90 degrees
-reflective_1 = openmc.Plane(
-    a=math.sin(math.radians(0)),
-    b=-math.cos(math.radians(0)),
-    c=0.0,
-    d=0.0,
-    surface_id=9991,
-    boundary_type="reflective",
+parser.add_argument(
+    "--names",
+    nargs="+",
+    default=None,
+    help="Names of the outputs of each config of a batch, one per config file. Default: the config file names",
+)
+parser.add_argument(
+    "--slots",
+    type=int,
+    default=None,
+    help="Number of cores allocated to the run, e.g. ${GALAXY_SLOTS}. Default: every core of the machine",
 )
-reflective_2 = openmc.Plane(
-    a=math.sin(math.radians(90)),
-    b=-math.cos(math.radians(90)),
-    c=0.0,
-    d=0.0,
-    surface_id=9990,
-    boundary_type="reflective",
+parser.add_argument(
+    "--run-info",
+    default="run_info.json",
+    help="File to write the parallel setup and transport rate of the run to. Format: JSON",
 )
-# specifies the region as below the universe boundary and inside the reflective surfaces
-region = -vac_surf & -reflective_1 & +reflective_2
-
-
-# creates a cell from the region and fills the cell with the dagmc geometry
-containing_cell = openmc.Cell(cell_id=9999, region=region, fill=dagmc_univ)
-geometry = openmc.Geometry(root=[containing_cell])
-
-model.geometry = geometry
-
-
-##################
-# RUN SETTINGS
-##################
-
-settings = openmc.Settings()
-
-# NOTE: Currently assuming a tokamak source
-# Could be easily changed dynamically in future with the JSON configuration file
-source_single = ops.TokamakSource(
-    # Geometry parameters
-    major_radius=geometry_config["major_radius"],
-    minor_radius=geometry_config["minor_radius"],
-    elongation=geometry_config["elongation"],
-    triangularity=geometry_config["triangularity"],
-    angles=(math.radians(0), math.radians(90)),
-    pedestal_radius=0.8 * geometry_config["minor_radius"],
-    # Plasma parameters
-    mode=plasma_config["plasma_mode"],  # Confinement mode
-    ion_density_centre=plasma_config["ion_density_centre"],
-    ion_density_peaking_factor=plasma_config["ion_density_peaking_factor"],
-    ion_density_pedestal=plasma_config["ion_density_pedestal"],
-    ion_density_separatrix=plasma_config["ion_density_separatrix"],
-    ion_temperature_centre=plasma_config["ion_temperature_centre"],
-    ion_temperature_peaking_factor=plasma_config["ion_temperature_peaking_factor"],
-    ion_temperature_pedestal=plasma_config["ion_temperature_pedestal"],
-    ion_temperature_separatrix=plasma_config["ion_temperature_separatrix"],
-    shafranov_factor=plasma_config["shafranov_factor"],
-    ion_temperature_beta=plasma_config["ion_temperature_beta"],
+parser.add_argument(
+    "--tallies",
+    default="tallies.npz",
+    help="File to save the mean and standard deviation of every tally to. Format: npz",
+)
+parser.add_argument(
+    "--source-cache",
+    default=os.environ.get("OPENMC_SOURCE_CACHE"),
+    help="Directory to keep sampled plasma source files in between runs. Default: $OPENMC_SOURCE_CACHE",
+)
+parser.add_argument(
+    "--weight-windows",
+    default=None,
+    help="Weight windows from an earlier run on the same geometry to run with. Format: h5",
+)
+parser.add_argument(
+    "--weight-windows-out",
+    default=None,
+    help="File to save the weight windows used by the run to. Format: h5",
+)
+parser.add_argument(
+    "--restart",
+    default=None,
+    help="Statepoint of an earlier run with the same geometry and settings to resume from. Format: h5",
+)
+parser.add_argument(
+    "--extra-batches",
+    type=int,
+    default=None,
+    help="Batches to run on top of those in the --restart statepoint. Default: up to the batches of the config",
+)
+parser.add_argument(
+    "--statepoint-out",
+    default=None,
+    help="File to copy the latest statepoint of the run to. Format: h5",
 )
 
-settings.source = source_single.sources
-
-
-##################
-# SOURCE
-##################
-
-settings.batches = settings_config["batches"]
-settings.particles = settings_config["particles"]
-settings.run_mode = settings_config["run_mode"]
-settings.max_tracks = 100
-
-model.settings = settings
-
-##################
-# TALLIES
-##################
-
-tbr_tally = openmc.Tally(name="TBR")
-tbr_tally.scores = ["H3-production"]
-
-model.tallies = openmc.Tallies([tbr_tally])
-
-##################
-# RUN OPENMC
-##################
+args = parser.parse_args()
 
-model.export_to_xml()
 
-openmc.run(tracks=True)
+def parallel_settings(settings_config, slots):
+    """
+    Function to pick the number of MPI ranks and OpenMP threads per rank
+
+    Args:
+        settings_config (dict): Settings block of the JSON config, may set
+            "mpi_processes" and "threads" (per MPI process)
+        slots (int): Cores allocated to the run, None for every core
+
+    Returns:
+        parallel (dict): format: {'slots': n, 'mpi_processes': n,
+            'threads': n}, never using more than slots cores in total
+    """
+    if slots is None or slots < 1:
+        slots = os.cpu_count() or 1
+
+    mpi_processes = max(1, int(settings_config.get("mpi_processes", 1)))
+    if mpi_processes > 1 and shutil.which("mpiexec") is None:
+        print(f"mpiexec not found, running with 1 MPI process instead of {mpi_processes}")
+        mpi_processes = 1
+    if mpi_processes > slots:
+        print(f"{mpi_processes} MPI processes requested but only {slots} cores allocated, using {slots}")
+        mpi_processes = slots
+
+    max_threads = max(1, slots // mpi_processes)
+    threads = int(settings_config.get("threads", max_threads))
+    if threads > max_threads:
+        print(f"{threads} threads per process requested but only {max_threads} cores free per process, using {max_threads}")
+        threads = max_threads
+
+    return {
+        "slots": slots,
+        "mpi_processes": mpi_processes,
+        "threads": max(1, threads),
+    }
+
+
+def restart_batch(statepoint_file):
+    """
+    Function to read how many batches a statepoint holds
+
+    Args:
+        statepoint_file (string): Path of the statepoint
+
+    Returns:
+        batch (int): Last batch run before the statepoint was written
+    """
+    with openmc.StatePoint(statepoint_file, autolink=False) as statepoint:
+        return int(statepoint.current_batch)
+
+
+def statepoint_batches(batches, interval, start_batch=0):
+    """
+    Function to list the batches to write statepoints at
+
+    Args:
+        batches (int): Total number of batches of the run
+        interval (int): Batches between statepoints, None to only write one at the end
+        start_batch (int): Batches already run before a restart
+
+    Returns:
+        statepoint_batches (array of ints): Always includes the last batch
+    """
+    if interval is None or interval < 1:
+        return [batches]
+    return sorted(set(range(start_batch + interval, batches, interval)) | {batches})
+
+
+def statepoint_files(directory="."):
+    """
+    Function to find the statepoints written in a directory
+
+    Args:
+        directory (string): Directory the run was made in
+
+    Returns:
+        statepoints (dict): format: {batch: statepoint_file}
+    """
+    statepoints = {}
+    for file_path in glob.glob(os.path.join(directory, "statepoint.*.h5")):
+        try:
+            statepoints[int(os.path.basename(file_path).split(".")[1])] = file_path
+        except ValueError:
+            continue
+    return statepoints
+
+
+def latest_statepoint(directory="."):
+    """
+    Function to find the statepoint of the latest batch run in a directory
+
+    Args:
+        directory (string): Directory the run was made in
+
+    Returns:
+        batch (int): Batch of the statepoint, None if there is none
+        statepoint_file (string): Path of the statepoint, None if there is none
+    """
+    statepoints = statepoint_files(directory)
+    if len(statepoints) == 0:
+        return None, None
+    batch = max(statepoints)
+    return batch, statepoints[batch]
+
+
+def save_latest_statepoint(statepoint_out):
+    """
+    Function to copy the statepoint of the latest batch run to statepoint_out
+
+    A run stopped part way can leave its last statepoint half written, so the latest statepoint
+        that can be read is copied. The copy is renamed into place so statepoint_out is never
+        half written either.
+
+    Args:
+        statepoint_out (string): Path to copy the statepoint to, None to skip
+
+    Returns:
+        batch (int): Batch of the copied statepoint, None if there is none
+    """
+    if statepoint_out is None:
+        return None
+    statepoints = statepoint_files()
+    for batch in sorted(statepoints, reverse=True):
+        try:
+            restart_batch(statepoints[batch])
+        except (OSError, KeyError, ValueError):
+            print(f"Statepoint of batch {batch} cannot be read, trying the one before")
+            continue
+        temp_file = f"{statepoint_out}.tmp"
+        shutil.copyfile(statepoints[batch], temp_file)
+        os.replace(temp_file, statepoint_out)
+        return batch
+    print("No statepoint was written")
+    return None
+
+
+def exit_on_sigterm():
+    """
+    Function to turn SIGTERM into SystemExit, so the finally blocks of the run (saving the latest
+        statepoint) run when a scheduler stops the job. A SIGKILL cannot be caught.
+    """
+    def handler(signum, frame):
+        print("Stopped by SIGTERM, saving the latest statepoint")
+        raise SystemExit(128 + signum)
+
+    signal.signal(signal.SIGTERM, handler)
+
+
+def tbr_trigger(settings_config):
+    """
+    Function to build the precision target of the TBR tally from the settings block
+
+    The run goes on past "batches" until the relative error of the TBR is at most
+        "tbr_rel_error", checked every "trigger_batch_interval" batches, and stops at
+        "max_batches" at the latest.
+
+    Args:
+        settings_config (dict): Settings block of the JSON config
+
+    Returns:
+        trigger (openmc.Trigger): None if no target is set
+    """
+    if settings_config.get("tbr_rel_error") is None:
+        return None
+    trigger = openmc.Trigger("rel_err", float(settings_config["tbr_rel_error"]))
+    trigger.scores = ["H3-production"]
+    return trigger
+
+
+def read_results(statepoint_file):
+    """
+    Function to read the batches run, transport time and TBR from the final statepoint
+
+    Args:
+        statepoint_file (string): Path of the statepoint
+
+    Returns:
+        results (dict): format: {'batches': n, 'transport_seconds': s,
+            'tbr': {'mean': m, 'std_dev': s, 'rel_error': r}}, values are None
+            if the statepoint could not be read
+    """
+    results = {
+        "batches": None,
+        "transport_seconds": None,
+        "tbr": {"mean": None, "std_dev": None, "rel_error": None, "figure_of_merit": None},
+    }
+    if statepoint_file is None:
+        return results
+    try:
+        with openmc.StatePoint(statepoint_file, autolink=False) as statepoint:
+            results["batches"] = int(statepoint.current_batch)
+            results["transport_seconds"] = float(statepoint.runtime["transport"])
+            tally = statepoint.get_tally(name="TBR")
+            mean = float(tally.mean.ravel()[0])
+            std_dev = float(tally.std_dev.ravel()[0])
+    except (OSError, KeyError, LookupError):
+        return results
+    rel_error = std_dev / mean if mean != 0 else None
+    results["tbr"] = {
+        "mean": mean,
+        "std_dev": std_dev,
+        "rel_error": rel_error,
+        "figure_of_merit": figure_of_merit(rel_error, results["transport_seconds"]),
+    }
+    return results
+
+
+def write_tally_arrays(statepoint_file, npz_file):
+    """
+    Function to save every tally of a statepoint as arrays, for comparing runs without parsing
+        tallies.out
+
+    For each tally <name> the file holds <name>/mean and <name>/std_dev, shaped
+        (filter bins, nuclides, scores) as in openmc.Tally, <name>/scores, <name>/nuclides,
+        <name>/filters (filter types) and <name>/filter_<i> (bins of filter i), plus the
+        batches and particles of the run.
+
+    Args:
+        statepoint_file (string): Path of the statepoint
+        npz_file (string): Path to save the arrays to. Format: npz
+    """
+    with openmc.StatePoint(statepoint_file, autolink=False) as statepoint:
+        arrays = {
+            "batches": np.array(statepoint.current_batch),
+            "particles": np.array(statepoint.n_particles),
+        }
+        for tally in statepoint.tallies.values():
+            name = tally.name or f"tally_{tally.id}"
+            arrays[f"{name}/mean"] = tally.mean
+            arrays[f"{name}/std_dev"] = tally.std_dev
+            arrays[f"{name}/scores"] = np.array(tally.scores, dtype=str)
+            arrays[f"{name}/nuclides"] = np.array(tally.nuclides, dtype=str)
+            arrays[f"{name}/filters"] = np.array([type(tally_filter).__name__ for tally_filter in tally.filters], dtype=str)
+            for i, tally_filter in enumerate(tally.filters):
+                arrays[f"{name}/filter_{i}"] = np.asarray(tally_filter.bins)
+    # np.savez adds .npz to paths without it, Galaxy dataset paths end in .dat
+    with open(npz_file, "wb") as write_file:
+        np.savez(write_file, **arrays)
+
+
+def figure_of_merit(rel_error, seconds):
+    """
+    Function to work out the figure of merit of a tally, 1 / (relative error^2 * time)
+
+    Returns:
+        figure_of_merit (float): Higher is better, None if it cannot be worked out
+    """
+    if not rel_error or not seconds:
+        return None
+    return 1.0 / (rel_error ** 2 * seconds)
+
+
+def require_weight_window_support():
+    """
+    Function to stop with a clear message when the OpenMC of the container cannot make or read
+        weight windows, openmc.WeightWindowGenerator and openmc.hdf5_to_wws are OpenMC 0.14+
+    """
+    installed = tuple(int(part) for part in re.findall(r"\d+", openmc.__version__)[:2])
+    if installed < WEIGHT_WINDOW_VERSION:
+        raise SystemExit(
+            f"Weight windows need OpenMC {'.'.join(map(str, WEIGHT_WINDOW_VERSION))} or newer, the container has "
+            f"{openmc.__version__}. Remove the weight_windows block and input or use a newer container."
+        )
+
+
+def weight_window_mesh(geometry_config, weight_window_config):
+    """
+    Function to build the mesh weight windows are generated on, covering the quarter of the
+        tokamak inside the reflective planes
+
+    Args:
+        geometry_config (dict): Geometry block of the JSON config
+        weight_window_config (dict): "weight_windows" of the settings block, may set
+            "dimension" [nx, ny, nz] of the mesh
+
+    Returns:
+        mesh (openmc.RegularMesh)
+    """
+    outer = geometry_config["outer_sphere"]
+    mesh = openmc.RegularMesh()
+    mesh.lower_left = (0.0, 0.0, -outer)
+    mesh.upper_right = (outer, outer, outer)
+    mesh.dimension = weight_window_config.get("dimension", [20, 20, 40])
+    return mesh
+
+
+def generate_weight_windows(geometry_file, config, source_cache, threads, weight_windows_out):
+    """
+    Function to make weight windows for the TBR with a short analog pilot run
+
+    The pilot runs the model of the config without weight windows, with "pilot_particles" and
+        "pilot_batches" of the "weight_windows" settings block, in the pilot directory, and
+        generates weight windows on its mesh with the MAGIC method.
+
+    Args:
+        geometry_file (string): DAGMC geometry. Format: h5m
+        config (dict): JSON config
+        source_cache (string): Directory of cached plasma source files
+        threads (int): OpenMP threads to run the pilot with
+        weight_windows_out (string): Path to save the weight windows to, None to only use them
+            in this run. Format: h5
+
+    Returns:
+        weight_windows (array of openmc.WeightWindows)
+        pilot (dict): format: {'particles': n, 'batches': n, 'transport_seconds': s,
+            'figure_of_merit': fom} of the analog pilot
+    """
+    weight_window_config = config["settings"]["weight_windows"]
+    model, _ = build_model(geometry_file, config, source_cache)
+    model.settings.particles = int(weight_window_config.get("pilot_particles", model.settings.particles))
+    model.settings.batches = int(weight_window_config.get("pilot_batches", 5))
+    model.settings.trigger_active = False
+    model.settings.statepoint = {"batches": [model.settings.batches]}
+    model.settings.weight_window_generators = openmc.WeightWindowGenerator(
+        weight_window_mesh(config["geometry"], weight_window_config),
+        particle_type="neutron",
+    )
+    for tally in model.tallies:
+        tally.triggers = []
+
+    print(f"Generating weight windows with a pilot of {model.settings.batches} x {model.settings.particles} particles")
+    os.makedirs("pilot", exist_ok=True)
+    # Outputs of an earlier pilot of this job (another batch session) would be read as this one's
+    for file_path in glob.glob(os.path.join("pilot", "statepoint.*.h5")) + [os.path.join("pilot", "weight_windows.h5")]:
+        if os.path.exists(file_path):
+            os.remove(file_path)
+    model.export_to_xml("pilot")
+    openmc.run(threads=threads, cwd="pilot", output=False)
+
+    results = read_results(latest_statepoint("pilot")[1])
+    weight_windows_file = os.path.join("pilot", "weight_windows.h5")
+    if weight_windows_out is not None:
+        shutil.copyfile(weight_windows_file, weight_windows_out)
+    return openmc.hdf5_to_wws(weight_windows_file), {
+        "particles": model.settings.particles,
+        "batches": model.settings.batches,
+        "transport_seconds": results["transport_seconds"],
+        "figure_of_merit": results["tbr"]["figure_of_merit"],
+    }
+
+
+def build_model(
+    geometry_file, config, source_cache=None, start_batch=0, extra_batches=None, weight_windows=None, source_particles=None
+):
+    """
+    Function to set up the openmc model of one config
+
+    Args:
+        geometry_file (string): DAGMC geometry. Format: h5m
+        config (dict): JSON config with geometry, settings and plasma_params blocks
+        source_cache (string): Directory of cached plasma source files
+        start_batch (int): Batches already in the statepoint being resumed
+        extra_batches (int): Batches to run on top of start_batch, None to run to the
+            batches of the config
+        weight_windows (array of openmc.WeightWindows): Weight windows to run with, None for
+            analog transport
+        source_particles (int): Source particles the source file is sized for, None for the
+            particles times the most batches of the config
+
+    Returns:
+        model (openmc.model.Model)
+        setup (dict): format: {'source': source info, 'trigger': openmc.Trigger or None,
+            'max_batches': n}
+    """
+    geometry_config = config["geometry"]
+    settings_config = config["settings"]
+    plasma_config = config["plasma_params"]
+
+    # Set up the openmc model to add all the simulation settings to
+    model = openmc.model.Model()
+
+    ##################
+    # MATERIALS
+    ##################
+
+    # NOTE: Currently defining these statically
+    # Could be easily done dynamically in future with the JSON configuration file
+    blanket = nmm.Material.from_library(
+        name="Lithium",
+        enrichment=7.5,
+        enrichment_target="Li6",
+        enrichment_type="ao",
+    ).openmc_material
+    blanket.name = "blanket"
+
+    firstwall = nmm.Material.from_library(name="Tungsten").openmc_material
+    firstwall.name = "firstwall"
+
+    divertor = nmm.Material.from_library(name="Tungsten").openmc_material
+    divertor.name = "divertor"
+
+    plasma = nmm.Material.from_library(name="DT_plasma").openmc_material
+    plasma.name = "plasma"
+
+    materials = openmc.Materials([blanket, firstwall, divertor, plasma])
+    model.materials = materials
+
+    ##################
+    # GEOMETRY
+    ##################
+
+    # NOTE: Currently defining most of this statically
+    # Could be easily done dynamically in future with the JSON configuration file
+
+    dagmc_univ = openmc.DAGMCUniverse(filename=os.path.abspath(geometry_file))
+
+    # creates an edge of universe boundary surface
+    vac_surf = openmc.Sphere(
+        r=geometry_config["outer_sphere"], surface_id=9999, boundary_type="vacuum"
+    )
+
+    # creates reflective surfaces at 0 and 90 degrees
+    reflective_1 = openmc.Plane(
+        a=math.sin(math.radians(0)),
+        b=-math.cos(math.radians(0)),
+        c=0.0,
+        d=0.0,
+        surface_id=9991,
+        boundary_type="reflective",
+    )
+    reflective_2 = openmc.Plane(
+        a=math.sin(math.radians(90)),
+        b=-math.cos(math.radians(90)),
+        c=0.0,
+        d=0.0,
+        surface_id=9990,
+        boundary_type="reflective",
+    )
+    # specifies the region as below the universe boundary and inside the reflective surfaces
+    region = -vac_surf & -reflective_1 & +reflective_2
+
+    # creates a cell from the region and fills the cell with the dagmc geometry
+    containing_cell = openmc.Cell(cell_id=9999, region=region, fill=dagmc_univ)
+    geometry = openmc.Geometry(root=[containing_cell])
+
+    model.geometry = geometry
+
+    ##################
+    # RUN SETTINGS
+    ##################
+
+    settings = openmc.Settings()
+
+    settings.batches = settings_config["batches"]
+    if start_batch > 0 and extra_batches is not None:
+        settings.batches = start_batch + extra_batches
+
+    trigger = tbr_trigger(settings_config)
+    max_batches = settings.batches
+    if trigger is not None:
+        max_batches = max(int(settings_config.get("max_batches", settings.batches)), settings.batches)
+        settings.trigger_active = True
+        settings.trigger_max_batches = max_batches
+        settings.trigger_batch_interval = int(settings_config.get("trigger_batch_interval", 1))
+
+    settings.statepoint = {
+        "batches": statepoint_batches(max_batches, settings_config.get("statepoint_interval"), start_batch)
+    }
+    settings.particles = settings_config["particles"]
+    settings.run_mode = settings_config["run_mode"]
+    # Tracks to write, more can be asked for and thinned by the track filter tool afterwards
+    settings.max_tracks = int(settings_config.get("max_tracks", 100))
+    if "seed" in settings_config:
+        settings.seed = int(settings_config["seed"])
+    if weight_windows is not None:
+        settings.weight_windows = weight_windows
+        settings.weight_windows_on = True
+
+    ##################
+    # SOURCE
+    ##################
+
+    # OpenMC samples the source file with replacement, a file with fewer sites than the source
+    # particles drawn reuses sites and correlates the batches
+    if source_particles is None:
+        source_particles = int(settings_config["particles"]) * max_batches
+    sites = int(settings_config.get("source_sites", max(DEFAULT_SITES, source_particles)))
+    if sites < source_particles:
+        print(
+            f"Warning: {source_particles} source particles drawn from {sites} source sites, each site is used"
+            f" {source_particles / sites:.1f} times on average. Raise source_sites to decorrelate the batches"
+        )
+
+    # NOTE: Currently assuming a tokamak source
+    # Could be easily changed dynamically in future with the JSON configuration file
+    source, source_info = plasma_source(
+        geometry_config,
+        plasma_config,
+        angles=(math.radians(0), math.radians(90)),
+        sites=sites,
+        cache_dir=source_cache,
+    )
+    if source_info["cached"]:
+        print(f"Using cached plasma source {source_info['key'][:16]}, saved {source_info['seconds_saved']:.1f}s")
+
+    settings.source = source
+
+    model.settings = settings
+
+    ##################
+    # TALLIES
+    ##################
+
+    tbr_tally = openmc.Tally(name="TBR")
+    tbr_tally.scores = ["H3-production"]
+    if trigger is not None:
+        tbr_tally.triggers = [trigger]
+
+    model.tallies = openmc.Tallies([tbr_tally])
+
+    return model, {"source": source_info, "trigger": trigger, "max_batches": max_batches}
+
+
+def run_info_of(results, particles, start_batch, trigger, wall_seconds):
+    """
+    Function to sum up a finished run for the run info output
+
+    Args:
+        results (dict): From read_results
+        particles (int): Particles per batch
+        start_batch (int): Batches already run before a restart
+        trigger (openmc.Trigger): Precision target of the TBR, None if there is none
+        wall_seconds (float): Time taken by the run
+
+    Returns:
+        run_info (dict)
+    """
+    tbr = dict(results["tbr"], target_rel_error=trigger.threshold if trigger is not None else None)
+    tbr["converged"] = trigger is None or (
+        tbr["rel_error"] is not None and tbr["rel_error"] <= trigger.threshold
+    )
+    batches_run = (results["batches"] or start_batch) - start_batch
+    if tbr["rel_error"] is not None:
+        print(
+            f"TBR {tbr['mean']:.5g} +/- {tbr['std_dev']:.3g} "
+            f"(relative error {tbr['rel_error']:.3g}) after {results['batches']} batches"
+        )
+    return {
+        "particles": particles,
+        "batches": results["batches"],
+        "restarted_from_batch": start_batch,
+        "wall_seconds": wall_seconds,
+        "transport_seconds": results["transport_seconds"],
+        "particles_per_second": particles * batches_run / (results["transport_seconds"] or wall_seconds),
+        "tbr": tbr,
+    }
+
+
+def run_single(args):
+    """
+    Function to run one config with the openmc executable, in the working directory
+    """
+    with open(args.config_files[0], 'r') as read_file:
+        config = json.load(read_file)
+    settings_config = config["settings"]
+
+    start_batch = 0
+    if args.restart is not None:
+        start_batch = restart_batch(args.restart)
+
+    parallel = parallel_settings(settings_config, args.slots)
+
+    weight_windows = None
+    weight_window_info = None
+    if args.weight_windows is not None or "weight_windows" in settings_config:
+        require_weight_window_support()
+    if args.weight_windows is not None:
+        weight_windows = openmc.hdf5_to_wws(args.weight_windows)
+        weight_window_info = {"from": "input"}
+        if args.weight_windows_out is not None:
+            shutil.copyfile(args.weight_windows, args.weight_windows_out)
+    elif "weight_windows" in settings_config:
+        weight_windows, pilot = generate_weight_windows(
+            args.geometry_file, config, args.source_cache, parallel["threads"], args.weight_windows_out
+        )
+        weight_window_info = {"from": "pilot", "pilot": pilot}
+
+    model, setup = build_model(
+        args.geometry_file, config, args.source_cache, start_batch, args.extra_batches, weight_windows
+    )
+    batches = model.settings.batches
+    if start_batch > 0:
+        if batches <= start_batch:
+            raise SystemExit(
+                f"The statepoint already holds {start_batch} batches, set --extra-batches to run more than "
+                f"the {batches} of the config"
+            )
+        print(f"Resuming from batch {start_batch} of {args.restart}, running to batch {batches}")
+    if setup["trigger"] is not None:
+        print(
+            f"Running until the TBR relative error is at most {setup['trigger'].threshold}, "
+            f"between {batches} and {setup['max_batches']} batches"
+        )
+
+    model.export_to_xml()
+
+    print(
+        f"Running on {parallel['slots']} cores: {parallel['mpi_processes']} MPI process(es) "
+        f"x {parallel['threads']} thread(s)"
+    )
+
+    mpi_args = None
+    if parallel["mpi_processes"] > 1:
+        mpi_args = ["mpiexec", "-n", str(parallel["mpi_processes"])]
+
+    exit_on_sigterm()
+    start = time.perf_counter()
+    try:
+        openmc.run(tracks=True, threads=parallel["threads"], mpi_args=mpi_args, restart_file=args.restart)
+    finally:
+        # Keep the last checkpoint when the run fails or is stopped with SIGTERM part way
+        saved_batch = save_latest_statepoint(args.statepoint_out)
+    wall_seconds = time.perf_counter() - start
+
+    # Without parallel HDF5 each MPI rank writes its own track file
+    rank_track_files = sorted(glob.glob("tracks_p*.h5"))
+    if len(rank_track_files) > 0:
+        openmc.Tracks.combine(rank_track_files, "tracks.h5")
+
+    run_info = run_info_of(
+        read_results(latest_statepoint()[1]),
+        model.settings.particles,
+        start_batch,
+        setup["trigger"],
+        wall_seconds,
+    )
+    run_info.update({
+        "parallel": parallel,
+        "max_batches": setup["max_batches"],
+        "statepoint_batch": saved_batch,
+        "source": setup["source"],
+    })
+    if weight_window_info is not None:
+        weight_window_info["figure_of_merit"] = run_info["tbr"]["figure_of_merit"]
+        analog = weight_window_info.get("pilot", {}).get("figure_of_merit")
+        if analog and run_info["tbr"]["figure_of_merit"]:
+            weight_window_info["figure_of_merit_gain"] = run_info["tbr"]["figure_of_merit"] / analog
+            print(
+                f"TBR figure of merit {run_info['tbr']['figure_of_merit']:.4g} with weight windows, "
+                f"{analog:.4g} analog ({weight_window_info['figure_of_merit_gain']:.2f}x)"
+            )
+        run_info["weight_windows"] = weight_window_info
+
+    with open(args.run_info, "w") as write_file:
+        json.dump(run_info, write_file, indent=4)
+
+    statepoint_file = latest_statepoint()[1]
+    if args.tallies is not None and statepoint_file is not None:
+        write_tally_arrays(statepoint_file, args.tallies)
+
+
+def batch_group_key(config):
+    """
+    Function to find which configs can share one OpenMC session
+
+    Particles, batches and seed can be changed between runs of an initialised OpenMC, anything
+        else (plasma source, geometry block, triggers) needs the model to be loaded again.
+
+    Returns:
+        key (string): Same for configs that can share a session
+    """
+    shared = json.loads(json.dumps(config))
+    for name in ("particles", "batches", "seed", "threads", "mpi_processes"):
+        shared["settings"].pop(name, None)
+    return json.dumps(shared, sort_keys=True)
+
+
+def output_names(config_files, names=None):
+    """
+    Function to name the outputs of each config of a batch
+
+    Args:
+        config_files (array of strings): Config files of the batch
+        names (array of strings): Name of each config, e.g. Galaxy element identifiers, None
+            to use the config file names
+
+    Returns:
+        output_names (array of strings): Names without path separators, repeated names numbered
+    """
+    if names is None:
+        names = [os.path.splitext(os.path.basename(config_file))[0] for config_file in config_files]
+    cleaned = [name.replace(os.sep, "_").replace("/", "_").strip() or "config" for name in names]
+    seen = {}
+    unique = []
+    for name in cleaned:
+        seen[name] = seen.get(name, 0) + 1
+        unique.append(f"{name}_{seen[name]}" if cleaned.count(name) > 1 else name)
+    return unique
+
+
+def run_batch(args):
+    """
+    Function to run many configs sharing one geometry in this process
+
+    The geometry and cross sections are loaded once into OpenMC (openmc.lib) per group of configs
+        that only differ in particles, batches or seed, and each config is run in turn in memory.
+        The outputs of each config are saved in output_dir as tbr/<name>.out (name from --names
+        or the config file name),
+        tracks/<name>.h5, tallies/<name>.npz and run_info/<name>.json, with batch_info.json summing up the
+        overhead shared between the configs.
+    """
+    for output in ("tbr", "tracks", "run_info", "tallies"):
+        os.makedirs(os.path.join(args.output_dir, output), exist_ok=True)
+
+    groups = {}
+    for config_file, name in zip(args.config_files, output_names(args.config_files, args.names)):
+        with open(config_file, 'r') as read_file:
+            config = json.load(read_file)
+        groups.setdefault(batch_group_key(config), []).append((name, config))
+
+    # openmc.lib runs in this process, so only threads are used
+    parallel = parallel_settings({"threads": args.slots or os.cpu_count() or 1}, args.slots)
+
+    weight_windows = None
+    if args.weight_windows is not None or any(
+        "weight_windows" in config["settings"] for configs in groups.values() for _, config in configs
+    ):
+        require_weight_window_support()
+    if args.weight_windows is not None:
+        weight_windows = openmc.hdf5_to_wws(args.weight_windows)
+    print(f"Running {len(args.config_files)} configs in {len(groups)} OpenMC session(s) with {parallel['threads']} thread(s)")
+
+    batch_info = {
+        "parallel": parallel,
+        "configs": len(args.config_files),
+        "import_seconds": IMPORT_SECONDS,
+        "sessions": [],
+    }
+    transport_total = 0.0
+    for configs in groups.values():
+        # The weight_windows block is part of the group key, so a pilot serves every config of the group
+        group_weight_windows = weight_windows
+        weight_window_info = {"from": "input"} if weight_windows is not None else None
+        if weight_windows is None and "weight_windows" in configs[0][1]["settings"]:
+            group_weight_windows, pilot = generate_weight_windows(
+                args.geometry_file, configs[0][1], args.source_cache, parallel["threads"], None
+            )
+            weight_window_info = {"from": "pilot", "pilot": pilot}
+
+        init_start = time.perf_counter()
+        # The configs share the source file, so it is sized for the one drawing the most particles
+        source_particles = max(
+            int(config["settings"]["particles"])
+            * max(int(config["settings"]["batches"]), int(config["settings"].get("max_batches", 0)))
+            for _, config in configs
+        )
+        model, setup = build_model(
+            args.geometry_file, configs[0][1], args.source_cache, weight_windows=group_weight_windows,
+            source_particles=source_particles,
+        )
+        model.export_to_xml()
+        openmc.lib.init(args=["--track", "--threads", str(parallel["threads"])], output=False)
+        init_seconds = time.perf_counter() - init_start
+        session = {"configs": [name for name, _ in configs], "init_seconds": init_seconds}
+
+        try:
+            for name, config in configs:
+                settings_config = config["settings"]
+                for file_path in glob.glob("statepoint.*.h5") + ["tracks.h5", "tallies.out"]:
+                    if os.path.exists(file_path):
+                        os.remove(file_path)
+
+                openmc.lib.hard_reset()
+                openmc.lib.settings.particles = int(settings_config["particles"])
+                batches = int(settings_config["batches"])
+                if setup["trigger"] is None:
+                    openmc.lib.settings.set_batches(batches)
+                else:
+                    # The trigger runs up to max_batches of this config, not of the config the
+                    # session was loaded with, so it is set first and batches kept below it
+                    openmc.lib.settings.set_batches(max(int(settings_config.get("max_batches", batches)), batches))
+                    openmc.lib.settings.set_batches(batches, set_max_batches=False)
+                if "seed" in settings_config:
+                    openmc.lib.settings.seed = int(settings_config["seed"])
+
+                start = time.perf_counter()
+                openmc.lib.run(output=False)
+                wall_seconds = time.perf_counter() - start
+
+                shutil.move("tallies.out", os.path.join(args.output_dir, "tbr", f"{name}.out"))
+                shutil.move("tracks.h5", os.path.join(args.output_dir, "tracks", f"{name}.h5"))
+                statepoint_file = latest_statepoint()[1]
+                write_tally_arrays(statepoint_file, os.path.join(args.output_dir, "tallies", f"{name}.npz"))
+                run_info = run_info_of(
+                    read_results(statepoint_file),
+                    int(settings_config["particles"]),
+                    0,
+                    setup["trigger"],
+                    wall_seconds,
+                )
+                run_info.update({"parallel": parallel, "source": setup["source"], "batch_session_init_seconds": init_seconds})
+                if weight_window_info is not None:
+                    run_info["weight_windows"] = weight_window_info
+                with open(os.path.join(args.output_dir, "run_info", f"{name}.json"), "w") as write_file:
+                    json.dump(run_info, write_file, indent=4)
+                transport_total += run_info["transport_seconds"] or wall_seconds
+        finally:
+            openmc.lib.finalize()
+        batch_info["sessions"].append(session)
+
+    total_seconds = IMPORT_SECONDS + time.perf_counter() - PROCESS_START
+    batch_info["total_seconds"] = total_seconds
+    batch_info["transport_seconds"] = transport_total
+    # Everything but transport is overhead, shared by all configs of the batch
+    batch_info["amortised_overhead_seconds"] = (total_seconds - transport_total) / len(args.config_files)
+    # A separate job per config pays the imports and a full model load every time
+    batch_info["separate_job_overhead_seconds"] = IMPORT_SECONDS + statistics.mean(
+        session["init_seconds"] for session in batch_info["sessions"]
+    )
+    print(
+        f"Overhead per config {batch_info['amortised_overhead_seconds']:.2f}s, "
+        f"against {batch_info['separate_job_overhead_seconds']:.2f}s as separate jobs (excluding container start)"
+    )
+    with open(os.path.join(args.output_dir, "batch_info.json"), "w") as write_file:
+        json.dump(batch_info, write_file, indent=4)
+
+
+if len(args.config_files) > 1 or args.output_dir is not None:
+    if args.restart is not None or args.statepoint_out is not None:
+        parser.error("--restart and --statepoint-out only work with a single config")
+    if args.names is not None and len(args.names) != len(args.config_files):
+        parser.error(f"--names gives {len(args.names)} names for {len(args.config_files)} config files")
+    run_batch(args)
+else:
+    run_single(args)
@@ -0,0 +1,241 @@
+"""
+Cache of the tokamak plasma source of openmc_run.py.
+
+ops.TokamakSource builds one openmc.Source per sampled point of the plasma, so a finely
+    discretised source is thousands of Python objects, all of which are written out to
+    settings.xml and parsed again by OpenMC. Instead the source is sampled once into an OpenMC
+    source file (positions, directions and energies of source sites) keyed by the SHA-256 of
+    the parameters it depends on, and runs with the same plasma and plasma shape read that file.
+    Changes to the blanket, materials, particle count or batches keep the same key, a cached file
+    with at least the sites a run asks for is used for it.
+
+OpenMC samples the sites of a source file at random with replacement, so a run drawing more
+    source particles than the file has sites uses sites more than once, correlating source
+    particles between batches. openmc_run.py sizes the file to the particles drawn by the run.
+"""
+
+import os
+import glob
+import json
+import math
+import time
+import hashlib
+import tempfile
+
+import h5py
+import numpy as np
+import openmc
+import openmc_plasma_source as ops
+
+# Geometry parameters the plasma source depends on, the rest only change the CAD
+SOURCE_GEOMETRY_KEYS = ("major_radius", "minor_radius", "elongation", "triangularity")
+
+DEFAULT_SITES = 100000
+
+# Layout of the source bank in an OpenMC (0.13+) source file, as openmc.write_source_file writes it
+POSITION_DTYPE = np.dtype([("x", "<f8"), ("y", "<f8"), ("z", "<f8")])
+SOURCE_DTYPE = np.dtype([
+    ("r", POSITION_DTYPE), ("u", POSITION_DTYPE), ("E", "<f8"), ("time", "<f8"), ("wgt", "<f8"),
+    ("delayed_group", "<i4"), ("surf_id", "<i4"), ("particle", "<i4"),
+])
+
+
+def source_key(geometry_config, plasma_config, angles):
+    """
+    Function to build the cache key of a plasma source
+
+    Args:
+        geometry_config (dict): Geometry block of the JSON config
+        plasma_config (dict): Plasma parameters block of the JSON config
+        angles (tuple of floats): Toroidal extent of the source in radians
+
+    Returns:
+        key (string): Hex SHA-256 of the source description
+    """
+    description = {
+        "geometry": {name: geometry_config[name] for name in SOURCE_GEOMETRY_KEYS},
+        "plasma": plasma_config,
+        "angles": list(angles),
+    }
+    return hashlib.sha256(json.dumps(description, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def tokamak_sources(geometry_config, plasma_config, angles):
+    """
+    Function to build the per point sources of the tokamak plasma
+
+    Returns:
+        sources (array of openmc.Source)
+    """
+    return ops.TokamakSource(
+        # Geometry parameters
+        major_radius=geometry_config["major_radius"],
+        minor_radius=geometry_config["minor_radius"],
+        elongation=geometry_config["elongation"],
+        triangularity=geometry_config["triangularity"],
+        angles=angles,
+        pedestal_radius=0.8 * geometry_config["minor_radius"],
+        # Plasma parameters
+        mode=plasma_config["plasma_mode"],  # Confinement mode
+        ion_density_centre=plasma_config["ion_density_centre"],
+        ion_density_peaking_factor=plasma_config["ion_density_peaking_factor"],
+        ion_density_pedestal=plasma_config["ion_density_pedestal"],
+        ion_density_separatrix=plasma_config["ion_density_separatrix"],
+        ion_temperature_centre=plasma_config["ion_temperature_centre"],
+        ion_temperature_peaking_factor=plasma_config["ion_temperature_peaking_factor"],
+        ion_temperature_pedestal=plasma_config["ion_temperature_pedestal"],
+        ion_temperature_separatrix=plasma_config["ion_temperature_separatrix"],
+        shafranov_factor=plasma_config["shafranov_factor"],
+        ion_temperature_beta=plasma_config["ion_temperature_beta"],
+    ).sources
+
+
+def _energy_spread(energy):
+    """Mean and standard deviation of the Muir (Gaussian) energy of a point source"""
+    if isinstance(energy, openmc.stats.Normal):
+        return energy.mean_value, energy.std_dev
+    return energy.e0, math.sqrt(2.0 * energy.e0 * energy.kt / energy.m_rat)
+
+
+def write_source_file(sources, sites, file_path, seed=None):
+    """
+    Function to sample source sites from the point sources of a TokamakSource
+
+    Each site picks a point source with probability given by its strength, a toroidal angle
+        uniform over the source extent, an isotropic direction and a Muir distributed energy.
+        The sites are written straight to the source bank of the file as one structured array.
+
+    Args:
+        sources (array of openmc.Source): Sources from TokamakSource
+        sites (int): Number of sites to sample
+        file_path (string): Path of the OpenMC source file to write. Format: h5
+        seed (int): Seed of the sampling, None for a random seed
+    """
+    rng = np.random.default_rng(seed)
+
+    strengths = np.array([source.strength for source in sources], dtype=float)
+    index = rng.choice(len(sources), size=sites, p=strengths / strengths.sum())
+
+    radius = np.array([source.space.r.x[0] for source in sources])[index]
+    phi = rng.uniform(
+        np.array([source.space.phi.a for source in sources])[index],
+        np.array([source.space.phi.b for source in sources])[index],
+    )
+    spread = np.array([_energy_spread(source.energy) for source in sources])[index]
+    mu = rng.uniform(-1.0, 1.0, sites)
+    azimuth = rng.uniform(0.0, 2.0 * np.pi, sites)
+    transverse = np.sqrt(1.0 - mu ** 2)
+
+    bank = np.zeros(sites, dtype=SOURCE_DTYPE)
+    bank["r"]["x"] = radius * np.cos(phi)
+    bank["r"]["y"] = radius * np.sin(phi)
+    bank["r"]["z"] = np.array([source.space.z.x[0] for source in sources])[index]
+    bank["u"]["x"] = transverse * np.cos(azimuth)
+    bank["u"]["y"] = transverse * np.sin(azimuth)
+    bank["u"]["z"] = mu
+    bank["E"] = np.maximum(rng.normal(spread[:, 0], spread[:, 1]), 1.0)
+    bank["wgt"] = 1.0
+    # Neutrons, not from a surface source or a delayed group
+    bank["particle"] = 0
+
+    with h5py.File(file_path, "w") as f_write:
+        f_write.attrs["filetype"] = np.bytes_("source")
+        f_write.create_dataset("source_bank", data=bank)
+
+
+def cached_sources(directory, key):
+    """
+    Function to list the source files of a key in the cache
+
+    Args:
+        directory (string): Cache directory
+        key (string): Key from source_key
+
+    Returns:
+        sources (dict): format: {sites: (source_file, stored info)}
+    """
+    sources = {}
+    for info_file in glob.glob(os.path.join(directory, f"source_{key[:16]}_*.json")):
+        try:
+            with open(info_file, "r") as read_file:
+                stored = json.load(read_file)
+        except (OSError, ValueError):
+            continue
+        source_file = f"{os.path.splitext(info_file)[0]}.h5"
+        if stored.get("key") == key and os.path.isfile(source_file):
+            sources[int(stored["sites"])] = (source_file, stored)
+    return sources
+
+
+def _replace_atomically(directory, file_path, write):
+    """Write a file with write(temp_path) and rename it into place, so it is never half written"""
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(file_path) + ".", suffix=".tmp")
+    os.close(fd)
+    try:
+        write(temp_path)
+        os.replace(temp_path, file_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def plasma_source(geometry_config, plasma_config, angles, sites=DEFAULT_SITES, cache_dir=None):
+    """
+    Function to get the file source of the tokamak plasma, from cache_dir if it was made before
+
+    Args:
+        geometry_config (dict): Geometry block of the JSON config
+        plasma_config (dict): Plasma parameters block of the JSON config
+        angles (tuple of floats): Toroidal extent of the source in radians
+        sites (int): Least number of source sites the file needs
+        cache_dir (string): Directory to keep source files in between runs, None to only
+            make one in the working directory
+
+    Returns:
+        source (openmc.Source): Source reading the source file
+        info (dict): format: {'key': key, 'cached': bool, 'sites': n in the file,
+            'seconds': time to get the source, 'generation_seconds': time it took
+            to make, 'seconds_saved': generation minus load time on a hit}
+    """
+    start = time.perf_counter()
+    key = source_key(geometry_config, plasma_config, angles)
+    directory = cache_dir if cache_dir else "."
+
+    # The smallest cached file with enough sites
+    cached = {}
+    if cache_dir and os.path.isdir(cache_dir):
+        cached = {n: found for n, found in cached_sources(cache_dir, key).items() if n >= sites}
+
+    if cached:
+        sites = min(cached)
+        file_path, stored = cached[sites]
+        file_path = os.path.abspath(file_path)
+        generation_seconds = stored.get("generation_seconds")
+    else:
+        os.makedirs(directory, exist_ok=True)
+        file_path = os.path.abspath(os.path.join(directory, f"source_{key[:16]}_{sites}.h5"))
+        sources = tokamak_sources(geometry_config, plasma_config, angles)
+        _replace_atomically(
+            directory,
+            file_path,
+            lambda temp_path: write_source_file(sources, sites, temp_path, seed=int(key[:8], 16)),
+        )
+        generation_seconds = time.perf_counter() - start
+
+        def write_info(temp_path):
+            with open(temp_path, "w") as write_file:
+                json.dump({"key": key, "sites": sites, "generation_seconds": generation_seconds}, write_file)
+
+        _replace_atomically(directory, f"{os.path.splitext(file_path)[0]}.json", write_info)
+
+    seconds = time.perf_counter() - start
+    info = {
+        "key": key,
+        "cached": bool(cached),
+        "sites": sites,
+        "seconds": seconds,
+        "generation_seconds": generation_seconds,
+        "seconds_saved": generation_seconds - seconds if cached and generation_seconds is not None else 0.0,
+    }
+    return openmc.Source(filename=file_path), info
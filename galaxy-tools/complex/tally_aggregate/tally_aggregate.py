@@ -0,0 +1,146 @@
+"""
+Combine the tally arrays (npz) of many OpenMC runs into one summary.
+
+Each input is the Tallies output of the openmc tool: <name>/mean and <name>/std_dev arrays
+    shaped (filter bins, nuclides, scores) for every tally, see write_tally_arrays in
+    openmc_run.py. The summary stacks them along a new first axis of runs, so a whole sweep
+    loads with a single np.load:
+        summary = np.load("summary.npz")
+        summary["runs"]          # run names, shape (runs,)
+        summary["TBR/mean"]      # shape (runs, filter bins, nuclides, scores)
+    and optionally writes a flat CSV table with one row per run, tally, bin, nuclide and score.
+
+Usage: tally_aggregate.py summary.npz run_1.npz run_2.npz ... --names run_1 run_2 ... --table summary.csv
+"""
+
+import os
+import csv
+import argparse
+
+import numpy as np
+
+parser = argparse.ArgumentParser(
+    prog="tally_aggregate.py",
+    description="Combine the tally arrays of many OpenMC runs. Usage: tally_aggregate.py <summary.npz> <run.npz> [<run.npz> ...]",
+)
+parser.add_argument("out_file", help="Combined tallies of every run. Format: npz")
+parser.add_argument("in_files", nargs="+", help="Tallies output of each run. Format: npz")
+parser.add_argument("--names", nargs="+", default=None, help="Name of each run, default the file names")
+parser.add_argument("--table", default=None, help="Also write the combined tallies as a table. Format: CSV")
+
+args = parser.parse_args()
+
+
+def read_runs(in_files):
+    """
+    Function to read the tally arrays of every run
+
+    Args:
+        in_files (array of strings): Tallies output of each run. Format: npz
+
+    Returns:
+        runs (array of dicts): Arrays of each run, format: {key: array}
+    """
+    runs = []
+    for in_file in in_files:
+        with np.load(in_file, allow_pickle=False) as data:
+            runs.append({key: data[key] for key in data.files})
+    return runs
+
+
+def aggregate(runs, names):
+    """
+    Function to stack the arrays of every run along a new first axis
+
+    Tallies missing from a run, or shaped differently from the first run that has them, are
+        filled with NaN for that run.
+
+    Args:
+        runs (array of dicts): From read_runs
+        names (array of strings): Name of each run
+
+    Returns:
+        summary (dict): format: {'runs': names, '<tally>/mean': array, ...}
+    """
+    summary = {"runs": np.array(names, dtype=str)}
+    summary["batches"] = np.array([run.get("batches", -1) for run in runs], dtype=np.int64)
+    summary["particles"] = np.array([run.get("particles", -1) for run in runs], dtype=np.int64)
+
+    keys = []
+    for run in runs:
+        keys.extend(key for key in run if key not in keys)
+
+    for key in keys:
+        if key in ("batches", "particles"):
+            continue
+        if key.endswith("/mean") or key.endswith("/std_dev"):
+            shape = next(run[key].shape for run in runs if key in run)
+            stacked = np.full((len(runs),) + shape, np.nan)
+            for i, run in enumerate(runs):
+                if key in run and run[key].shape == shape:
+                    stacked[i] = run[key]
+                elif key in run:
+                    print(f"{names[i]}: {key} is shaped {run[key].shape} not {shape}, left out")
+            summary[key] = stacked
+        else:
+            # Scores, nuclides and filter bins describe the axes, taken from the first run
+            summary[key] = next(run[key] for run in runs if key in run)
+    return summary
+
+
+def write_table(summary, table_file):
+    """
+    Function to write the combined tallies with one row per run, tally, filter bin, nuclide
+        and score
+
+    Args:
+        summary (dict): From aggregate
+        table_file (string): Path of the table. Format: CSV
+    """
+    names = summary["runs"]
+    with open(table_file, "w", newline="") as write_file:
+        writer = csv.writer(write_file)
+        writer.writerow(["run", "tally", "filter_bin", "nuclide", "score", "mean", "std_dev", "rel_error"])
+        for key in summary:
+            if not key.endswith("/mean"):
+                continue
+            tally = key[:-len("/mean")]
+            mean = summary[key]
+            std_dev = summary[f"{tally}/std_dev"]
+            nuclides = summary.get(f"{tally}/nuclides", np.array([]))
+            scores = summary.get(f"{tally}/scores", np.array([]))
+
+            # Index of every value along each axis, flattened in the same order as the values
+            run_i, bin_i, nuclide_i, score_i = (
+                index.ravel() for index in np.indices(mean.shape)
+            )
+            with np.errstate(divide="ignore", invalid="ignore"):
+                rel_error = np.where(mean != 0, std_dev / mean, np.nan).ravel()
+            writer.writerows(zip(
+                names[run_i],
+                [tally] * len(run_i),
+                bin_i,
+                nuclides[nuclide_i] if len(nuclides) == mean.shape[2] else nuclide_i,
+                scores[score_i] if len(scores) == mean.shape[3] else score_i,
+                mean.ravel(),
+                std_dev.ravel(),
+                rel_error,
+            ))
+
+
+names = args.names
+if names is None:
+    names = [os.path.splitext(os.path.basename(in_file))[0] for in_file in args.in_files]
+if len(names) != len(args.in_files):
+    parser.error(f"{len(names)} names given for {len(args.in_files)} files")
+
+summary = aggregate(read_runs(args.in_files), names)
+
+# np.savez adds .npz to paths without it, Galaxy dataset paths end in .dat
+with open(args.out_file, "wb") as write_file:
+    np.savez(write_file, **summary)
+
+if args.table is not None:
+    write_table(summary, args.table)
+
+print(f"Combined the tallies of {len(names)} runs into {args.out_file}")
@@ -0,0 +1,237 @@
+"""
+Filter and subsample the tracks of an OpenMC track file down to a size that can be viewed.
+
+Settings come from the "track_filter" block of the workflow JSON config, all optional:
+    "track_filter": {
+        "particles": ["neutron", "photon"],     particle types to keep
+        "energy": [1.0e5, 2.0e7],               window of the starting energy of a track in eV
+        "region": {"lower_left": [x, y, z],     box a track needs at least one point in, cm
+                   "upper_right": [x, y, z]},
+        "max_tracks": 1000,                     most tracks to keep
+        "stratify": "both",                     keep the share of each "particle" type, "energy"
+                                                bin, "both" or "none" when subsampling
+        "energy_bins": 8,                       log spaced energy bins for stratifying
+        "seed": 1                               seed of the random subsampling
+    }
+
+The file is read one dataset (source particle) at a time, twice: the first pass only keeps a few
+    numbers per track to pick the tracks, the second copies the picked tracks to the output, so
+    the whole file is never held in memory. The output keeps the OpenMC track file layout, so it
+    can go into any of the track converters.
+
+Usage: track_filter.py <tracks.h5> <filtered.h5> [--config config.json]
+"""
+
+import json
+import argparse
+
+import h5py
+import numpy as np
+
+# openmc.ParticleType values
+PARTICLE_TYPES = {"neutron": 0, "photon": 1, "electron": 2, "positron": 3}
+
+
+def track_datasets(f_read):
+    """
+    Function to iterate over the datasets of a track file, reading each into an array
+
+    Yields:
+        name (string): Dataset name, track_<batch>_<generation>_<particle>
+        states (array): Every state of every track of the dataset
+        offsets (array): Start of each track in states, with the end of the last
+        particles (array): Particle type of each track
+    """
+    state_dtype = None
+    for name in f_read:
+        if not name.startswith("track_"):
+            continue
+        dset = f_read[name]
+        # Every dataset has the same compound type, reading into an array of it directly
+        # skips working the type out again for each of the (many) small datasets
+        if state_dtype is None:
+            state_dtype = dset.dtype
+        states = np.empty(dset.shape, dtype=state_dtype)
+        dset.id.read(h5py.h5s.ALL, h5py.h5s.ALL, states)
+        yield name, states, np.asarray(dset.attrs["offsets"], dtype=np.int64), np.asarray(dset.attrs["particles"])
+
+
+def select_candidates(states, offsets, particles, settings):
+    """
+    Function to find the tracks of a dataset passing the particle, energy and region filters
+
+    Returns:
+        keep (array of bools): One per track
+        energy (array): Starting energy of each track
+    """
+    counts = np.diff(offsets)
+    keep = counts > 1
+
+    if "particles" in settings:
+        wanted = [PARTICLE_TYPES[particle] for particle in settings["particles"]]
+        keep &= np.isin(particles, wanted)
+
+    # Empty tracks (never kept) can start past the last state
+    energy = states["E"][np.minimum(offsets[:-1], len(states) - 1)] if len(states) > 0 else np.zeros(len(counts))
+    if "energy" in settings:
+        low, high = settings["energy"]
+        keep &= (energy >= low) & (energy <= high)
+
+    if "region" in settings:
+        position = states["r"]
+        low = settings["region"]["lower_left"]
+        high = settings["region"]["upper_right"]
+        inside = np.ones(len(states), dtype=bool)
+        for axis, name in enumerate(("x", "y", "z")):
+            inside &= (position[name] >= low[axis]) & (position[name] <= high[axis])
+        # A track is in the region if any of its points is. reduceat is only given the starts of
+        # tracks with points, an empty track would read the next track's first point (or past
+        # the end for the last one)
+        nonempty = counts > 0
+        in_region = np.zeros(len(counts), dtype=bool)
+        if nonempty.any():
+            in_region[nonempty] = np.add.reduceat(inside, offsets[:-1][nonempty]) > 0
+        keep &= in_region
+
+    return keep, energy
+
+
+def strata_of(particles, energy, settings):
+    """
+    Function to give each track the stratum it is subsampled in
+
+    Returns:
+        strata (array of ints)
+    """
+    stratify = settings.get("stratify", "both")
+    strata = np.zeros(len(particles), dtype=np.int64)
+    if stratify in ("particle", "both"):
+        strata += particles.astype(np.int64)
+    if stratify in ("energy", "both"):
+        bins = int(settings.get("energy_bins", 8))
+        edges = np.geomspace(1e-5, 2e7, bins + 1)[1:-1]
+        strata = strata * bins + np.searchsorted(edges, energy)
+    return strata
+
+
+def stratified_choice(strata, max_tracks, rng):
+    """
+    Function to pick max_tracks tracks, each stratum getting a share in proportion to its size
+
+    Args:
+        strata (array of ints): Stratum of each candidate track
+        max_tracks (int): Number of tracks to pick, None to keep all
+        rng (numpy.random.Generator)
+
+    Returns:
+        picked (array of bools): One per candidate track
+    """
+    picked = np.zeros(len(strata), dtype=bool)
+    if max_tracks is None or len(strata) <= max_tracks:
+        picked[:] = True
+        return picked
+
+    values, sizes = np.unique(strata, return_counts=True)
+    # Largest remainder share of max_tracks for each stratum
+    shares = sizes * max_tracks / len(strata)
+    quotas = np.floor(shares).astype(np.int64)
+    remainder = max_tracks - quotas.sum()
+    quotas[np.argsort(quotas - shares)[:remainder]] += 1
+
+    for value, quota in zip(values, quotas):
+        members = np.flatnonzero(strata == value)
+        picked[rng.choice(members, size=min(quota, len(members)), replace=False)] = True
+    return picked
+
+
+def filter_tracks(in_file, out_file, settings):
+    """
+    Function to write the tracks passing the filters, subsampled to at most max_tracks
+
+    Args:
+        in_file (string): OpenMC track file. Format: h5
+        out_file (string): Path of the filtered track file. Format: h5
+        settings (dict): "track_filter" block of the config
+
+    Returns:
+        summary (dict): format: {'tracks': n in file, 'candidates': n passing the
+            filters, 'kept': n written}
+    """
+    rng = np.random.default_rng(settings.get("seed"))
+
+    # First pass: a few numbers per candidate track
+    dataset_index = []
+    track_index = []
+    particles_all = []
+    energy_all = []
+    total = 0
+    with h5py.File(in_file, "r") as f_read:
+        names = []
+        for name, states, offsets, particles in track_datasets(f_read):
+            keep, energy = select_candidates(states, offsets, particles, settings)
+            tracks = np.flatnonzero(keep)
+            dataset_index.append(np.full(len(tracks), len(names)))
+            track_index.append(tracks)
+            particles_all.append(particles[tracks])
+            energy_all.append(energy[tracks])
+            names.append(name)
+            total += len(keep)
+
+    if len(names) == 0:
+        dataset_index = track_index = particles_all = energy_all = [np.zeros(0, dtype=np.int64)]
+    dataset_index = np.concatenate(dataset_index)
+    track_index = np.concatenate(track_index)
+    picked = stratified_choice(
+        strata_of(np.concatenate(particles_all), np.concatenate(energy_all), settings),
+        settings.get("max_tracks"),
+        rng,
+    )
+    dataset_index = dataset_index[picked]
+    track_index = track_index[picked]
+
+    # Second pass: copy the picked tracks
+    wanted = {}
+    for dataset, track in zip(dataset_index.tolist(), track_index.tolist()):
+        wanted.setdefault(names[dataset], []).append(track)
+
+    with h5py.File(in_file, "r") as f_read, h5py.File(out_file, "w") as f_write:
+        for key, value in f_read.attrs.items():
+            f_write.attrs[key] = value
+        for name, states, offsets, particles in track_datasets(f_read):
+            if name not in wanted:
+                continue
+            tracks = np.array(sorted(wanted[name]))
+            counts = np.diff(offsets)
+            point_mask = np.repeat(np.isin(np.arange(len(counts)), tracks), counts)
+            counts = counts[tracks]
+            dset = f_write.create_dataset(name, data=states[point_mask])
+            for key, value in f_read[name].attrs.items():
+                dset.attrs[key] = value
+            dset.attrs["n_particles"] = len(tracks)
+            dset.attrs["offsets"] = np.concatenate(([0], np.cumsum(counts))).astype(offsets.dtype)
+            dset.attrs["particles"] = particles[tracks]
+
+    return {"tracks": total, "candidates": len(picked), "kept": int(picked.sum())}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="track_filter.py",
+        description="Filter and subsample OpenMC tracks. Usage: track_filter.py <tracks.h5> <filtered.h5> [--config config.json]",
+    )
+    parser.add_argument("in_file", help="OpenMC track file. Format: h5")
+    parser.add_argument("out_file", help="Filtered track file. Format: h5")
+    parser.add_argument("--config", default=None, help="Workflow config with a track_filter block. Format: JSON")
+    parser.add_argument("--max-tracks", type=int, default=None, help="Most tracks to keep, overrides the config")
+
+    args = parser.parse_args()
+
+    settings = {}
+    if args.config is not None:
+        with open(args.config, "r") as read_file:
+            settings = json.load(read_file).get("track_filter", {})
+    if args.max_tracks is not None:
+        settings["max_tracks"] = args.max_tracks
+
+    summary = filter_tracks(args.in_file, args.out_file, settings)
+    print(f"Kept {summary['kept']} of {summary['tracks']} tracks ({summary['candidates']} passed the filters)")
@@ -0,0 +1,155 @@
+"""
+Benchmark of tracks_to_usd.py against the tracks_to_vtp -> vtp_obj -> obj_to_usd chain.
+
+Writes a synthetic OpenMC track file (or uses --tracks), then times each conversion as its own
+    process and records its wall time, peak memory and output size. Chain stages whose tools
+    (openmc-track-to-vtk, vtk for vtp_to_obj.py, usdzconvert) are not installed are skipped.
+
+Usage:
+    python bench_tracks_to_usd.py --particles 1000 --points 50 --output bench.json
+"""
+
+import os
+import sys
+import glob
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+
+import h5py
+import numpy as np
+
+TOOL_DIR = os.path.dirname(os.path.abspath(__file__))
+
+parser = argparse.ArgumentParser(
+    prog="bench_tracks_to_usd.py",
+    description="Benchmark tracks.h5 to USD conversion, single stage against the three tool chain",
+)
+parser.add_argument("--tracks", default=None, help="OpenMC track file to convert, default a synthetic one")
+parser.add_argument("--particles", type=int, default=1000, help="Source particles in the synthetic track file")
+parser.add_argument("--points", type=int, default=50, help="Points per track in the synthetic track file")
+parser.add_argument("--secondaries", type=int, default=2, help="Secondary tracks per source particle in the synthetic track file")
+parser.add_argument("--usdzconvert", default=shutil.which("usdzconvert") or "/home/usdzconvert/usdzconvert", help="usdzconvert executable")
+parser.add_argument("--output", default=None, help="JSON file to write the results to")
+
+args = parser.parse_args()
+
+
+def write_synthetic_tracks(file_path, particles, points, secondaries):
+    """Random walks in the layout of an OpenMC (0.13+) track file"""
+    position = np.dtype([("x", "<f8"), ("y", "<f8"), ("z", "<f8")])
+    state = np.dtype([
+        ("r", position), ("u", position), ("E", "<f8"), ("time", "<f8"), ("wgt", "<f8"),
+        ("cell_id", "<i4"), ("cell_instance", "<i4"), ("material_id", "<i4"),
+    ])
+    rng = np.random.default_rng(1)
+    tracks_per_particle = 1 + secondaries
+    with h5py.File(file_path, "w") as f_write:
+        f_write.attrs["filetype"] = np.bytes_("track")
+        f_write.attrs["version"] = np.array([3, 0])
+        for i in range(particles):
+            states = np.zeros(points * tracks_per_particle, dtype=state)
+            steps = rng.normal(0.0, 5.0, (len(states), 3)).cumsum(axis=0)
+            states["r"]["x"], states["r"]["y"], states["r"]["z"] = steps.T
+            states["E"] = np.geomspace(14.1e6, 1e-2, points).tolist() * tracks_per_particle
+            dset = f_write.create_dataset(f"track_1_1_{i + 1}", data=states)
+            dset.attrs["n_particles"] = tracks_per_particle
+            dset.attrs["offsets"] = np.arange(0, len(states) + 1, points)
+            dset.attrs["particles"] = np.array([0] + [1] * secondaries)
+
+
+def run_stage(command, cwd):
+    """
+    Returns:
+        stage (dict): format: {'seconds': wall time, 'peak_rss_mb': peak memory}, None if the
+            command failed
+    """
+    start = time.perf_counter()
+    process = subprocess.Popen(command, cwd=cwd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    _, status, usage = os.wait4(process.pid, 0)
+    seconds = time.perf_counter() - start
+    if status != 0:
+        print(f"{' '.join(command)} failed", file=sys.stderr)
+        return None
+    # ru_maxrss is in KiB on Linux
+    return {"seconds": seconds, "peak_rss_mb": usage.ru_maxrss / 1024}
+
+
+def size_mb(file_path):
+    return os.path.getsize(file_path) / 1024 ** 2
+
+
+results = {
+    "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    "python": sys.version.split()[0],
+    "platform": platform.platform(),
+    "parameters": vars(args),
+}
+
+with tempfile.TemporaryDirectory() as workdir:
+    tracks_file = os.path.join(workdir, "tracks.h5")
+    if args.tracks is not None:
+        shutil.copyfile(args.tracks, tracks_file)
+    else:
+        write_synthetic_tracks(tracks_file, args.particles, args.points, args.secondaries)
+    results["tracks_mb"] = size_mb(tracks_file)
+
+    stage = run_stage(
+        [sys.executable, os.path.join(TOOL_DIR, "tracks_to_usd.py"), "tracks.h5", "single.usd"], workdir
+    )
+    if stage is not None:
+        stage["output_mb"] = size_mb(os.path.join(workdir, "single.usd"))
+    results["tracks_to_usd"] = stage
+
+    # Each stage of the chain runs on the output of the one before, so the chain stops at the first
+    # stage that is not installed or fails
+    chain = {}
+    failed = None
+    stages = [
+        ("tracks_to_vtp", shutil.which("openmc-track-to-vtk") is not None, lambda: ["openmc-track-to-vtk", "tracks.h5"]),
+        ("vtp_obj", True, lambda: [
+            sys.executable,
+            os.path.join(TOOL_DIR, "..", "vtp_to_obj", "vtp_to_obj.py"),
+            sorted(glob.glob(os.path.join(workdir, "*.vtp")))[0],
+            os.path.join(workdir, "out.obj"),
+        ]),
+        ("obj_to_usd", os.path.exists(args.usdzconvert), lambda: [args.usdzconvert, "out.obj", "chain.usd"]),
+    ]
+    outputs = {
+        "tracks_to_vtp": lambda: sorted(glob.glob(os.path.join(workdir, "*.vtp")))[:1],
+        "vtp_obj": lambda: [os.path.join(workdir, "out.obj")],
+        "obj_to_usd": lambda: [os.path.join(workdir, "chain.usd")],
+    }
+    for name, installed, command in stages:
+        if not installed:
+            print(f"{name} is not installed, the chain stops before it", file=sys.stderr)
+            break
+        stage = run_stage(command(), workdir)
+        output_files = [file_path for file_path in outputs[name]() if os.path.exists(file_path)] if stage else []
+        if not output_files:
+            failed = name
+            print(f"Chain stage {name} failed, the chain stops there", file=sys.stderr)
+            break
+        stage["output_mb"] = size_mb(output_files[0])
+        chain[name] = stage
+
+    if len(chain) == len(stages):
+        chain["total"] = {
+            "seconds": sum(stage["seconds"] for stage in chain.values()),
+            "peak_rss_mb": max(stage["peak_rss_mb"] for stage in chain.values()),
+            "output_mb": chain["obj_to_usd"]["output_mb"],
+        }
+    else:
+        print("The conversion chain did not complete, chain results are partial", file=sys.stderr)
+    results["chain_failed_stage"] = failed
+    results["chain"] = chain
+
+output = json.dumps(results, indent=4)
+if args.output is not None:
+    with open(args.output, "w") as f_write:
+        f_write.write(output)
+print(output)
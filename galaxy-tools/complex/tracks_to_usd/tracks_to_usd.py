@@ -0,0 +1,143 @@
+"""
+Converter to go straight from an OpenMC tracks.h5 file to binary USD (usdc), replacing the
+    tracks_to_vtp -> vtp_obj -> obj_to_usd chain.
+
+Each dataset of tracks.h5 (one per source particle, holding the tracks of it and its secondaries)
+    is read whole with h5py and split into tracks with NumPy, with no per-point Python. The tracks
+    of each particle type are written as one linear UsdGeom.BasisCurves prim, /Tracks/<type>, with
+    a constant width and the particle energy at every point as an "energy" primvar, so the viewer
+    draws them as tubes without tessellated geometry in the file.
+
+Usage: tracks_to_usd.py <tracks.h5> <out.usd> [--width 2.0]
+"""
+
+import os
+import argparse
+
+import h5py
+import numpy as np
+from pxr import Gf, Sdf, Usd, UsdGeom, Vt
+
+# openmc.ParticleType values and the colour tracks of each type are shown in
+PARTICLE_TYPES = {
+    0: ("neutron", (0.2, 0.4, 1.0)),
+    1: ("photon", (1.0, 0.8, 0.1)),
+    2: ("electron", (0.9, 0.2, 0.2)),
+    3: ("positron", (0.2, 0.9, 0.3)),
+}
+
+
+def read_tracks(in_file):
+    """
+    Function to read every track of an OpenMC track file, grouped by particle type
+
+    Args:
+        in_file (string): OpenMC track file. Format: h5
+
+    Returns:
+        tracks (dict): format: {particle type: {'points': (n, 3) array,
+            'energy': (n,) array, 'counts': points per track}}
+    """
+    states = []
+    counts = []
+    particles = []
+    state_dtype = None
+    with h5py.File(in_file, "r") as f_read:
+        for name in f_read:
+            if not name.startswith("track_"):
+                continue
+            dset = f_read[name]
+            # Every dataset has the same compound type, reading into an array of it directly
+            # skips working the type out again for each of the (many) small datasets
+            if state_dtype is None:
+                state_dtype = dset.dtype
+            dset_states = np.empty(dset.shape, dtype=state_dtype)
+            dset.id.read(h5py.h5s.ALL, h5py.h5s.ALL, dset_states)
+            states.append(dset_states)
+            counts.append(np.diff(dset.attrs["offsets"]))
+            particles.append(dset.attrs["particles"])
+
+    if len(states) == 0:
+        return {}
+    states = np.concatenate(states)
+    counts = np.concatenate(counts).astype(np.int64)
+    particles = np.concatenate(particles).astype(np.int64)
+
+    position = states["r"]
+    points = np.column_stack((position["x"], position["y"], position["z"])).astype(np.float32)
+    energy = states["E"].astype(np.float32)
+
+    tracks = {}
+    for particle in np.unique(particles):
+        # A curve needs at least two points
+        keep_tracks = (particles == particle) & (counts > 1)
+        if not keep_tracks.any():
+            continue
+        keep_points = np.repeat(keep_tracks, counts)
+        tracks[int(particle)] = {
+            "points": points[keep_points],
+            "energy": energy[keep_points],
+            "counts": counts[keep_tracks],
+        }
+    return tracks
+
+
+def write_usd(tracks, out_file, width):
+    """
+    Function to write the tracks as one BasisCurves prim per particle type
+
+    Args:
+        tracks (dict): From read_tracks
+        out_file (string): Path of the USD file, written as usdc
+        width (float): Width of the drawn tracks in cm
+    """
+    # USD picks the file format from the extension, Galaxy dataset paths end in .dat
+    usd_file = out_file if os.path.splitext(out_file)[1] in (".usd", ".usdc") else out_file + ".usd"
+    layer = Sdf.Layer.CreateNew(usd_file, args={"format": "usdc"})
+    stage = Usd.Stage.Open(layer)
+    UsdGeom.SetStageUpAxis(stage, UsdGeom.Tokens.z)
+    # OpenMC positions are in cm
+    UsdGeom.SetStageMetersPerUnit(stage, 0.01)
+
+    root = UsdGeom.Xform.Define(stage, "/Tracks")
+    stage.SetDefaultPrim(root.GetPrim())
+
+    for particle, part in sorted(tracks.items()):
+        name, colour = PARTICLE_TYPES.get(particle, (f"particle_{particle}", (0.8, 0.8, 0.8)))
+        curves = UsdGeom.BasisCurves.Define(stage, f"/Tracks/{name}")
+        curves.CreateTypeAttr(UsdGeom.Tokens.linear)
+        curves.CreatePointsAttr(Vt.Vec3fArray.FromNumpy(part["points"]))
+        curves.CreateCurveVertexCountsAttr(Vt.IntArray.FromNumpy(part["counts"].astype(np.int32)))
+        curves.CreateWidthsAttr(Vt.FloatArray([width]))
+        curves.SetWidthsInterpolation(UsdGeom.Tokens.constant)
+        curves.CreateDisplayColorAttr(Vt.Vec3fArray([Gf.Vec3f(*colour)]))
+        curves.CreateExtentAttr(Vt.Vec3fArray([
+            Gf.Vec3f(*(part["points"].min(axis=0) - width / 2).tolist()),
+            Gf.Vec3f(*(part["points"].max(axis=0) + width / 2).tolist()),
+        ]))
+        UsdGeom.PrimvarsAPI(curves).CreatePrimvar(
+            "energy", Sdf.ValueTypeNames.FloatArray, UsdGeom.Tokens.vertex
+        ).Set(Vt.FloatArray.FromNumpy(part["energy"]))
+
+    layer.Save()
+    if usd_file != out_file:
+        os.replace(usd_file, out_file)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="tracks_to_usd.py",
+        description="Converter to go from an OpenMC tracks.h5 file to USD. Usage: tracks_to_usd.py <tracks.h5> <out.usd>",
+    )
+    parser.add_argument("in_file", help="OpenMC track file. Format: h5")
+    parser.add_argument("out_file", help="USD output file, written as binary usdc")
+    parser.add_argument("--width", type=float, default=2.0, help="Width of the drawn tracks in cm")
+
+    args = parser.parse_args()
+
+    tracks = read_tracks(args.in_file)
+    write_usd(tracks, args.out_file, args.width)
+
+    for particle, part in sorted(tracks.items()):
+        name = PARTICLE_TYPES.get(particle, (f"particle_{particle}",))[0]
+        print(f"{name}: {len(part['counts'])} tracks, {len(part['points'])} points")
@@ -0,0 +1,100 @@
+"""
+Benchmark of tracks_to_vtp.py throughput against the number of worker processes, on synthetic
+    random walk tracks split over several per rank track files.
+
+Usage:
+    python bench_tracks_to_vtp.py --files 4 --particles 5000 --workers 1 2 4 8 --output bench.json
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import subprocess
+
+import h5py
+import numpy as np
+
+TOOL_DIR = os.path.dirname(os.path.abspath(__file__))
+
+parser = argparse.ArgumentParser(
+    prog="bench_tracks_to_vtp.py",
+    description="Benchmark tracks_to_vtp.py against the number of worker processes",
+)
+parser.add_argument("--files", type=int, default=4, help="Track files, as written by that many MPI ranks")
+parser.add_argument("--particles", type=int, default=5000, help="Source particles in each track file")
+parser.add_argument("--points", type=int, default=50, help="Points in each track")
+parser.add_argument("--secondaries", type=int, default=3, help="Secondary tracks of each source particle")
+parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8], help="Worker processes to test")
+parser.add_argument("--output", default=None, help="JSON file to write the results to")
+
+args = parser.parse_args()
+
+
+def write_synthetic_tracks(file_path, particles, points, secondaries, seed):
+    """Random walks in the layout of an OpenMC (0.13+) track file"""
+    position = np.dtype([("x", "<f8"), ("y", "<f8"), ("z", "<f8")])
+    state = np.dtype([
+        ("r", position), ("u", position), ("E", "<f8"), ("time", "<f8"), ("wgt", "<f8"),
+        ("cell_id", "<i4"), ("cell_instance", "<i4"), ("material_id", "<i4"),
+    ])
+    rng = np.random.default_rng(seed)
+    tracks_per_particle = 1 + secondaries
+    with h5py.File(file_path, "w") as f_write:
+        f_write.attrs["filetype"] = np.bytes_("track")
+        f_write.attrs["version"] = np.array([3, 0])
+        for i in range(particles):
+            states = np.zeros(points * tracks_per_particle, dtype=state)
+            steps = rng.normal(0.0, 5.0, (len(states), 3)).cumsum(axis=0)
+            states["r"]["x"], states["r"]["y"], states["r"]["z"] = steps.T
+            states["E"] = np.geomspace(14.1e6, 1e-2, points).tolist() * tracks_per_particle
+            dset = f_write.create_dataset(f"track_1_1_{seed * particles + i + 1}", data=states)
+            dset.attrs["n_particles"] = tracks_per_particle
+            dset.attrs["offsets"] = np.arange(0, len(states) + 1, points)
+            dset.attrs["particles"] = np.array([0] + [1] * secondaries)
+
+
+results = {
+    "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    "python": sys.version.split()[0],
+    "platform": platform.platform(),
+    "cpus": os.cpu_count(),
+    "parameters": vars(args),
+    "runs": [],
+}
+
+with tempfile.TemporaryDirectory() as workdir:
+    track_files = []
+    for rank in range(args.files):
+        track_files.append(os.path.join(workdir, f"tracks_p{rank}.h5"))
+        write_synthetic_tracks(track_files[-1], args.particles, args.points, args.secondaries, rank)
+    tracks = args.files * args.particles * (1 + args.secondaries)
+
+    for workers in args.workers:
+        out_file = os.path.join(workdir, "tracks.vtp")
+        start = time.perf_counter()
+        status = subprocess.call(
+            [sys.executable, os.path.join(TOOL_DIR, "tracks_to_vtp.py"), out_file, *track_files, "--workers", str(workers)],
+            stdout=subprocess.DEVNULL,
+        )
+        seconds = time.perf_counter() - start
+        run = {
+            "workers": workers,
+            "ok": status == 0,
+            "seconds": seconds,
+            "tracks_per_s": tracks / seconds,
+            "speedup": None,
+        }
+        if results["runs"] and results["runs"][0]["ok"]:
+            run["speedup"] = results["runs"][0]["seconds"] / seconds
+        results["runs"].append(run)
+        print(f"{workers:3d} workers: {seconds:6.2f}s, {run['tracks_per_s']:10.0f} tracks/s", flush=True)
+
+output = json.dumps(results, indent=4)
+if args.output is not None:
+    with open(args.output, "w") as f_write:
+        f_write.write(output)
+print(output)
@@ -0,0 +1,198 @@
+"""
+Converter from OpenMC track files to vtp polylines, using every core given to it.
+
+openmc-track-to-vtk builds the lines point by point in Python and the tool kept only tracks_0.vtp,
+    dropping the other files of runs writing one track file per MPI rank. Here every dataset
+    (source particle) of every track file given is read with h5py and turned into line arrays
+    by a pool of worker processes, a part of the datasets each. The parts are merged into one
+    vtp, or one vtp per track file with --split, with the particle energy as point data and the
+    particle type as cell data.
+
+Usage: tracks_to_vtp.py <out.vtp> <tracks.h5> [<tracks_p1.h5> ...] [--workers n] [--split dir [--names name ...]]
+"""
+
+import os
+import argparse
+import multiprocessing
+
+import h5py
+import numpy as np
+from vtkmodules.util.numpy_support import numpy_to_vtk, numpy_to_vtkIdTypeArray
+from vtkmodules.vtkCommonCore import vtkPoints
+from vtkmodules.vtkCommonDataModel import vtkCellArray, vtkPolyData
+from vtkmodules.vtkIOXML import vtkXMLPolyDataWriter
+
+parser = argparse.ArgumentParser(
+    prog="tracks_to_vtp.py",
+    description="Converter from OpenMC track files to vtp. Usage: tracks_to_vtp.py <out.vtp> <tracks.h5> [<tracks.h5> ...]",
+)
+parser.add_argument("out_file", help="Merged tracks of every file. Format: vtp")
+parser.add_argument("in_files", nargs="+", help="OpenMC track files, e.g. tracks.h5 or tracks_p*.h5 of each rank. Format: h5")
+parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Worker processes reading the track files")
+parser.add_argument("--split", default=None, help="Write one vtp per track file into this directory instead of merging")
+parser.add_argument("--names", nargs="+", default=None, help="Names of the vtp files of --split, one per track file, default the track file names")
+parser.add_argument("--parts-per-worker", type=int, default=4, help="Parts the datasets of each worker are split into, to balance the load")
+
+
+def plan_parts(in_files, n_parts):
+    """
+    Function to split the datasets of the track files into parts for the workers
+
+    Parts hold about the same number of datasets, only the names are read here since opening
+        every dataset for its size costs about as much as reading it. Many more parts than
+        workers evens out datasets of different sizes.
+
+    Args:
+        in_files (array of strings): OpenMC track files. Format: h5
+        n_parts (int): Number of parts to aim for
+
+    Returns:
+        parts (array of tuples): format: (file index, in_file, [dataset names]), in file order
+    """
+    names = []
+    for in_file in in_files:
+        with h5py.File(in_file, "r") as f_read:
+            names.append([name for name in f_read if name.startswith("track_")])
+
+    per_part = max(1, -(-sum(len(file_names) for file_names in names) // max(1, n_parts)))
+    parts = []
+    for i, (in_file, file_names) in enumerate(zip(in_files, names)):
+        # A part never spans two files, so --split can tell them apart
+        for start in range(0, len(file_names), per_part):
+            parts.append((i, in_file, file_names[start:start + per_part]))
+    return parts
+
+
+def read_part(part):
+    """
+    Function to read some datasets of a track file into line arrays, run by the workers
+
+    Args:
+        part (tuple): From plan_parts
+
+    Returns:
+        file_index (int): Index of the track file the part is from
+        points (array): shape (n, 3)
+        energy (array): Energy at each point
+        counts (array): Points in each track
+        particles (array): Particle type of each track
+    """
+    file_index, in_file, names = part
+    states = []
+    counts = []
+    particles = []
+    with h5py.File(in_file, "r") as f_read:
+        state_dtype = f_read[names[0]].dtype
+        for name in names:
+            dset = f_read[name]
+            # Reading into an array of the shared type skips working it out for every dataset
+            dset_states = np.empty(dset.shape, dtype=state_dtype)
+            dset.id.read(h5py.h5s.ALL, h5py.h5s.ALL, dset_states)
+            states.append(dset_states)
+            counts.append(np.diff(dset.attrs["offsets"]))
+            particles.append(dset.attrs["particles"])
+
+    states = np.concatenate(states)
+    counts = np.concatenate(counts).astype(np.int64)
+    particles = np.concatenate(particles).astype(np.int32)
+
+    # A line needs at least two points
+    keep_tracks = counts > 1
+    keep_points = np.repeat(keep_tracks, counts)
+    position = states["r"][keep_points]
+    return (
+        file_index,
+        np.column_stack((position["x"], position["y"], position["z"])),
+        states["E"][keep_points],
+        counts[keep_tracks],
+        particles[keep_tracks],
+    )
+
+
+def write_vtp(out_file, parts):
+    """
+    Function to merge read parts into one polyline vtp
+
+    Args:
+        out_file (string): Path of the vtp file
+        parts (array of tuples): From read_part
+
+    Returns:
+        n_tracks (int): Number of lines written
+        n_points (int): Number of points written
+    """
+    points = np.concatenate([part[1] for part in parts]) if parts else np.zeros((0, 3))
+    energy = np.concatenate([part[2] for part in parts]) if parts else np.zeros(0)
+    counts = np.concatenate([part[3] for part in parts]) if parts else np.zeros(0, dtype=np.int64)
+    particles = np.concatenate([part[4] for part in parts]) if parts else np.zeros(0, dtype=np.int32)
+
+    vtk_points = vtkPoints()
+    vtk_points.SetData(numpy_to_vtk(points, deep=True))
+    lines = vtkCellArray()
+    lines.SetData(
+        numpy_to_vtkIdTypeArray(np.concatenate(([0], np.cumsum(counts))).astype(np.int64), deep=True),
+        numpy_to_vtkIdTypeArray(np.arange(len(points), dtype=np.int64), deep=True),
+    )
+    poly_data = vtkPolyData()
+    poly_data.SetPoints(vtk_points)
+    poly_data.SetLines(lines)
+
+    energy_array = numpy_to_vtk(energy, deep=True)
+    energy_array.SetName("energy")
+    poly_data.GetPointData().AddArray(energy_array)
+    particle_array = numpy_to_vtk(particles, deep=True)
+    particle_array.SetName("particle")
+    poly_data.GetCellData().AddArray(particle_array)
+
+    writer = vtkXMLPolyDataWriter()
+    writer.SetFileName(out_file)
+    # LZ4 writes several times faster than the default zlib for a slightly bigger file
+    writer.SetCompressorTypeToLZ4()
+    writer.SetInputData(poly_data)
+    writer.Write()
+    return len(counts), len(points)
+
+
+def split_names(names):
+    """
+    Function to turn the names of the track files into unique vtp file names for --split
+
+    Args:
+        names (array of strings): Name of each track file, e.g. Galaxy dataset names
+
+    Returns:
+        file_names (array of strings): Names without path separators, repeated names numbered
+    """
+    cleaned = [name.replace(os.sep, "_").replace("/", "_").strip() or "tracks" for name in names]
+    repeats = {name: cleaned.count(name) > 1 for name in cleaned}
+    seen = {}
+    file_names = []
+    for name in cleaned:
+        seen[name] = seen.get(name, 0) + 1
+        file_names.append(f"{name}_{seen[name]}" if repeats[name] else name)
+    return file_names
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    workers = max(1, args.workers)
+    if args.names is not None and len(args.names) != len(args.in_files):
+        parser.error(f"--names gives {len(args.names)} names for {len(args.in_files)} track files")
+
+    parts = plan_parts(args.in_files, workers * args.parts_per_worker)
+    if workers == 1:
+        read = [read_part(part) for part in parts]
+    else:
+        with multiprocessing.Pool(workers) as pool:
+            read = pool.map(read_part, parts)
+
+    if args.split is None:
+        n_tracks, n_points = write_vtp(args.out_file, read)
+        print(f"Wrote {n_tracks} tracks ({n_points} points) from {len(args.in_files)} track files to {args.out_file}")
+    else:
+        os.makedirs(args.split, exist_ok=True)
+        names = args.names or [os.path.splitext(os.path.basename(in_file))[0] for in_file in args.in_files]
+        for i, (in_file, name) in enumerate(zip(args.in_files, split_names(names))):
+            out_file = os.path.join(args.split, f"{name}.vtp")
+            n_tracks, n_points = write_vtp(out_file, [part for part in read if part[0] == i])
+            print(f"Wrote {n_tracks} tracks ({n_points} points) from {in_file} to {out_file}")
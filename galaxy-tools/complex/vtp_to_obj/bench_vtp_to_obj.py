@@ -0,0 +1,106 @@
+"""
+Benchmark of vtp_to_obj.py conversion time, peak memory and output size against the number of
+    track segments, on synthetic random walk tracks.
+
+Usage:
+    python bench_vtp_to_obj.py --segments 100000 1000000 --sides 3 6 --output bench.json
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import subprocess
+
+import numpy as np
+from vtkmodules.util.numpy_support import numpy_to_vtk, numpy_to_vtkIdTypeArray
+from vtkmodules.vtkCommonCore import vtkPoints
+from vtkmodules.vtkCommonDataModel import vtkCellArray, vtkPolyData
+from vtkmodules.vtkIOXML import vtkXMLPolyDataWriter
+
+TOOL_DIR = os.path.dirname(os.path.abspath(__file__))
+
+parser = argparse.ArgumentParser(
+    prog="bench_vtp_to_obj.py",
+    description="Benchmark vtp_to_obj.py against the number of track segments",
+)
+parser.add_argument("--segments", type=int, nargs="+", default=[100000, 1000000], help="Track segments to convert")
+parser.add_argument("--segments-per-track", type=int, default=20, help="Segments in each synthetic track")
+parser.add_argument("--sides", type=int, nargs="+", default=[3], help="Tube sides to test")
+parser.add_argument("--output", default=None, help="JSON file to write the results to")
+
+args = parser.parse_args()
+
+
+def write_tracks_vtp(file_path, segments, segments_per_track):
+    """Random walk polylines with the given total number of segments"""
+    tracks = max(1, segments // segments_per_track)
+    points_per_track = segments_per_track + 1
+    rng = np.random.default_rng(1)
+    points = rng.normal(0.0, 5.0, (tracks, points_per_track, 3)).cumsum(axis=1).reshape(-1, 3)
+
+    vtk_points = vtkPoints()
+    vtk_points.SetData(numpy_to_vtk(points, deep=True))
+    lines = vtkCellArray()
+    lines.SetData(
+        numpy_to_vtkIdTypeArray(np.arange(0, len(points) + 1, points_per_track, dtype=np.int64), deep=True),
+        numpy_to_vtkIdTypeArray(np.arange(len(points), dtype=np.int64), deep=True),
+    )
+    poly_data = vtkPolyData()
+    poly_data.SetPoints(vtk_points)
+    poly_data.SetLines(lines)
+
+    writer = vtkXMLPolyDataWriter()
+    writer.SetFileName(file_path)
+    writer.SetInputData(poly_data)
+    writer.Write()
+    return tracks * segments_per_track
+
+
+results = {
+    "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    "python": sys.version.split()[0],
+    "platform": platform.platform(),
+    "parameters": vars(args),
+    "runs": [],
+}
+
+with tempfile.TemporaryDirectory() as workdir:
+    for segments in args.segments:
+        vtp_file = os.path.join(workdir, f"tracks_{segments}.vtp")
+        written = write_tracks_vtp(vtp_file, segments, args.segments_per_track)
+        for sides in args.sides:
+            obj_file = os.path.join(workdir, "out.obj")
+            start = time.perf_counter()
+            process = subprocess.Popen(
+                [sys.executable, os.path.join(TOOL_DIR, "vtp_to_obj.py"), vtp_file, obj_file, "--sides", str(sides)],
+                stdout=subprocess.DEVNULL,
+            )
+            _, status, usage = os.wait4(process.pid, 0)
+            seconds = time.perf_counter() - start
+            run = {
+                "segments": written,
+                "sides": sides,
+                "ok": status == 0,
+                "seconds": seconds,
+                "segments_per_s": written / seconds,
+                # ru_maxrss is in KiB on Linux
+                "peak_rss_mb": usage.ru_maxrss / 1024,
+                "vtp_mb": os.path.getsize(vtp_file) / 1024 ** 2,
+                "obj_mb": os.path.getsize(obj_file) / 1024 ** 2 if status == 0 else None,
+            }
+            results["runs"].append(run)
+            print(
+                f"{written:9d} segments, {sides} sides: {seconds:6.2f}s, "
+                f"{run['peak_rss_mb']:7.1f} MB peak, {run['obj_mb'] or 0:8.1f} MB obj",
+                flush=True,
+            )
+
+output = json.dumps(results, indent=4)
+if args.output is not None:
+    with open(args.output, "w") as f_write:
+        f_write.write(output)
+print(output)
@@ -1,6 +1,23 @@
-import vtk as vtk
+"""
+Converter to go from vtp track lines to an obj tube mesh.
+
+Only geometry modules of VTK are loaded (no renderer, render window or OpenGL context), so it
+    runs on headless nodes. The lines are turned into tubes and written to the obj file a chunk
+    of lines at a time, so memory use is set by --chunk-segments rather than by the size of the
+    whole tube mesh.
+
+Usage: vtp_to_obj.py <input.vtp> <output.obj> [--sides 3] [--radius 0.5] [--chunk-segments 50000]
+"""
+
 import argparse
 
+import numpy as np
+from vtkmodules.util.numpy_support import numpy_to_vtk, numpy_to_vtkIdTypeArray, vtk_to_numpy
+from vtkmodules.vtkCommonCore import vtkPoints
+from vtkmodules.vtkCommonDataModel import vtkCellArray, vtkPolyData
+from vtkmodules.vtkFiltersCore import vtkTriangleFilter, vtkTubeFilter
+from vtkmodules.vtkIOXML import vtkXMLPolyDataReader
+
 parser = argparse.ArgumentParser(
     prog='vtp_to_obj.py',
     description = 'Converter to go from vtp to obj file format. Usage: vtp_to_obj.py <input.vtp> <output.obj>'
@@ -8,36 +25,120 @@ parser = argparse.ArgumentParser(
 
 parser.add_argument('in_file', help='.vtp input file')
 parser.add_argument('out_file', help='.obj output file')
+parser.add_argument('--sides', type=int, default=3, help='Number of sides of each tube')
+parser.add_argument('--radius', type=float, default=0.5, help='Radius of the tubes, in the units of the vtp')
+parser.add_argument('--chunk-segments', type=int, default=50000, help='Line segments turned into tubes and written at a time')
+parser.add_argument('--no-normals', action='store_true', help='Do not write vertex normals')
+
+
+def read_lines(in_file):
+    """
+    Function to read the points and polylines of a vtp file
+
+    Returns:
+        points (array): shape (n, 3)
+        offsets (array): Start of each line in connectivity, with the end of the last line
+        connectivity (array): Point indices of every line, one after the other
+    """
+    reader = vtkXMLPolyDataReader()
+    reader.SetFileName(in_file)
+    reader.Update()
+    poly_data = reader.GetOutput()
+
+    lines = poly_data.GetLines()
+    return (
+        vtk_to_numpy(poly_data.GetPoints().GetData()),
+        vtk_to_numpy(lines.GetOffsetsArray()).astype(np.int64),
+        vtk_to_numpy(lines.GetConnectivityArray()).astype(np.int64),
+    )
+
+
+def tube_chunk(points, offsets, connectivity, sides, radius):
+    """
+    Function to turn some of the lines into a triangulated tube mesh
+
+    Args:
+        points (array): Points of the whole file
+        offsets (array): Offsets of the lines in the chunk, into connectivity
+        connectivity (array): Point indices of the lines in the chunk
+        sides (int): Number of sides of each tube
+        radius (float): Radius of the tubes
+
+    Returns:
+        vertices (array): shape (n, 3)
+        normals (array): shape (n, 3)
+        triangles (array): shape (m, 3), indices into vertices
+    """
+    # Only the points used by this chunk go into the tube filter
+    used, local = np.unique(connectivity, return_inverse=True)
+
+    vtk_points = vtkPoints()
+    vtk_points.SetData(numpy_to_vtk(np.ascontiguousarray(points[used]), deep=True))
+    cells = vtkCellArray()
+    cells.SetData(
+        numpy_to_vtkIdTypeArray(offsets - offsets[0], deep=True),
+        numpy_to_vtkIdTypeArray(local.astype(np.int64), deep=True),
+    )
+    chunk = vtkPolyData()
+    chunk.SetPoints(vtk_points)
+    chunk.SetLines(cells)
 
-args = parser.parse_args()
+    tubes = vtkTubeFilter()
+    tubes.SetInputData(chunk)
+    tubes.SetNumberOfSides(sides)
+    tubes.SetRadius(radius)
 
-in_file = args.in_file
-out_file = args.out_file
+    triangles = vtkTriangleFilter()
+    triangles.SetInputConnection(tubes.GetOutputPort())
+    triangles.Update()
+    mesh = triangles.GetOutput()
 
-reader = vtk.vtkXMLPolyDataReader();
-reader.SetFileName(in_file)
+    return (
+        vtk_to_numpy(mesh.GetPoints().GetData()),
+        vtk_to_numpy(mesh.GetPointData().GetNormals()),
+        vtk_to_numpy(mesh.GetPolys().GetConnectivityArray()).reshape(-1, 3),
+    )
 
-tubes = vtk.vtkTubeFilter();
-tubes.SetInputConnection(reader.GetOutputPort());
 
-ren = vtk.vtkRenderer()
-renWin = vtk.vtkRenderWindow()
-renWin.AddRenderer(ren)
+def write_rows(write_file, row_format, rows, block=50000):
+    """Write the rows of an array, formatting a block of rows at a time instead of one by one"""
+    for start in range(0, len(rows), block):
+        part = rows[start:start + block]
+        write_file.write((row_format * len(part)) % tuple(part.ravel().tolist()))
 
-iren = vtk.vtkRenderWindowInteractor()
-iren.SetRenderWindow(renWin)
 
-profileMapper = vtk.vtkPolyDataMapper()
-profileMapper.SetInputConnection(tubes.GetOutputPort())
+if __name__ == '__main__':
+    args = parser.parse_args()
 
-profile = vtk.vtkActor() 
-profile.SetMapper(profileMapper) 
-profile.GetProperty().SetSpecular(.3) 
-profile.GetProperty().SetSpecularPower(30) 
+    points, offsets, connectivity = read_lines(args.in_file)
+    n_lines = len(offsets) - 1
 
-ren.AddActor(profile)
+    face_format = 'f %d %d %d\n' if args.no_normals else 'f %d//%d %d//%d %d//%d\n'
+    # obj indices start at 1 and count every vertex written before
+    base = 1
+    n_triangles = 0
+    with open(args.out_file, 'w') as write_file:
+        # Split the lines into chunks of about chunk_segments segments, a line of n points has
+        # n - 1 segments so offsets[i] - i segments come before line i
+        chunk_of_line = (offsets[:-1] - np.arange(n_lines)) // args.chunk_segments
+        bounds = np.concatenate(([0], np.flatnonzero(np.diff(chunk_of_line)) + 1, [n_lines]))
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            if start == end:
+                continue
+            vertices, normals, triangles = tube_chunk(
+                points,
+                offsets[start:end + 1],
+                connectivity[offsets[start]:offsets[end]],
+                args.sides,
+                args.radius,
+            )
+            write_rows(write_file, 'v %.6g %.6g %.6g\n', vertices)
+            faces = triangles + base
+            if not args.no_normals:
+                write_rows(write_file, 'vn %.4f %.4f %.4f\n', normals)
+                faces = np.repeat(faces, 2, axis=1)
+            write_rows(write_file, face_format, faces)
+            base += len(vertices)
+            n_triangles += len(triangles)
 
-writer = vtk.vtkOBJExporter()
-writer.SetFilePrefix(out_file.replace('.obj', ''))
-writer.SetInput(renWin)
-writer.Write()
\ No newline at end of file
+    print(f"Wrote {n_lines} lines ({len(connectivity) - n_lines} segments) as {base - 1} vertices and {n_triangles} triangles")
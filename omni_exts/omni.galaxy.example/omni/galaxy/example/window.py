@@ -21,7 +21,11 @@ api_path = os.path.join(parent_path, "galaxy-api")
 data_path = os.path.join(parent_path, "omni-data")
 sys.path.append(api_path)
 
-from helper_functs import launch_workflow, get_workflows, get_inputs, get_outputs # pylint: disable=import-error
+from helper_functs import launch_workflow_async, get_workflows, get_inputs, get_outputs, set_cache_dir, WorkflowFailedError # pylint: disable=import-error
+
+# Keep the workflow metadata between sessions so the inputs / outputs do not
+# need to be fetched from galaxy again on every start
+set_cache_dir(os.path.join(data_path, ".cache"))
 
 LABEL_WIDTH = 50
 HEIGHT = 300
@@ -43,6 +47,7 @@ else:
         "selected_folder_idx": 0,
         "selected_file_idx": 0,
         "local_file_selector": 0,
+        "download_outputs": "",
     }
 
 
@@ -54,13 +59,6 @@ collapsible_frames_default = {
 }
 
 
-def fire_and_forget(f):
-    '''To wrap a function for a fire and forget call.'''
-    def wrapped(*args, **kwargs):
-        return asyncio.get_event_loop().run_in_executor(None, f, *args, *kwargs)
-    return wrapped
-
-
 class Window(ui.Window):
     """The class that represents the window"""
 
@@ -235,6 +233,11 @@ class Window(ui.Window):
                 ui.ComboBox(self.settings["local_file_selector"])
                 ui.Button("Select File", clicked_fn=lambda: self._get_fname_from_explorer())
 
+        with ui.HStack(height=0, spacing=SPACING):
+            ui.Label("Outputs to save (comma separated, empty for all):")
+            self.settings["download_outputs"] = ui.StringField().model
+            self.settings["download_outputs"].set_value(default.get("download_outputs", ""))
+
         # Only want launch_workflow when we have the inputs
         ui.Button("Launch Workflow", clicked_fn=lambda: self._launch_workflow())
 
@@ -353,9 +356,14 @@ class Window(ui.Window):
             value = self.settings["workflow_inputs"][input_name].get_value_as_string()
             inputs[input_name] = value
 
+        outputs = [
+            name.strip()
+            for name in self.settings["download_outputs"].get_value_as_string().split(",")
+            if name.strip()
+        ]
+
         self._new_print(f"Launching workflow {workflow} with inputs {inputs}")
-        self._async_launch(server, api_key, workflow, inputs)
-        self._new_print("Workflow launched")
+        asyncio.ensure_future(self._async_launch(server, api_key, workflow, inputs, outputs or None))
 
     def _new_print(self, console_text):
         self.output_prev_commands += f"{console_text}\n"
@@ -402,6 +410,21 @@ class Window(ui.Window):
             with open(file_path) as f_read:
                 data = f_read.read()
                 self._new_print(f"File {file} from {uid}:\n{data}")
+        elif ext == ".npz":
+            import numpy as np
+            lines = []
+            with np.load(file_path, allow_pickle=False) as data:
+                for key in data.files:
+                    if not key.endswith("/mean"):
+                        continue
+                    tally = key[:-len("/mean")]
+                    mean = data[key].reshape(-1)
+                    std_dev = data[f"{tally}/std_dev"].reshape(-1)
+                    lines.append(f"{tally}: " + ", ".join(
+                        f"{m:.5g} +/- {s:.3g}" for m, s in zip(mean[:10], std_dev[:10])
+                    ) + (f" ... ({len(mean)} values)" if len(mean) > 10 else ""))
+            nice_string = "\n".join(lines)
+            self._new_print(f"File {file} from {uid}:\n{nice_string}")
         elif 'usd' in ext:
             carb.log_info(f"Opening {file_path}")
             import_USD(file_path)
@@ -413,25 +436,36 @@ class Window(ui.Window):
         for uid in os.listdir(data_path):
             shutil.rmtree(data_path + os.sep + uid)
 
-    @fire_and_forget
-    def _async_launch(self, server, api_key, workflow, inputs):
+    async def _async_launch(self, server, api_key, workflow, inputs, outputs=None):
         uid = str(uuid.uuid4())
-        tempdir = launch_workflow(server, api_key, workflow, inputs, uid, True)
+        handle = await launch_workflow_async(server, api_key, workflow, inputs, uid, outputs=outputs)
 
-        self._new_print(f"Workflow {workflow} finished, saving outputs to: {data_path + os.sep + uid}")
+        if handle is False:
+            self._new_print(f"Workflow {workflow} failed to launch")
+            return
+
+        if handle.cached:
+            self._new_print(f"Workflow {workflow} already run with these inputs, outputs are in: {handle.output_dir}")
+            for file in handle.files:
+                self._new_print(f"Saved file: {file}")
+            return
 
-        if not os.path.exists(data_path):
-            os.mkdir(data_path)
+        self._new_print(f"Workflow launched, invocation: {handle.invocation_id}")
 
-        os.mkdir(data_path + os.sep + uid)
+        try:
+            async for event in handle.events():
+                self._new_print(f"Step {event['label']}: {event['state']}")
+        except WorkflowFailedError as e:
+            self._new_print(f"Workflow {workflow} failed: {e}")
+            return
+
+        self._new_print(f"Workflow {workflow} finished, saving outputs to: {data_path + os.sep + uid}")
 
-        for file_name in os.listdir(tempdir.name):
-            file = tempdir.name + os.sep + file_name
+        files = await handle.download_outputs(data_path + os.sep + uid, outputs=outputs, delete_history=True)
+        for file in files:
             self._new_print(f"Saving file: {file}")
-            shutil.move(file, data_path + os.sep + uid + os.sep + file_name)
 
         add_uid_to_prov(uid, workflow)
-        tempdir.cleanup()
         self._new_print(f'Workflow call finished.')
 
     def _get_fname_from_explorer(self):